@@ -9,17 +9,34 @@ usage="Usage: $(basename "$0")
 	--hgvsc	[hgvsc]			    input HGVSC
 	--regions [regions]		    regions to slice input on
     --convert                   flag to run conversion only, not annotation
+    --resume                    skip steps already completed with the same input in a previous run in the output folder
+    --variant-cache [dir]       per-variant annotation cache, only uncached variants are annotated (default: \$VARIANT_CACHE_DIR)
+    --stream                    connect the steps from REMOVE_STAR_ALLELES to VCFSORT through pipes, only writing the output
+                                of the last step to disk (default: \$STREAM_PIPELINE or 0)
+    --keep-intermediate         with --stream, also write the output of every streamed step (for debugging)
+    --bgzip                     also write the final output as BGZF compressed, tabix indexed output.vcf.gz, and compress
+                                the intermediate step outputs when done (default: \$BGZIP_OUTPUT or 0)
 	-o|--outfolder [outfolder]	output folder (default: working directory)
     -p|--processes              number of cores to use for time-consuming annotation steps (default number of cores available)
+    --shards [n]                split input in n shards for VEP and vcfanno (default: \$NUM_SHARDS or 1)
+    --shard-jobs [n]            number of shards to annotate concurrently (default: number of shards). The cores given by
+                                --processes are divided between the concurrent shards
 
 "
 
 # Parse arguments
 WORKDIR=${PWD}
 CONVERT_ONLY=0
+RESUME=0
+VARIANT_CACHE_DIR=${VARIANT_CACHE_DIR:-}
+STREAM_PIPELINE=${STREAM_PIPELINE:-0}
+KEEP_INTERMEDIATE=${KEEP_INTERMEDIATE:-0}
+BGZIP_OUTPUT=${BGZIP_OUTPUT:-0}
 NUM_VEP_PROCESSES=${NUM_VEP_PROCESSES:-$(nproc)}
 NUM_VCFANNO_PROCESSES=${NUM_VCFANNO_PROCESSES:-$(nproc)}
 VEP_BUFFER_SIZE=${VEP_BUFFER_SIZE:-5000}
+NUM_SHARDS=${NUM_SHARDS:-1}
+NUM_SHARD_JOBS=${NUM_SHARD_JOBS:-}
 while [[ $# -gt 0 ]]; do
     case "$1" in
         --vcf)
@@ -61,6 +78,26 @@ while [[ $# -gt 0 ]]; do
         --convert)
             CONVERT_ONLY=1
             ;;
+        --resume)
+            RESUME=1
+            ;;
+        --stream)
+            STREAM_PIPELINE=1
+            ;;
+        --keep-intermediate)
+            KEEP_INTERMEDIATE=1
+            ;;
+        --bgzip)
+            BGZIP_OUTPUT=1
+            ;;
+        --variant-cache)
+            if [[ $2 = -* ]]; then
+                echo "Need argument for $1"
+                exit 1
+            fi
+            VARIANT_CACHE_DIR="$2"
+            shift
+            ;;
         --processes | -p)
             NUM_VEP_PROCESSES="$2"
             NUM_VCFANNO_PROCESSES="$2"
@@ -70,6 +107,14 @@ while [[ $# -gt 0 ]]; do
             VEP_BUFFER_SIZE="$2"
             shift
             ;;
+        --shards)
+            NUM_SHARDS="$2"
+            shift
+            ;;
+        --shard-jobs)
+            NUM_SHARD_JOBS="$2"
+            shift
+            ;;
 
         *)
             echo "* Error: Invalid argument: $1"
@@ -91,6 +136,8 @@ if [[ -z ${HGVSC} && -z ${VCF} ]]; then
     exit 1
 fi
 
+NUM_SHARD_JOBS=${NUM_SHARD_JOBS:-${NUM_SHARDS}}
+
 if [[ -z ${FASTA} || -z ${ANNO} ]]; then
     echo "Missing one or more mandatory environment variables:"
     echo "FASTA: ${FASTA}"
@@ -100,6 +147,10 @@ fi
 
 ANNODATA="${SOURCE_DIR}/../../data"
 VCFANNO_CONFIG="${ANNODATA}/vcfanno_config.toml"
+VARIANT_CACHE_ARGS="--cache-dir ${VARIANT_CACHE_DIR} \
+    --version-file ${ANNODATA}/sources.json \
+    --version-file ${VCFANNO_CONFIG} \
+    --version-file ${SOURCE_DIR}/../../version"
 
 echo "ANNO version:"
 cat "${SOURCE_DIR}/../../version"
@@ -110,6 +161,11 @@ echo "HGVSC: ${HGVSC}"
 echo "REGIONS: ${REGIONS}"
 echo "WORKDIR: ${WORKDIR}"
 echo "CONVERT_ONLY: ${CONVERT_ONLY}"
+echo "RESUME: ${RESUME}"
+echo "VARIANT_CACHE_DIR: ${VARIANT_CACHE_DIR}"
+echo "STREAM_PIPELINE: ${STREAM_PIPELINE} (KEEP_INTERMEDIATE: ${KEEP_INTERMEDIATE})"
+echo "NUM_SHARDS: ${NUM_SHARDS} (${NUM_SHARD_JOBS} concurrent)"
+echo "BGZIP_OUTPUT: ${BGZIP_OUTPUT}"
 
 # End parse arguments
 
@@ -142,7 +198,7 @@ handle_step_failed() {
     cat "${OUTPUT_LOG}"
 }
 
-handle_step_start() {
+set_step() {
     STEP=$1
     WORKDIR_STEP="${WORKDIR}/${STEP}"
     mkdir -p "${WORKDIR_STEP}"
@@ -151,10 +207,49 @@ handle_step_start() {
     OUTPUT_CMD="${WORKDIR_STEP}/cmd.sh"
     OUTPUT_SUCCESS="${WORKDIR_STEP}/SUCCESS"
     OUTPUT_FAILED="${WORKDIR_STEP}/FAILED"
+}
+
+handle_step_start() {
+    set_step "$1"
 
     echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\t${STEP}\tSTARTED" | tee -a "${STATUS_FILE}"
 }
 
+# Check if the current step was completed in a previous run with identical input files (only with --resume).
+# Otherwise, store the input checksum for the step, so that it can be skipped if the pipeline is resumed later.
+# The size and modification time of the input files (fingerprint) are compared first, the checksum only if these
+# changed (e.g. the input was written again by a step that was run again).
+# Step outputs compressed by a previous run (--bgzip) are decompressed when the step is skipped.
+step_is_done() {
+    local INPUT_FINGERPRINT INPUT_CHECKSUM=""
+    INPUT_FINGERPRINT="$(stat -L -c $'%n\t%s\t%.9Y' "$@")"
+    if [[ ${RESUME} = 1 && -f "${OUTPUT_SUCCESS}" ]] && [[ -f "${OUTPUT_VCF}" || -f "${OUTPUT_VCF}.gz" ]]; then
+        if [[ "$(cat "${WORKDIR_STEP}/input.fingerprint" 2>/dev/null)" != "${INPUT_FINGERPRINT}" ]]; then
+            INPUT_CHECKSUM="$(cat "$@" | md5sum | cut -d' ' -f1)"
+        fi
+        if [[ -z ${INPUT_CHECKSUM} || "$(cat "${WORKDIR_STEP}/input.md5" 2>/dev/null)" == "${INPUT_CHECKSUM}" ]]; then
+            echo "${INPUT_FINGERPRINT}" >"${WORKDIR_STEP}/input.fingerprint"
+            if [[ ! -f "${OUTPUT_VCF}" ]]; then
+                bgzip -d -c "${OUTPUT_VCF}.gz" >"${OUTPUT_VCF}"
+                rm "${OUTPUT_VCF}.gz"
+            fi
+            return 0
+        fi
+    fi
+    rm -f "${OUTPUT_SUCCESS}" "${OUTPUT_FAILED}"
+    if [[ -z ${INPUT_CHECKSUM} ]]; then
+        INPUT_CHECKSUM="$(cat "$@" | md5sum | cut -d' ' -f1)"
+    fi
+    echo "${INPUT_CHECKSUM}" >"${WORKDIR_STEP}/input.md5"
+    echo "${INPUT_FINGERPRINT}" >"${WORKDIR_STEP}/input.fingerprint"
+    return 1
+}
+
+handle_step_skipped() {
+    echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\t${STEP}\tSKIPPED" | tee -a "${STATUS_FILE}"
+    VCF=${OUTPUT_VCF}
+}
+
 ### End reused functions
 
 ### Set output folders
@@ -173,6 +268,7 @@ if [[ -f ${FINAL_VCF} ]]; then
     echo "Removing old final vcf"
     rm "${FINAL_VCF}"
 fi
+rm -f "${FINAL_VCF}.gz" "${FINAL_VCF}.gz.tbi" "${FINAL_VCF}.idx"
 
 ### End set output folders
 
@@ -183,66 +279,169 @@ if [[ -n ${HGVSC} ]]; then
     # Set environment variables for step
     handle_step_start "CONVERT"
 
-    # Create and run command
-    cmd="python3 ${ANNO}/src/conversion/convert.py ${HGVSC} ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
-    echo "${cmd}" >"${OUTPUT_CMD}"
-    bash "${OUTPUT_CMD}"
+    if step_is_done "${HGVSC}"; then
+        handle_step_skipped
+    else
+        # Create and run command
+        cmd="python3 ${ANNO}/src/conversion/convert.py ${HGVSC} ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
 
-    # Handle step exit
-    handle_step_done
+        # Handle step exit
+        handle_step_done
+    fi
 fi
 
 # Store original VCF
 # For use in targets
 cp "${VCF}" "${WORKDIR}/original.vcf"
 
-##################################
-###### REMOVE STAR ALLELES #######
-##################################
-handle_step_start "REMOVE_STAR_ALLELES"
+if [[ ${STREAM_PIPELINE} = 1 ]]; then
+    ##################################
+    ##### STREAMED PREPROCESSING #####
+    ##################################
+    # Run REMOVE_STAR_ALLELES, VT_DECOMPOSE, VT_NORMALIZE and VCFSORT as one pipeline. Every step still gets its own
+    # STATUS lines, folder, cmd.sh and output.log, but only the last step writes its output to disk (unless
+    # --keep-intermediate is given). The steps are resumed as a group.
+    STREAM_STEPS=("REMOVE_STAR_ALLELES" "VT_DECOMPOSE" "VT_NORMALIZE" "VCFSORT")
+    LAST_STREAM_STEP=${STREAM_STEPS[-1]}
+
+    set_step "${LAST_STREAM_STEP}"
+    if step_is_done "${VCF}"; then
+        for step in "${STREAM_STEPS[@]}"; do
+            set_step "${step}"
+            handle_step_skipped
+        done
+    else
+        STREAM_INPUT=${VCF}
+        pipeline=""
+        for step in "${STREAM_STEPS[@]}"; do
+            handle_step_start "${step}"
+            case "${step}" in
+                REMOVE_STAR_ALLELES)
+                    cmd="remove_star_alleles --input ${STREAM_INPUT} --output /dev/stdout"
+                    ;;
+                VT_DECOMPOSE)
+                    # Fix wrong header for older GATK
+                    cmd="sed 's/##FORMAT=<ID=AD,Number=\./##FORMAT=<ID=AD,Number=R/g' | vt decompose -s -o - -"
+                    ;;
+                VT_NORMALIZE)
+                    cmd="vt normalize -r ${FASTA} -o - -"
+                    ;;
+                VCFSORT)
+                    # Written to the output file, read back only if the input is not sorted (see sort_vcf.py)
+                    cmd="python3 ${ANNO}/src/annotation/sort_vcf.py --output ${OUTPUT_VCF} --tmp-dir ${WORKDIR_STEP}"
+                    ;;
+            esac
+            echo "${cmd}" >"${OUTPUT_CMD}"
+
+            # The checksum of the group input is stored for the last step only
+            if [[ ${step} != "${LAST_STREAM_STEP}" ]]; then
+                rm -f "${OUTPUT_SUCCESS}" "${OUTPUT_FAILED}" "${WORKDIR_STEP}/input.md5" "${WORKDIR_STEP}/input.fingerprint"
+            fi
 
-cmd="remove_star_alleles --input ${VCF} --output ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
-echo "${cmd}" >"${OUTPUT_CMD}"
-bash "${OUTPUT_CMD}"
+            # Record the exit code of every step, to report the step that failed
+            rm -f "${WORKDIR_STEP}/exit_code"
+            cmd="(set -o pipefail; ${cmd}; echo \$? > ${WORKDIR_STEP}/exit_code) 2> ${OUTPUT_LOG}"
+            # The last step (VCFSORT) writes its output file itself
+            if [[ ${step} != "${LAST_STREAM_STEP}" ]]; then
+                if [[ ${KEEP_INTERMEDIATE} = 1 ]]; then
+                    cmd="${cmd} | tee ${OUTPUT_VCF}"
+                else
+                    rm -f "${OUTPUT_VCF}"
+                fi
+            fi
+            pipeline="${pipeline:+${pipeline} | }${cmd}"
+        done
+
+        echo "${pipeline}" >"${WORKDIR}/${LAST_STREAM_STEP}/stream_cmd.sh"
+        bash "${WORKDIR}/${LAST_STREAM_STEP}/stream_cmd.sh"
+
+        # A failing step makes the steps before it fail with SIGPIPE (141), so report the first other failure
+        FAILED_STEP=""
+        for step in "${STREAM_STEPS[@]}"; do
+            exit_code=$(cat "${WORKDIR}/${step}/exit_code" 2>/dev/null || echo 1)
+            if [[ ${exit_code} != 0 ]] && [[ -z ${FAILED_STEP} || ${exit_code} != 141 ]]; then
+                FAILED_STEP=${step}
+                [[ ${exit_code} != 141 ]] && break
+            fi
+        done
+        if [[ -n ${FAILED_STEP} ]]; then
+            set_step "${FAILED_STEP}"
+            exit 1
+        fi
 
-handle_step_done
+        for step in "${STREAM_STEPS[@]}"; do
+            set_step "${step}"
+            handle_step_done
+        done
+    fi
+else
+    ##################################
+    ###### REMOVE STAR ALLELES #######
+    ##################################
+    handle_step_start "REMOVE_STAR_ALLELES"
 
-##################################
-######### VT DECOMPOSE ###########
-##################################
-# Set environment variables for step
-handle_step_start "VT_DECOMPOSE"
+    if step_is_done "${VCF}"; then
+        handle_step_skipped
+    else
+        cmd="remove_star_alleles --input ${VCF} --output ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
 
-# Fix wrong header for older GATK
-sed -i 's/##FORMAT=<ID=AD,Number=\./##FORMAT=<ID=AD,Number=R/g' "${VCF}"
+        handle_step_done
+    fi
 
-cmd="vt decompose -s -o ${OUTPUT_VCF} ${VCF} &> ${OUTPUT_LOG}"
-echo "${cmd}" >"${OUTPUT_CMD}"
-bash "${OUTPUT_CMD}"
+    ##################################
+    ######### VT DECOMPOSE ###########
+    ##################################
+    # Set environment variables for step
+    handle_step_start "VT_DECOMPOSE"
 
-handle_step_done
+    # Fix wrong header for older GATK
+    sed -i 's/##FORMAT=<ID=AD,Number=\./##FORMAT=<ID=AD,Number=R/g' "${VCF}"
 
-##################################
-######### VT NORMALIZE ###########
-##################################
-handle_step_start "VT_NORMALIZE"
+    if step_is_done "${VCF}"; then
+        handle_step_skipped
+    else
+        cmd="vt decompose -s -o ${OUTPUT_VCF} ${VCF} &> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
 
-cmd="vt normalize -r ${FASTA} -o ${OUTPUT_VCF} ${VCF} &> ${OUTPUT_LOG}"
-echo "${cmd}" >"${OUTPUT_CMD}"
-bash "${OUTPUT_CMD}"
+        handle_step_done
+    fi
 
-handle_step_done
+    ##################################
+    ######### VT NORMALIZE ###########
+    ##################################
+    handle_step_start "VT_NORMALIZE"
 
-##################################
-############ VCFSORT #############
-##################################
-handle_step_start "VCFSORT"
+    if step_is_done "${VCF}"; then
+        handle_step_skipped
+    else
+        cmd="vt normalize -r ${FASTA} -o ${OUTPUT_VCF} ${VCF} &> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
+
+        handle_step_done
+    fi
+
+    ##################################
+    ############ VCFSORT #############
+    ##################################
+    handle_step_start "VCFSORT"
 
-cmd="vcf-sort -c ${VCF} | uniq > ${OUTPUT_VCF} 2> ${OUTPUT_LOG}"
-echo "${cmd}" >"${OUTPUT_CMD}"
-bash "${OUTPUT_CMD}"
+    if step_is_done "${VCF}"; then
+        handle_step_skipped
+    else
+        # Sort (as vcf-sort -c) and remove duplicates, unless already sorted
+        cmd="python3 ${ANNO}/src/annotation/sort_vcf.py --input ${VCF} --output ${OUTPUT_VCF} --tmp-dir ${WORKDIR_STEP} 2> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
 
-handle_step_done
+        handle_step_done
+    fi
+fi
 
 ##################################
 ########### SLICING ##############
@@ -251,25 +450,16 @@ if [[ -n ${REGIONS} ]]; then
     # Set environment variables for step
     handle_step_start "SLICE"
 
-    # Perform slicing
-    cmd="bedtools intersect -header -wa -u -a ${VCF} -b ${REGIONS} > ${WORKDIR_STEP}/tmp_output.vcf 2> ${OUTPUT_LOG}"
-    echo "${cmd}" >"${OUTPUT_CMD}"
-
-    # Ensure that all multiallelic blocks are preserved
-    # 1. Gather all multiallelic (whole or partial) blocks in a text file
-    cmd="grep -oP '(?<=[\s;])OLD_MULTIALLELIC[^\s;]*' ${WORKDIR_STEP}/tmp_output.vcf | sort | uniq > ${WORKDIR_STEP}/tmp_multiallelic_blocks.txt 2> ${OUTPUT_LOG}"
-    echo "${cmd}" >>"${OUTPUT_CMD}"
-
-    # 2. Grep for these multiallelic sites in the $VCF from the previous step (whole blocks only)
-    # Append these to the temporary file, re-sort and remove duplicates
-    cmd="cat ${WORKDIR_STEP}/tmp_output.vcf <(grep -F -f ${WORKDIR_STEP}/tmp_multiallelic_blocks.txt ${VCF}) | vcf-sort -c | uniq > ${OUTPUT_VCF} 2> ${OUTPUT_LOG}"
-
-    echo "${cmd}" >>"${OUTPUT_CMD}"
-    bash "${OUTPUT_CMD}"
-
-    rm "${WORKDIR_STEP}/tmp_multiallelic_blocks.txt" "${WORKDIR_STEP}/tmp_output.vcf"
+    if step_is_done "${VCF}" "${REGIONS}"; then
+        handle_step_skipped
+    else
+        # Keep the records overlapping the regions, and all records of their multiallelic blocks
+        cmd="python3 ${ANNO}/src/annotation/slice_vcf.py --input ${VCF} --regions ${REGIONS} --output ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
 
-    handle_step_done
+        handle_step_done
+    fi
 fi
 
 ##################################
@@ -277,70 +467,169 @@ fi
 ##################################
 handle_step_start "VALIDATE"
 
-cmd="validate_vcf --input ${VCF} --output ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
-echo "${cmd}" >"${OUTPUT_CMD}"
-bash "${OUTPUT_CMD}"
+if step_is_done "${VCF}"; then
+    handle_step_skipped
+else
+    cmd="validate_vcf --input ${VCF} --output ${OUTPUT_VCF} --processes ${NUM_VEP_PROCESSES} &> ${OUTPUT_LOG}"
+    echo "${cmd}" >"${OUTPUT_CMD}"
+    bash "${OUTPUT_CMD}"
 
-handle_step_done
+    handle_step_done
+fi
 
 # Run annotation if not specified to run convert only
 if [[ ${CONVERT_ONLY} = 0 ]]; then
+    if [[ -n ${VARIANT_CACHE_DIR} ]]; then
+        ##################################
+        ###### VARIANT CACHE SPLIT #######
+        ##################################
+        # Only variants not found in the variant cache are annotated by VEP and vcfanno
+        handle_step_start "VARIANT_CACHE_SPLIT"
+        VARIANT_CACHE_INPUT=${VCF}
+        VARIANT_CACHE_CACHED="${WORKDIR_STEP}/cached.vcf"
+
+        if step_is_done "${VCF}"; then
+            handle_step_skipped
+        else
+            cmd="python3 ${ANNO}/src/annotation/variant_cache.py ${VARIANT_CACHE_ARGS} split --input ${VCF} --cached ${VARIANT_CACHE_CACHED} --uncached ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+            echo "${cmd}" >"${OUTPUT_CMD}"
+            bash "${OUTPUT_CMD}"
+
+            handle_step_done
+        fi
+    fi
+
     ##################################
     ############## VEP ###############
     ##################################
     handle_step_start "VEP"
-    if [[ "$(grep -c '^#' "${VCF}")" -eq "$(grep -c '^.' "${VCF}")" ]]; then
-        # HACK: If there are no variants in the vcf, VEP doesn't write anything..
-        cmd="cp ${VCF} ${OUTPUT_VCF}"
+    if step_is_done "${VCF}" "${ANNODATA}/sources.json"; then
+        handle_step_skipped
     else
-        cmd="vep_offline \
-              --fasta ${FASTA} \
-              --force_overwrite \
-              --sift=b \
-              --polyphen=b \
-              --hgvs \
-              --numbers \
-              --domains \
-              --regulatory \
-              --canonical \
-              --protein \
-              --biotype \
-              --pubmed \
-              --symbol \
-              --allow_non_variant \
-              --fork=${NUM_VEP_PROCESSES} \
-              --vcf \
-              --allele_number \
-              --no_escape \
-              --failed=1 \
-              --exclude_predicted \
-              --hgvsg \
-              --no_stats \
-              --merged \
-              --buffer_size=${VEP_BUFFER_SIZE} \
-              --custom ${ANNODATA}/RefSeq/GRCh37_refseq_$(jq -r '.refseq.version' "${ANNODATA}/sources.json")_VEP.gff.gz,RefSeq_gff,gff,overlap,1, \
-              --custom ${ANNODATA}/RefSeq_interim/GRCh37_refseq_interim_$(jq -r '.refseq_interim.version' "${ANNODATA}/sources.json")_VEP.gff.gz,RefSeq_Interim_gff,gff,overlap,1, \
-              -i ${VCF} \
-              -o ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+        VEP_ARGS="--fasta ${FASTA} \
+                  --force_overwrite \
+                  --sift=b \
+                  --polyphen=b \
+                  --hgvs \
+                  --numbers \
+                  --domains \
+                  --regulatory \
+                  --canonical \
+                  --protein \
+                  --biotype \
+                  --pubmed \
+                  --symbol \
+                  --allow_non_variant \
+                  --vcf \
+                  --allele_number \
+                  --no_escape \
+                  --failed=1 \
+                  --exclude_predicted \
+                  --hgvsg \
+                  --no_stats \
+                  --merged \
+                  --buffer_size=${VEP_BUFFER_SIZE} \
+                  --custom ${ANNODATA}/RefSeq/GRCh37_refseq_$(jq -r '.refseq.version' "${ANNODATA}/sources.json")_VEP.gff.gz,RefSeq_gff,gff,overlap,1, \
+                  --custom ${ANNODATA}/RefSeq_interim/GRCh37_refseq_interim_$(jq -r '.refseq_interim.version' "${ANNODATA}/sources.json")_VEP.gff.gz,RefSeq_Interim_gff,gff,overlap,1,"
+        if [[ "$(grep -c '^#' "${VCF}")" -eq "$(grep -c '^.' "${VCF}")" ]]; then
+            # HACK: If there are no variants in the vcf, VEP doesn't write anything..
+            cmd="cp ${VCF} ${OUTPUT_VCF}"
+        elif ((NUM_SHARDS > 1)); then
+            # Split the forks between the concurrent shards
+            cmd="python3 ${ANNO}/src/annotation/shard_vcf.py \
+                  --input ${VCF} \
+                  --output ${OUTPUT_VCF} \
+                  --shards ${NUM_SHARDS} \
+                  --jobs ${NUM_SHARD_JOBS} \
+                  --workdir ${WORKDIR_STEP}/shards \
+                  -- vep_offline ${VEP_ARGS} \
+                  --fork=$(((NUM_VEP_PROCESSES + NUM_SHARD_JOBS - 1) / NUM_SHARD_JOBS)) \
+                  -i {input} \
+                  -o {output} &> ${OUTPUT_LOG}"
+        else
+            cmd="vep_offline ${VEP_ARGS} \
+                  --fork=${NUM_VEP_PROCESSES} \
+                  -i ${VCF} \
+                  -o ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+        fi
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
+
+        handle_step_done
     fi
-    echo "${cmd}" >"${OUTPUT_CMD}"
-    bash "${OUTPUT_CMD}"
-
-    handle_step_done
 
     ##################################
     ############ VCFANNO #############
     ##################################
     handle_step_start "VCFANNO"
 
-    cp "${VCFANNO_CONFIG}" "${WORKDIR_STEP}/vcfanno_config.toml"
-    cmd="IRELATE_MAX_GAP=1000 GOGC=1000 vcfanno -p ${NUM_VCFANNO_PROCESSES} -base-path ${ANNODATA} ${WORKDIR_STEP}/vcfanno_config.toml ${VCF} > ${OUTPUT_VCF} 2> ${OUTPUT_LOG}"
-    echo "${cmd}" >"${OUTPUT_CMD}"
-    bash "${OUTPUT_CMD}"
+    if step_is_done "${VCF}" "${VCFANNO_CONFIG}" "${ANNODATA}/sources.json"; then
+        handle_step_skipped
+    else
+        cp "${VCFANNO_CONFIG}" "${WORKDIR_STEP}/vcfanno_config.toml"
+        if ((NUM_SHARDS > 1)); then
+            cmd="IRELATE_MAX_GAP=1000 GOGC=1000 python3 ${ANNO}/src/annotation/shard_vcf.py --input ${VCF} --output ${OUTPUT_VCF} --shards ${NUM_SHARDS} --jobs ${NUM_SHARD_JOBS} --workdir ${WORKDIR_STEP}/shards --stdout -- vcfanno -p $(((NUM_VCFANNO_PROCESSES + NUM_SHARD_JOBS - 1) / NUM_SHARD_JOBS)) -base-path ${ANNODATA} ${WORKDIR_STEP}/vcfanno_config.toml {input} &> ${OUTPUT_LOG}"
+        else
+            cmd="IRELATE_MAX_GAP=1000 GOGC=1000 vcfanno -p ${NUM_VCFANNO_PROCESSES} -base-path ${ANNODATA} ${WORKDIR_STEP}/vcfanno_config.toml ${VCF} > ${OUTPUT_VCF} 2> ${OUTPUT_LOG}"
+        fi
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
+
+        handle_step_done
+    fi
 
-    handle_step_done
+    if [[ -n ${VARIANT_CACHE_DIR} ]]; then
+        ##################################
+        ###### VARIANT CACHE MERGE #######
+        ##################################
+        # Merge cached and newly annotated variants in input order, and store the new annotations in the cache
+        handle_step_start "VARIANT_CACHE_MERGE"
+
+        if step_is_done "${VARIANT_CACHE_INPUT}" "${VARIANT_CACHE_CACHED}" "${VCF}"; then
+            handle_step_skipped
+        else
+            cmd="python3 ${ANNO}/src/annotation/variant_cache.py ${VARIANT_CACHE_ARGS} merge --input ${VARIANT_CACHE_INPUT} --cached ${VARIANT_CACHE_CACHED} --annotated ${VCF} --output ${OUTPUT_VCF} &> ${OUTPUT_LOG}"
+            echo "${cmd}" >"${OUTPUT_CMD}"
+            bash "${OUTPUT_CMD}"
+
+            handle_step_done
+        fi
+    fi
+fi
+
+##################################
+########### COMPRESS #############
+##################################
+if [[ ${BGZIP_OUTPUT} = 1 ]]; then
+    handle_step_start "COMPRESS"
+    FINAL_OUTPUT_VCF=${VCF}
+    OUTPUT_VCF="${WORKDIR_STEP}/output.vcf.gz"
+
+    if step_is_done "${VCF}" && [[ -f "${OUTPUT_VCF}.tbi" ]]; then
+        handle_step_skipped
+    else
+        cmd="bgzip -@ ${NUM_VCFANNO_PROCESSES} -c ${VCF} > ${OUTPUT_VCF} 2> ${OUTPUT_LOG} && tabix -f -p vcf ${OUTPUT_VCF} &>> ${OUTPUT_LOG}"
+        echo "${cmd}" >"${OUTPUT_CMD}"
+        bash "${OUTPUT_CMD}"
+
+        handle_step_done
+    fi
+
+    # Compress the step outputs, except the uncompressed final output. They are decompressed when resumed.
+    for STEP_VCF in "${WORKDIR}"/*/output.vcf; do
+        if [[ -f ${STEP_VCF} && ! -L ${STEP_VCF} && "$(realpath "${STEP_VCF}")" != "$(realpath "${FINAL_OUTPUT_VCF}")" ]]; then
+            bgzip -f -@ "${NUM_VCFANNO_PROCESSES}" "${STEP_VCF}"
+        fi
+    done
+
+    ln -rs "${VCF}" "${FINAL_VCF}.gz"
+    ln -rs "${VCF}.tbi" "${FINAL_VCF}.gz.tbi"
+    VCF=${FINAL_OUTPUT_VCF}
 fi
 
 # Create link to final vcf
 ln -rs "${VCF}" "${FINAL_VCF}"
+# Coordinate index for region queries on the result. Not fatal, the API builds the index if missing.
+python3 "${ANNO}/src/annotation/vcf_index.py" --input "${FINAL_VCF}" &>"${WORKDIR}/index.log" \
+    || echo "Unable to index ${FINAL_VCF}, see ${WORKDIR}/index.log"
 echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\tFINALIZED\t" | tee -a "${STATUS_FILE}"
@@ -1,35 +1,168 @@
+"""
+Check that the reference alleles of a vcf match the reference genome (FASTA).
+
+The records are grouped by contig and checked in position order, fetching the genome sequence in windows of
+WINDOW_SIZE bases rather than once per record. The vcf is first indexed by contig (the byte ranges of the consecutive
+records of each contig), and the records of one contig at a time are read for checking. Contigs are checked in
+parallel by a pool of worker processes, each reading its contig from the vcf and with its own handle to the FASTA file.
+All mismatches are reported.
+"""
+
 import os
+import multiprocessing
+from collections import OrderedDict
+
 import pysam
 
+# Bases fetched from the FASTA at once
+WINDOW_SIZE = 1 << 20
+# Number of mismatches listed in the error message
+MAX_REPORTED = 1000
+
 
 class IncorrectReferenceError(RuntimeError):
     pass
 
 
+def _check_contig(fasta, chrom, records):
+    """
+    Compare the reference of the (line number, 0-based position, ref) records on `chrom` with the genome reference.
+    Returns the mismatches as (line number, chrom, position, vcf ref, genome ref) tuples.
+    """
+    if chrom not in set(fasta.references):
+        return [(i, chrom, pos + 1, vcf_ref, None) for i, pos, vcf_ref in records]
+
+    mismatches = []
+    window_start = 0
+    window = ""
+    for i, pos, vcf_ref in sorted(records, key=lambda r: r[1]):
+        end = pos + len(vcf_ref)
+        if pos < window_start or end > window_start + len(window):
+            window_start = pos
+            window = fasta.fetch(chrom, pos, max(end, pos + WINDOW_SIZE))
+        actual_ref = window[pos - window_start : end - window_start]
+        if actual_ref != vcf_ref:
+            mismatches.append((i, chrom, pos + 1, vcf_ref, actual_ref))
+    return mismatches
+
+
+# FASTA handle of the worker process, opened by _init_worker
+_FASTA = None
+
+
+def _init_worker(fasta_path):
+    global _FASTA
+    _FASTA = pysam.FastaFile(fasta_path)
+
+
+def _worker_check_contig(args):
+    vcf_file, chrom, runs = args
+    return _check_contig(_FASTA, chrom, list(read_records(vcf_file, runs)))
+
+
+def index_contigs(vcf_file):
+    """
+    Return OrderedDict of contig to list of (start offset, end offset, first line number) of its runs of consecutive
+    records. Records are not kept in memory, see read_records.
+    """
+    contigs = OrderedDict()
+    current = None
+    offset = 0
+    with open(vcf_file, "rb") as input:
+        for i, l in enumerate(input, 1):
+            start, offset = offset, offset + len(l)
+            if l.startswith(b"#") or not l.strip():
+                continue
+            chrom = l.split(b"\t", 1)[0].decode("utf-8")
+            if chrom == current:
+                run = contigs[chrom][-1]
+                contigs[chrom][-1] = (run[0], offset, run[2])
+            else:
+                contigs.setdefault(chrom, []).append((start, offset, i))
+                current = chrom
+    return contigs
+
+
+def read_records(vcf_file, runs):
+    "Yield (line number, 0-based position, ref) of the records in `runs` (see index_contigs)"
+    with open(vcf_file, "rb") as input:
+        for start, end, line in runs:
+            input.seek(start)
+            offset = start
+            for i, l in enumerate(input, line):
+                if offset >= end:
+                    break
+                offset += len(l)
+                if l.startswith(b"#") or not l.strip():
+                    continue
+                chrom, pos, _, vcf_ref = l.decode("utf-8").split("\t", 4)[:4]
+                yield i, int(pos) - 1, vcf_ref
+
+
 class VCFCheckRef(object):
-    def __init__(self):
-        self.fasta = pysam.FastaFile(os.environ["FASTA"])
+    def __init__(self, fasta_path=None, processes=None):
+        self.fasta_path = fasta_path or os.environ["FASTA"]
+        self.fasta = pysam.FastaFile(self.fasta_path)
+        if processes is None:
+            # Same number of processes as the annotation of the task
+            processes = int(os.environ.get("NUM_VEP_PROCESSES", 1))
+        self.processes = processes
+
+    def find_mismatches(self, vcf_file):
+        contigs = index_contigs(vcf_file)
+        processes = min(self.processes, len(contigs))
+        if processes <= 1:
+            results = [
+                _check_contig(self.fasta, chrom, list(read_records(vcf_file, runs))) for chrom, runs in contigs.items()
+            ]
+        else:
+            pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(self.fasta_path,))
+            try:
+                # Largest contigs first, to keep all workers busy until the end
+                largest_first = sorted(
+                    contigs.items(), key=lambda c: sum(end - start for start, end, _ in c[1]), reverse=True
+                )
+                results = pool.map(
+                    _worker_check_contig, [(vcf_file, chrom, runs) for chrom, runs in largest_first], chunksize=1
+                )
+            finally:
+                pool.terminate()
+                pool.join()
+        return sorted(m for mismatches in results for m in mismatches)
 
     def check(self, vcf_file):
-        with open(vcf_file, "r") as input:
-            i = 0
-            for l in input:
-                if l.startswith("#") or not l:
-                    continue
-                i += 1
-                chrom, pos, _, vcf_ref = l.split("\t")[:4]
-                pos = int(pos) - 1
-                actual_ref = self.fasta.fetch(chrom, pos, pos + len(vcf_ref))
-                if str(actual_ref) != vcf_ref:
-                    raise IncorrectReferenceError(
-                        "Genome reference ({}) does not match vcf reference ({}). Offending line is: {} ".format(
-                            actual_ref, vcf_ref, l
+        mismatches = self.find_mismatches(vcf_file)
+        if mismatches:
+            lines = []
+            for i, chrom, pos, vcf_ref, actual_ref in mismatches[:MAX_REPORTED]:
+                if actual_ref is None:
+                    lines.append("Line {}: {}:{} contig not found in genome reference".format(i, chrom, pos))
+                else:
+                    lines.append(
+                        "Line {}: {}:{} genome reference ({}) does not match vcf reference ({})".format(
+                            i, chrom, pos, actual_ref, vcf_ref
                         )
                     )
+            if len(mismatches) > MAX_REPORTED:
+                lines.append("... and {} more".format(len(mismatches) - MAX_REPORTED))
+            raise IncorrectReferenceError(
+                "Genome reference does not match vcf reference for {} variant(s):\n{}".format(
+                    len(mismatches), "\n".join(lines)
+                )
+            )
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check vcf reference alleles against the reference genome")
+    parser.add_argument("vcf", help="vcf file to check")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="number of contigs to check in parallel (default: $NUM_VEP_PROCESSES or 1)",
+    )
+    args = parser.parse_args()
 
-    vcf_file = sys.argv[1]
-    VCFCheckRef().check(vcf_file)
+    VCFCheckRef(processes=args.processes).check(args.vcf)
@@ -44,6 +44,21 @@ if [[ -f "${TARGETS}/targets/preprocess/{{ target }}" ]]; then
     popd
 fi
 
+{% if cached_result %}
+####
+# Reuse result of an earlier task with identical input (result cache).
+# The cached files are linked into the task folder when the task is created.
+####
+echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\tSTARTED\t" | tee -a {{ status_file }}
+echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\tRESULT_CACHE\tSTARTED" | tee -a {{ status_file }}
+mkdir -p {{ task_dir }}/RESULT_CACHE
+echo "Reusing cached result {{ cached_result }}" | tee {{ task_dir }}/RESULT_CACHE/output.log
+rm -f {{ task_dir }}/original.vcf {{ task_dir }}/output.vcf
+cp {{ task_dir }}/cached_original.vcf {{ task_dir }}/original.vcf
+echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\tRESULT_CACHE\tDONE" | tee -a {{ status_file }}
+ln -rs {{ task_dir }}/cached_output.vcf {{ task_dir }}/output.vcf
+echo -e "$(date '+%Y-%m-%d %H:%M:%S.%N')\tFINALIZED\t" | tee -a {{ status_file }}
+{% else %}
 annotate \\
 {%- if input_type == 'vcf' %}
     --vcf {{ input_file }} \\
@@ -56,7 +71,9 @@ annotate \\
 {%- if convert_only %}
     --convert \\
 {%- endif %}
+    --resume \\
     -o {{ task_dir }}
+{% endif %}
 
 {% if target %}
 # Run targets
@@ -96,6 +113,32 @@ cd {{ task_dir }}
 """
 
 
+# Template for the Python pipeline engine (annotation/pipeline.py), which also runs target preprocessing and target
+PIPELINE_TEMPLATE = """
+#!/bin/bash
+
+set -euf -o pipefail
+
+python3 {{ pipeline_script }} \\
+{%- if input_type == 'vcf' %}
+    --vcf {{ input_file }} \\
+{%- elif input_type == 'hgvsc' %}
+    --hgvsc {{ input_file }} \\
+{%- endif %}
+{%- if input_regions %}
+    --regions {{ input_regions }} \\
+{%- endif %}
+{%- if convert_only %}
+    --convert \\
+{%- endif %}
+{%- if target %}
+    --target {{ target }} \\
+{%- endif %}
+    --resume \\
+    -o {{ task_dir }}
+"""
+
+
 class Command(object):
     def __init__(self, work_dir):
         self.work_dir = work_dir
@@ -128,9 +171,12 @@ class Command(object):
         convert_only=False,
         target=None,
         target_env=None,
+        cached_result=None,
+        engine="bash",
     ):
 
         assert input_file
+        assert engine in ["bash", "python"]
         assert input_type in ["vcf", "hgvsc"]
 
         if input_regions:
@@ -150,8 +196,14 @@ class Command(object):
             "target": target,
             "status_file": os.path.join(self.work_dir, "STATUS"),
             "convert_only": convert_only,
+            "cached_result": cached_result,
+            "pipeline_script": os.path.join(SCRIPT_DIR, "pipeline.py"),
         }
-        tmpl = jinja2.Template(COMMAND_TEMPLATE)
+        # Cached results are handled by the bash template
+        if engine == "python" and not cached_result:
+            tmpl = jinja2.Template(PIPELINE_TEMPLATE)
+        else:
+            tmpl = jinja2.Template(COMMAND_TEMPLATE)
 
         with open(self.cmd, "w") as f:
             f.write(tmpl.render(template_vars))
@@ -165,6 +217,8 @@ class Command(object):
         convert_only=False,
         target=None,
         target_env=None,
+        cached_result=None,
+        engine="bash",
     ):
         assert os.path.isfile(input_vcf)
         c = cls(work_dir)
@@ -176,6 +230,8 @@ class Command(object):
             convert_only=convert_only,
             target=target,
             target_env=target_env,
+            cached_result=cached_result,
+            engine=engine,
         )
         return c
 
@@ -188,6 +244,8 @@ class Command(object):
         convert_only=False,
         target=None,
         target_env=None,
+        cached_result=None,
+        engine="bash",
     ):
         assert os.path.isfile(input_hgvsc)
         c = cls(work_dir)
@@ -199,5 +257,7 @@ class Command(object):
             convert_only=convert_only,
             target=target,
             target_env=target_env,
+            cached_result=cached_result,
+            engine=engine,
         )
         return c
@@ -0,0 +1,126 @@
+"""
+Minimal inotify bindings (Linux only), used to wait for marker files written by other processes without polling.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        # Raises AttributeError on platforms without inotify
+        libc.inotify_init1
+        libc.inotify_add_watch
+        _libc = libc
+    return _libc
+
+
+def available():
+    try:
+        _get_libc()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class DirectoryWatch(object):
+    """
+    Watch a directory for files being created, moved into or touched in it
+    """
+
+    MASK = IN_CREATE | IN_MOVED_TO | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self, path):
+        libc = _get_libc()
+        self.path = path
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), DirectoryWatch.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err), path)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+            self.closed = True
+
+    def read(self, timeout=None):
+        """
+        Block until events are available (or timeout), and return a list of (mask, name) tuples.
+        An empty list means the timeout expired.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(buf):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset : offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+            events.append((mask, name))
+        return events
+
+
+def wait_for_files(path, names, timeout=None, on_timeout=None):
+    """
+    Wait until one of the files in `names` exists in directory `path`, and return its name.
+    Returns None if the directory is removed while waiting.
+
+    If `timeout` is given, `on_timeout` is called every `timeout` seconds while waiting.
+    """
+    with DirectoryWatch(path) as watch:
+        # Check after the watch is set up, so that a file created in between is not missed
+        for name in names:
+            if os.path.exists(os.path.join(path, name)):
+                return name
+        while True:
+            events = watch.read(timeout)
+            if not events:
+                if on_timeout is not None:
+                    on_timeout()
+                continue
+            for mask, name in events:
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    return None
+                if name in names:
+                    return name
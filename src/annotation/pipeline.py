@@ -0,0 +1,924 @@
+"""
+Python engine for the annotation pipeline.
+
+The pipeline is a DAG of steps connected through typed artifacts (files). A step runs as soon as the steps producing
+its inputs are done, so independent steps run concurrently (e.g. target preprocessing runs alongside the annotation,
+and VEP does not wait for validation). Like in annotate.sh, every step runs a shell command in its own folder
+(WORKDIR/<STEP>/{cmd.sh,output.log,output.vcf,SUCCESS,FAILED}) and can be resumed when its input is unchanged: the
+size and modification time of the inputs are compared first, their checksum only if these changed.
+
+Progress is reported to sinks: the STATUS file read by the API (same format as written by annotate.sh), and
+timings.json with the timing and resource usage of every step.
+
+annotate.sh is kept as the command line entry point, and for the options not supported here (--stream).
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
+ROOT_DIR = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+
+# Artifact types
+VCF = "vcf"
+VCF_GZ = "vcf.gz"
+HGVSC = "hgvsc"
+BED = "bed"
+
+STARTED = "STARTED"
+DONE = "DONE"
+FAILED = "FAILED"
+SKIPPED = "SKIPPED"
+# Running steps terminated because another step failed
+CANCELLED = "CANCELLED"
+
+# Seconds between terminating (SIGTERM) and killing the running steps when a step fails
+TERMINATE_GRACE_PERIOD = 10
+
+TIMINGS_FILE = "timings.json"
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Artifact(object):
+    def __init__(self, name, type, path, producer=None):
+        self.name = name
+        self.type = type
+        self.path = path
+        self.producer = producer
+
+
+class Step(object):
+    """
+    A pipeline step.
+
+    `inputs` maps argument names to (artifact name, type), and `outputs` maps artifact names to (type, file name in
+    the step folder). Exactly one of `command` and `func` is given, both are called with a dict of the paths of the
+    inputs and outputs (plus `dir` and `log`) when the step starts. `command` returns the shell command to run,
+    `func` runs the step in-process.
+
+    `checksum` lists additional files the output depends on (for resuming), `after` lists steps this step depends on
+    without using their output. Steps with `status=None` do not write to the STATUS file.
+    """
+
+    def __init__(
+        self,
+        name,
+        command=None,
+        func=None,
+        inputs=None,
+        outputs=None,
+        checksum=None,
+        after=None,
+        status=True,
+        dir=None,
+        resumable=True,
+    ):
+        assert (command is None) != (func is None)
+        self.name = name
+        self.command = command
+        self.func = func
+        self.inputs = OrderedDict(inputs or {})
+        self.outputs = OrderedDict(outputs or {})
+        self.checksum = checksum or []
+        self.after = after or []
+        self.status = name if status is True else status
+        self.dir = dir or name
+        self.resumable = resumable
+
+
+class StepResult(object):
+    def __init__(self, name):
+        self.name = name
+        self.state = None
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss = 0
+
+    def as_dict(self):
+        return OrderedDict(
+            [
+                ("state", self.state),
+                ("started", self.started),
+                ("finished", self.finished),
+                ("duration", None if self.finished is None else round(self.finished - self.started, 3)),
+                ("returncode", self.returncode),
+                ("user_time", round(self.user_time, 3)),
+                ("system_time", round(self.system_time, 3)),
+                # Peak resident set size in kilobytes of the largest process of the step
+                ("max_rss", self.max_rss),
+            ]
+        )
+
+
+def _timestamp():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class StatusFileSink(object):
+    "Append lines of '<timestamp>\\t<step>\\t<state>' to the STATUS file, as annotate.sh does"
+
+    def __init__(self, status_file, echo=True):
+        self.status_file = status_file
+        self.echo = echo
+
+    def __call__(self, name, state, result=None):
+        line = "{}\t{}\t{}".format(_timestamp(), name, state)
+        with open(self.status_file, "a") as f:
+            f.write(line + "\n")
+        if self.echo:
+            print(line, flush=True)
+
+
+class TimingsSink(object):
+    "Write timing and resource usage of every finished step to a json file"
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = OrderedDict()
+
+    def __call__(self, name, state, result=None):
+        if result is None or state == STARTED:
+            return
+        self.steps[name] = result.as_dict()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.steps, f, indent=2)
+        os.rename(tmp, self.path)
+
+
+def _checksum(files):
+    "md5 of the concatenated files, identical to the input checksum of annotate.sh"
+    h = hashlib.md5()
+    for path in files:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(files):
+    "Path, size and modification time of the files, identical to the input fingerprint of annotate.sh"
+    lines = []
+    for path in files:
+        st = os.stat(path)
+        lines.append("{}\t{}\t{}.{:09d}".format(path, st.st_size, st.st_mtime_ns // 10**9, st.st_mtime_ns % 10**9))
+    return "\n".join(lines)
+
+
+def _read_marker(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def _execute(cmd_file, cwd, result, started=None):
+    # In a process group of its own, so the step can be terminated with all its processes (see Pipeline.terminate)
+    p = subprocess.Popen(["bash", cmd_file], cwd=cwd, start_new_session=True)
+    if started is not None:
+        started(p)
+    # Reap the process with wait4 to get the resource usage of the step (including its children)
+    _, status, rusage = os.wait4(p.pid, 0)
+    p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    result.user_time = rusage.ru_utime
+    result.system_time = rusage.ru_stime
+    result.max_rss = rusage.ru_maxrss
+    return p.returncode
+
+
+class Pipeline(object):
+    def __init__(self, work_dir, sinks=None, resume=False, max_workers=4):
+        self.work_dir = work_dir
+        self.sinks = sinks if sinks is not None else []
+        self.resume = resume
+        self.max_workers = max_workers
+        self.steps = OrderedDict()
+        self.artifacts = {}
+        self.results = OrderedDict()
+        self._lock = threading.Lock()
+        # Processes of the running steps, by step name
+        self._processes = {}
+        self._terminating = False
+
+    def add_artifact(self, name, type, path):
+        "Add an artifact not produced by the pipeline (e.g. the input file)"
+        if name in self.artifacts:
+            raise PipelineError("Artifact {} is already defined".format(name))
+        self.artifacts[name] = Artifact(name, type, path)
+        return self.artifacts[name]
+
+    def add(self, step):
+        if step.name in self.steps:
+            raise PipelineError("Step {} is already defined".format(step.name))
+        for arg, (artifact, type) in step.inputs.items():
+            if artifact not in self.artifacts:
+                raise PipelineError("Step {}: unknown input artifact {}".format(step.name, artifact))
+            if self.artifacts[artifact].type != type:
+                raise PipelineError(
+                    "Step {}: input {} is of type {}, expected {}".format(
+                        step.name, artifact, self.artifacts[artifact].type, type
+                    )
+                )
+        for name in step.after:
+            if name not in self.steps:
+                raise PipelineError("Step {}: unknown step {}".format(step.name, name))
+        for artifact, (type, filename) in step.outputs.items():
+            if artifact in self.artifacts:
+                raise PipelineError("Step {}: artifact {} is already defined".format(step.name, artifact))
+            self.artifacts[artifact] = Artifact(
+                artifact, type, os.path.join(self.work_dir, step.dir, filename), producer=step.name
+            )
+        self.steps[step.name] = step
+        return step
+
+    def dependencies(self, step):
+        deps = set(step.after)
+        for artifact, _ in step.inputs.values():
+            if self.artifacts[artifact].producer is not None:
+                deps.add(self.artifacts[artifact].producer)
+        return deps
+
+    def emit(self, name, state, result=None):
+        with self._lock:
+            for sink in self.sinks:
+                sink(name, state, result)
+
+    def _paths(self, step):
+        step_dir = os.path.join(self.work_dir, step.dir)
+        paths = {"dir": step_dir, "log": os.path.join(step_dir, "output.log")}
+        for arg, (artifact, _) in step.inputs.items():
+            paths[arg] = self.artifacts[artifact].path
+        for artifact in step.outputs:
+            paths[artifact] = self.artifacts[artifact].path
+        return paths
+
+    def _emit_step(self, step, state, result):
+        if step.status is not None:
+            self.emit(step.status, state, result)
+
+    def _is_done(self, step, paths, input_files, fingerprint):
+        """
+        Returns whether the step is done with the same input, and the input checksum if it was computed (only when
+        the fingerprint of the inputs changed)
+        """
+        if not (self.resume and step.resumable and os.path.isfile(os.path.join(paths["dir"], "SUCCESS"))):
+            return False, None
+        outputs = [self.artifacts[a].path for a in step.outputs]
+        if not all(os.path.isfile(path) or os.path.isfile(path + ".gz") for path in outputs):
+            return False, None
+        checksum = None
+        if _read_marker(os.path.join(paths["dir"], "input.fingerprint")) != fingerprint:
+            # E.g. the input was written again by a step that was run again
+            checksum = _checksum(input_files)
+            if _read_marker(os.path.join(paths["dir"], "input.md5")) != checksum:
+                return False, checksum
+            with open(os.path.join(paths["dir"], "input.fingerprint"), "w") as f:
+                f.write(fingerprint + "\n")
+        # Outputs compressed after a previous run (bgzip option)
+        for path in outputs:
+            if not os.path.isfile(path):
+                with gzip.open(path + ".gz", "rb") as compressed, open(path, "wb") as f:
+                    shutil.copyfileobj(compressed, f)
+                os.unlink(path + ".gz")
+        return True, checksum
+
+    def _run_func(self, step, paths):
+        "Run an in-process step. These only do bookkeeping, and have no step folder."
+        result = StepResult(step.name)
+        self.results[step.name] = result
+        result.started = time.time()
+        try:
+            step.func(paths)
+            result.returncode = 0
+            result.state = DONE
+        except Exception as e:
+            print("Step {} failed: {}: {}".format(step.name, type(e).__name__, e), file=sys.stderr)
+            result.returncode = 1
+            result.state = FAILED
+        result.finished = time.time()
+        return result.state == DONE
+
+    def run_step(self, step):
+        paths = self._paths(step)
+        if step.func is not None:
+            return self._run_func(step, paths)
+
+        os.makedirs(paths["dir"], exist_ok=True)
+        result = StepResult(step.name)
+        self.results[step.name] = result
+        result.started = time.time()
+        self._emit_step(step, STARTED, result)
+
+        try:
+            input_files = [paths[arg] for arg in step.inputs] + list(step.checksum)
+            fingerprint = _fingerprint(input_files) if step.resumable else None
+            done, checksum = self._is_done(step, paths, input_files, fingerprint)
+            if done:
+                result.state = SKIPPED
+                result.finished = time.time()
+                self._emit_step(step, SKIPPED, result)
+                return True
+
+            for marker in ["SUCCESS", "FAILED"]:
+                if os.path.exists(os.path.join(paths["dir"], marker)):
+                    os.unlink(os.path.join(paths["dir"], marker))
+            if step.resumable:
+                with open(os.path.join(paths["dir"], "input.md5"), "w") as f:
+                    f.write((checksum or _checksum(input_files)) + "\n")
+                with open(os.path.join(paths["dir"], "input.fingerprint"), "w") as f:
+                    f.write(fingerprint + "\n")
+
+            cmd_file = os.path.join(paths["dir"], "cmd.sh")
+            with open(cmd_file, "w") as f:
+                f.write(step.command(paths) + "\n")
+        except Exception as e:
+            with open(paths["log"], "w") as f:
+                f.write("Unable to run step {}: {}: {}\n".format(step.name, type(e).__name__, e))
+            returncode = 1
+        else:
+            try:
+                returncode = _execute(cmd_file, paths["dir"], result, lambda p: self._started(step, p))
+            finally:
+                with self._lock:
+                    self._processes.pop(step.name, None)
+            missing = [a for a in step.outputs if not os.path.isfile(self.artifacts[a].path)]
+            if returncode == 0 and missing:
+                with open(paths["log"], "a") as f:
+                    f.write("Step {} did not write {}\n".format(step.name, ", ".join(missing)))
+                returncode = 1
+
+        result.returncode = returncode
+        result.finished = time.time()
+        if returncode == 0:
+            open(os.path.join(paths["dir"], "SUCCESS"), "a").close()
+            result.state = DONE
+        elif self._terminating:
+            open(os.path.join(paths["dir"], "FAILED"), "a").close()
+            result.state = CANCELLED
+        else:
+            open(os.path.join(paths["dir"], "FAILED"), "a").close()
+            result.state = FAILED
+            if os.path.isfile(paths["log"]):
+                shutil.copyfile(paths["log"], os.path.join(self.work_dir, "error.log"))
+        self._emit_step(step, result.state, result)
+        return returncode == 0
+
+    def _started(self, step, p):
+        with self._lock:
+            self._processes[step.name] = p
+            terminating = self._terminating
+        if terminating:
+            # Started while the other steps were terminated
+            self._terminate_process(p)
+
+    def _terminate_process(self, p):
+        def kill(sig):
+            # The process is reaped (returncode set) by _execute when it exits
+            if p.returncode is None:
+                try:
+                    os.killpg(p.pid, sig)
+                except OSError:
+                    pass
+
+        kill(signal.SIGTERM)
+        timer = threading.Timer(TERMINATE_GRACE_PERIOD, kill, args=(signal.SIGKILL,))
+        timer.daemon = True
+        timer.start()
+
+    def terminate(self):
+        """
+        Terminate the running steps (SIGTERM, and SIGKILL after TERMINATE_GRACE_PERIOD seconds). They are reported
+        as CANCELLED.
+        """
+        with self._lock:
+            self._terminating = True
+            processes = list(self._processes.values())
+        for p in processes:
+            self._terminate_process(p)
+
+    def run(self):
+        """
+        Run the pipeline, running up to `max_workers` independent steps concurrently. When a step fails, no new steps
+        are started, the running steps are terminated, and the pipeline fails once they have stopped.
+        """
+        self.emit("STARTED", "")
+        pending = OrderedDict(self.steps)
+        done = set()
+        failed = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if not failed:
+                    for name, step in list(pending.items()):
+                        if self.dependencies(step) <= done:
+                            running[executor.submit(self.run_step, step)] = step
+                            del pending[name]
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        print("Step {} failed: {}".format(step.name, e), file=sys.stderr)
+                        success = False
+                    if success:
+                        done.add(step.name)
+                    elif getattr(self.results.get(step.name), "state", None) != CANCELLED:
+                        failed.append(step.name)
+                        self.terminate()
+
+        if pending and not failed:
+            raise PipelineError("Unable to run steps {}, missing dependencies".format(", ".join(pending)))
+        return not failed
+
+
+def _anno_env(name, default=None):
+    value = os.environ.get(name)
+    return value if value else default
+
+
+def _vep_command(options, paths):
+    annodata = options["anno_data"]
+    with open(os.path.join(annodata, "sources.json")) as f:
+        sources = json.load(f)
+
+    with open(paths["vcf"]) as f:
+        has_variants = any(not l.startswith("#") and l.strip() for l in f)
+    if not has_variants:
+        # If there are no variants in the vcf, VEP doesn't write anything
+        return "cp {} {}".format(paths["vcf"], paths["vep"])
+
+    vep_args = " ".join(
+        [
+            "--fasta {}".format(options["fasta"]),
+            "--force_overwrite",
+            "--sift=b",
+            "--polyphen=b",
+            "--hgvs",
+            "--numbers",
+            "--domains",
+            "--regulatory",
+            "--canonical",
+            "--protein",
+            "--biotype",
+            "--pubmed",
+            "--symbol",
+            "--allow_non_variant",
+            "--vcf",
+            "--allele_number",
+            "--no_escape",
+            "--failed=1",
+            "--exclude_predicted",
+            "--hgvsg",
+            "--no_stats",
+            "--merged",
+            "--buffer_size={}".format(options["vep_buffer_size"]),
+            "--custom {}/RefSeq/GRCh37_refseq_{}_VEP.gff.gz,RefSeq_gff,gff,overlap,1,".format(
+                annodata, sources["refseq"]["version"]
+            ),
+            "--custom {}/RefSeq_interim/GRCh37_refseq_interim_{}_VEP.gff.gz,RefSeq_Interim_gff,gff,overlap,1,".format(
+                annodata, sources["refseq_interim"]["version"]
+            ),
+        ]
+    )
+    if options["shards"] > 1:
+        forks = -(-options["vep_processes"] // options["shard_jobs"])
+        return (
+            "python3 {}/shard_vcf.py --input {} --output {} --shards {} --jobs {} --workdir {}/shards -- "
+            "vep_offline {} --fork={} -i {{input}} -o {{output}} &> {}".format(
+                SCRIPT_DIR,
+                paths["vcf"],
+                paths["vep"],
+                options["shards"],
+                options["shard_jobs"],
+                paths["dir"],
+                vep_args,
+                forks,
+                paths["log"],
+            )
+        )
+    return "vep_offline {} --fork={} -i {} -o {} &> {}".format(
+        vep_args, options["vep_processes"], paths["vcf"], paths["vep"], paths["log"]
+    )
+
+
+def _vcfanno_command(options, paths):
+    config = os.path.join(paths["dir"], "vcfanno_config.toml")
+    shutil.copyfile(paths["config"], config)
+    if options["shards"] > 1:
+        processes = -(-options["vcfanno_processes"] // options["shard_jobs"])
+        return (
+            "IRELATE_MAX_GAP=1000 GOGC=1000 python3 {}/shard_vcf.py --input {} --output {} --shards {} --jobs {} "
+            "--workdir {}/shards --stdout -- vcfanno -p {} -base-path {} {} {{input}} &> {}".format(
+                SCRIPT_DIR,
+                paths["vcf"],
+                paths["vcfanno"],
+                options["shards"],
+                options["shard_jobs"],
+                paths["dir"],
+                processes,
+                options["anno_data"],
+                config,
+                paths["log"],
+            )
+        )
+    return "IRELATE_MAX_GAP=1000 GOGC=1000 vcfanno -p {} -base-path {} {} {} > {} 2> {}".format(
+        options["vcfanno_processes"], options["anno_data"], config, paths["vcf"], paths["vcfanno"], paths["log"]
+    )
+
+
+def _slice_command(paths):
+    # Keep the records overlapping the regions, and all records of their multiallelic blocks
+    return "python3 {}/slice_vcf.py --input {} --regions {} --output {} &> {}".format(
+        SCRIPT_DIR, paths["vcf"], paths["regions"], paths["sliced"], paths["log"]
+    )
+
+
+def _target_command(task_dir, target, script):
+    return "\n".join(
+        [
+            "set -euf -o pipefail",
+            "source {}/target.source".format(task_dir),
+            "mkdir -p {}/{}".format(task_dir, target),
+            "cd {}/{}".format(task_dir, target),
+            "set +f",
+            script,
+        ]
+    )
+
+
+def default_options():
+    "Pipeline options, from the same environment variables as annotate.sh"
+    processes = os.cpu_count() or 1
+    shards = int(_anno_env("NUM_SHARDS", 1))
+    return {
+        "anno": _anno_env("ANNO", ROOT_DIR),
+        "anno_data": os.path.join(ROOT_DIR, "data"),
+        "fasta": _anno_env("FASTA"),
+        "targets": _anno_env("TARGETS"),
+        "variant_cache_dir": _anno_env("VARIANT_CACHE_DIR"),
+        "vep_processes": int(_anno_env("NUM_VEP_PROCESSES", processes)),
+        "vcfanno_processes": int(_anno_env("NUM_VCFANNO_PROCESSES", processes)),
+        "vep_buffer_size": int(_anno_env("VEP_BUFFER_SIZE", 5000)),
+        "shards": shards,
+        "shard_jobs": int(_anno_env("NUM_SHARD_JOBS", shards)),
+        "max_workers": int(_anno_env("PIPELINE_WORKERS", 4)),
+        "bgzip": bool(int(_anno_env("BGZIP_OUTPUT", 0))),
+    }
+
+
+def build_pipeline(
+    work_dir, input_file, input_type, input_regions=None, convert_only=False, target=None, resume=False, options=None
+):
+    """
+    Build the annotation pipeline (the steps of annotate.sh, and target preprocessing and target of cmd.sh) for a
+    task folder
+    """
+    assert input_type in [VCF, HGVSC]
+    options = dict(default_options(), **(options or {}))
+    if not options["fasta"]:
+        raise PipelineError("Missing FASTA")
+
+    work_dir = os.path.abspath(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    pipeline = Pipeline(
+        work_dir,
+        sinks=[StatusFileSink(os.path.join(work_dir, "STATUS")), TimingsSink(os.path.join(work_dir, TIMINGS_FILE))],
+        resume=resume,
+        max_workers=options["max_workers"],
+    )
+    pipeline.add_artifact("input", input_type, os.path.abspath(input_file))
+    anno_data = options["anno_data"]
+    sources = os.path.join(anno_data, "sources.json")
+    vcfanno_config = os.path.join(anno_data, "vcfanno_config.toml")
+    version_file = os.path.join(ROOT_DIR, "version")
+    pipeline.add_artifact("vcfanno_config", "toml", vcfanno_config)
+
+    if target:
+        preprocess = os.path.join(options["targets"] or "", "targets", "preprocess", target)
+        pipeline.add(
+            Step(
+                "TARGET_CONFIG",
+                command=lambda p: _target_command(
+                    work_dir, target, "cd {}\nparse_config &> {}".format(work_dir, p["log"])
+                ),
+                status=None,
+                resumable=False,
+            )
+        )
+        if os.path.isfile(preprocess):
+            # Preprocessing only depends on the task config, and runs concurrently with the annotation
+            pipeline.add(
+                Step(
+                    "{} (PREPROCESS)".format(target.upper()),
+                    command=lambda p: _target_command(work_dir, target, 'bash "{}" &> {}'.format(preprocess, p["log"])),
+                    after=["TARGET_CONFIG"],
+                    dir=os.path.join(target, "PREPROCESS"),
+                    status="{} (PREPROCESS) ".format(target.upper()),
+                    resumable=False,
+                )
+            )
+
+    vcf = "input"
+    if input_type == HGVSC:
+        pipeline.add(
+            Step(
+                "CONVERT",
+                command=lambda p: "python3 {}/src/conversion/convert.py {} {} &> {}".format(
+                    options["anno"], p["hgvsc"], p["converted"], p["log"]
+                ),
+                inputs={"hgvsc": ("input", HGVSC)},
+                outputs={"converted": (VCF, "output.vcf")},
+            )
+        )
+        vcf = "converted"
+
+    # Store original VCF, for use in targets
+    pipeline.add(
+        Step(
+            "ORIGINAL",
+            func=lambda p: shutil.copyfile(p["vcf"], os.path.join(work_dir, "original.vcf")),
+            inputs={"vcf": (vcf, VCF)},
+            status=None,
+            resumable=False,
+        )
+    )
+
+    chain = [
+        ("REMOVE_STAR_ALLELES", "star_removed", "remove_star_alleles --input {vcf} --output {out} &> {log}"),
+        # Fix wrong header for older GATK (on the fly, annotate.sh modifies the input in place)
+        (
+            "VT_DECOMPOSE",
+            "decomposed",
+            "sed 's/##FORMAT=<ID=AD,Number=\\./##FORMAT=<ID=AD,Number=R/g' {vcf} | vt decompose -s -o {out} - &> {log}",
+        ),
+        ("VT_NORMALIZE", "normalized", "vt normalize -r {fasta} -o {out} {vcf} &> {log}"),
+        (
+            "VCFSORT",
+            "sorted",
+            "python3 {script_dir}/sort_vcf.py --input {vcf} --output {out} --tmp-dir {dir} 2> {log}",
+        ),
+    ]
+    for name, output, template in chain:
+        pipeline.add(
+            Step(
+                name,
+                command=lambda p, output=output, template=template: "set -o pipefail\n"
+                + template.format(
+                    vcf=p["vcf"],
+                    out=p[output],
+                    log=p["log"],
+                    dir=p["dir"],
+                    fasta=options["fasta"],
+                    script_dir=SCRIPT_DIR,
+                ),
+                inputs={"vcf": (vcf, VCF)},
+                outputs={output: (VCF, "output.vcf")},
+            )
+        )
+        vcf = output
+
+    if input_regions:
+        pipeline.add_artifact("regions", BED, os.path.abspath(input_regions))
+        pipeline.add(
+            Step(
+                "SLICE",
+                command=_slice_command,
+                inputs={"vcf": (vcf, VCF), "regions": ("regions", BED)},
+                outputs={"sliced": (VCF, "output.vcf")},
+            )
+        )
+        vcf = "sliced"
+
+    pipeline.add(
+        Step(
+            "VALIDATE",
+            command=lambda p: "validate_vcf --input {} --output {} --processes {} &> {}".format(
+                p["vcf"], p["validated"], options["vep_processes"], p["log"]
+            ),
+            inputs={"vcf": (vcf, VCF)},
+            outputs={"validated": (VCF, "output.vcf")},
+        )
+    )
+
+    if convert_only:
+        final = "validated"
+        final_after = []
+    else:
+        # VEP annotates the same records as validated, and does not need to wait for the validation. The final output
+        # is only available when the validation passed.
+        final_after = ["VALIDATE"]
+        variant_cache_args = None
+        if options["variant_cache_dir"]:
+            variant_cache_args = "--cache-dir {} --version-file {} --version-file {} --version-file {}".format(
+                options["variant_cache_dir"], sources, vcfanno_config, version_file
+            )
+            pipeline.add(
+                Step(
+                    "VARIANT_CACHE_SPLIT",
+                    command=lambda p: "python3 {}/variant_cache.py {} split --input {} --cached {} --uncached {} "
+                    "&> {}".format(SCRIPT_DIR, variant_cache_args, p["vcf"], p["cached"], p["uncached"], p["log"]),
+                    inputs={"vcf": (vcf, VCF)},
+                    outputs={"uncached": (VCF, "output.vcf"), "cached": (VCF, "cached.vcf")},
+                )
+            )
+            variant_cache_input = vcf
+            vcf = "uncached"
+
+        pipeline.add(
+            Step(
+                "VEP",
+                command=lambda p: _vep_command(options, p),
+                inputs={"vcf": (vcf, VCF)},
+                outputs={"vep": (VCF, "output.vcf")},
+                checksum=[sources],
+            )
+        )
+        pipeline.add(
+            Step(
+                "VCFANNO",
+                command=lambda p: _vcfanno_command(options, p),
+                inputs={"vcf": ("vep", VCF), "config": ("vcfanno_config", "toml")},
+                outputs={"vcfanno": (VCF, "output.vcf")},
+                checksum=[sources],
+            )
+        )
+        final = "vcfanno"
+
+        if variant_cache_args:
+            pipeline.add(
+                Step(
+                    "VARIANT_CACHE_MERGE",
+                    command=lambda p: "python3 {}/variant_cache.py {} merge --input {} --cached {} --annotated {} "
+                    "--output {} &> {}".format(
+                        SCRIPT_DIR, variant_cache_args, p["input"], p["cached"], p["vcf"], p["merged"], p["log"]
+                    ),
+                    inputs={
+                        "input": (variant_cache_input, VCF),
+                        "cached": ("cached", VCF),
+                        "vcf": ("vcfanno", VCF),
+                    },
+                    outputs={"merged": (VCF, "output.vcf")},
+                )
+            )
+            final = "merged"
+
+    finalize_inputs = {"vcf": (final, VCF)}
+    if options["bgzip"]:
+        # BGZF compressed, tabix indexed final output (output.vcf.gz), next to the uncompressed output.vcf
+        pipeline.add(
+            Step(
+                "COMPRESS",
+                command=lambda p: "bgzip -@ {threads} -c {vcf} > {out} 2> {log} "
+                "&& tabix -f -p vcf {out} &>> {log}".format(
+                    threads=options["vcfanno_processes"], vcf=p["vcf"], out=p["compressed"], log=p["log"]
+                ),
+                inputs={"vcf": (final, VCF)},
+                outputs={"compressed": (VCF_GZ, "output.vcf.gz")},
+                after=final_after,
+            )
+        )
+        # Compress the step outputs when they are no longer used. They are decompressed when a step is resumed.
+        pipeline.add(
+            Step(
+                "COMPRESS_STEPS",
+                command=lambda p: "\n".join(
+                    "[[ ! -f {path} ]] || bgzip -f -@ {threads} {path} &>> {log}".format(
+                        path=a.path, threads=options["vcfanno_processes"], log=p["log"]
+                    )
+                    for a in pipeline.artifacts.values()
+                    if a.type == VCF and a.producer is not None and a.name != final
+                ),
+                after=["COMPRESS", "ORIGINAL"],
+                status=None,
+                resumable=False,
+            )
+        )
+        finalize_inputs["compressed"] = ("compressed", VCF_GZ)
+
+    def finalize(p):
+        # Create links to final vcf (and compressed vcf and index)
+        links = [(p["vcf"], "output.vcf")]
+        if "compressed" in p:
+            links += [(p["compressed"], "output.vcf.gz"), (p["compressed"] + ".tbi", "output.vcf.gz.tbi")]
+        for path, name in links:
+            link = os.path.join(work_dir, name)
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(os.path.relpath(path, work_dir), link)
+        pipeline.emit("FINALIZED", "")
+
+    # Coordinate index for region queries on the result (output.vcf.idx), see vcf_index.py. Not fatal, the API
+    # builds the index if missing.
+    pipeline.add(
+        Step(
+            "INDEX",
+            command=lambda p: "python3 {}/vcf_index.py --input {} --output {} &> {log} "
+            "|| echo 'Unable to index' >> {log}".format(
+                SCRIPT_DIR, p["vcf"], os.path.join(work_dir, "output.vcf.idx"), log=p["log"]
+            ),
+            inputs={"vcf": (final, VCF)},
+            after=final_after,
+            status=None,
+            resumable=False,
+        )
+    )
+
+    pipeline.add(
+        Step(
+            "FINALIZE",
+            func=finalize,
+            inputs=finalize_inputs,
+            after=final_after + ["INDEX"],
+            status=None,
+            resumable=False,
+        )
+    )
+
+    if target:
+        target_out = os.path.join(work_dir, target, "OUT")
+        deliver = "\n".join(
+            [
+                'DELIVERY_TARGET_OUT="${{TARGETS_OUT__{}:-$TARGETS_OUT/{}}}"'.format(target.upper(), target),
+                'mkdir -p "${DELIVERY_TARGET_OUT}"',
+                'echo "Copying all files"',
+                # Copy data, exclude READY file(s), then copy possible READY files
+                'rsync -av --no-perms --exclude READY "{}"/* "${{DELIVERY_TARGET_OUT}}"'.format(target_out),
+                'rsync -av --no-perms "{}"/* --ignore-existing "${{DELIVERY_TARGET_OUT}}"'.format(target_out),
+            ]
+        )
+        after = ["FINALIZE", "TARGET_CONFIG"]
+        if "{} (PREPROCESS)".format(target.upper()) in pipeline.steps:
+            after.append("{} (PREPROCESS)".format(target.upper()))
+        pipeline.add(
+            Step(
+                "TARGET",
+                command=lambda p: _target_command(
+                    work_dir,
+                    target,
+                    'mkdir -p "{out}"\nTARGET_OUT="{out}" bash "$TARGETS/targets/{target}" &> {log}\n'
+                    "chmod -R a+rw .\n{deliver}".format(out=target_out, target=target, log=p["log"], deliver=deliver),
+                ),
+                after=after,
+                dir=target,
+                status=target.upper(),
+                resumable=False,
+            )
+        )
+
+    return pipeline
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the annotation pipeline")
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument("--vcf", help="input VCF")
+    input_group.add_argument("--hgvsc", help="input HGVSC")
+    parser.add_argument("--regions", help="regions to slice input on")
+    parser.add_argument("--convert", action="store_true", help="run conversion only, not annotation")
+    parser.add_argument("--target", help="target to run after annotation")
+    parser.add_argument("--resume", action="store_true", help="skip steps completed with the same input")
+    parser.add_argument(
+        "--bgzip", action="store_true", help="also write BGZF compressed, tabix indexed output (output.vcf.gz)"
+    )
+    parser.add_argument("-o", "--outfolder", default=os.getcwd(), help="output folder (default: working directory)")
+    args = parser.parse_args()
+
+    for f in ["FINISHED", "output.vcf", "output.vcf.gz", "output.vcf.gz.tbi", "output.vcf.idx"]:
+        if os.path.lexists(os.path.join(args.outfolder, f)):
+            os.unlink(os.path.join(args.outfolder, f))
+
+    pipeline = build_pipeline(
+        args.outfolder,
+        args.vcf or args.hgvsc,
+        VCF if args.vcf else HGVSC,
+        input_regions=args.regions,
+        convert_only=args.convert,
+        target=args.target,
+        resume=args.resume,
+        options={"bgzip": True} if args.bgzip else None,
+    )
+    sys.exit(0 if pipeline.run() else 1)
@@ -0,0 +1,260 @@
+import glob
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger("anno")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS task (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    updated REAL NOT NULL,
+    step TEXT,
+    estimated_runtime REAL,
+    queued REAL
+);
+CREATE INDEX IF NOT EXISTS task_state_idx ON task (state);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Columns added after the first version of the schema, added to existing registries
+MIGRATIONS = [("estimated_runtime", "REAL"), ("queued", "REAL")]
+
+
+def read_last_status(status_file):
+    """
+    Return the last line of a STATUS file formatted as "<STEP> <MODE>", or None if the file is missing or empty.
+    Only the tail of the file is read.
+    """
+    try:
+        with open(status_file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            lines = f.read().decode("utf-8").strip().split("\n")
+    except OSError:
+        return None
+    if not lines[-1]:
+        return None
+    return " ".join(lines[-1].split("\t")[1:])
+
+
+class TaskRegistry(object):
+    """
+    Persistent index of the tasks in the work folder, backed by SQLite.
+
+    The marker files (ACTIVE/SUCCESS/FAILED) and the STATUS file in each task folder are still written, but listing and
+    state lookups are answered from the registry, so they do not scale with the number of retained task folders.
+    """
+
+    CREATED = "CREATED"
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCESS = "SUCCESS"
+    FAILED = "FAILED"
+
+    ACTIVE_STATES = (CREATED, QUEUED, RUNNING)
+    FINISHED_STATES = (SUCCESS, FAILED)
+
+    def __init__(self, path, work_folder):
+        self.path = path
+        self.work_folder = work_folder
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(task)")]
+            for column, column_type in MIGRATIONS:
+                if column not in columns:
+                    conn.execute("ALTER TABLE task ADD COLUMN {} {}".format(column, column_type))
+        # Retried until an import completed, also if an earlier import was interrupted
+        if self.get_meta("imported") is None:
+            self.import_task_folders()
+
+    @contextmanager
+    def _connect(self):
+        # Use a connection per operation; tasks are updated from several worker threads.
+        # Rollback journal (not WAL) is used on purpose, as the work folder may be on network storage.
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_meta(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key, value):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def add(self, id, priority=False, state=CREATED, estimated_runtime=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO task (id, state, priority, created, updated, estimated_runtime) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (id, state, int(priority), now, now, estimated_runtime),
+            )
+
+    def set_state(self, id, state, step=None):
+        now = time.time()
+        assignments = ["state = ?", "updated = ?"]
+        values = [state, now]
+        if step is not None:
+            assignments.append("step = ?")
+            values.append(step)
+        if state == TaskRegistry.RUNNING:
+            assignments.append("started = ?")
+            values.append(now)
+        elif state in TaskRegistry.FINISHED_STATES:
+            assignments.append("finished = ?")
+            values.append(now)
+        elif state == TaskRegistry.QUEUED:
+            assignments.extend(["started = NULL", "finished = NULL"])
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE task SET {} WHERE id = ?".format(", ".join(assignments)),
+                values + [id],
+            )
+
+    def queue(self, id, priority=False, queued=None):
+        """
+        Mark a task as queued with `priority`. `queued` is the time it was first queued (default: now), kept when a
+        task is queued again after a restart of the API, so it keeps its place in the queue.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE task SET state = ?, step = ?, priority = ?, queued = ?, updated = ?, started = NULL, "
+                "finished = NULL WHERE id = ?",
+                (TaskRegistry.QUEUED, "QUEUED", int(priority), queued or now, now, id),
+            )
+
+    def get_queue(self):
+        "Active tasks, in the order they were queued"
+        query = "SELECT * FROM task WHERE state IN ({}) ORDER BY COALESCE(queued, created), CAST(id AS INTEGER)".format(
+            ", ".join("?" * len(TaskRegistry.ACTIVE_STATES))
+        )
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, TaskRegistry.ACTIVE_STATES)]
+
+    def remove(self, id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM task WHERE id = ?", (id,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM task")
+
+    def get(self, id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM task WHERE id = ?", (id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_state(self, id):
+        task = self.get(id)
+        if task is None:
+            # Folder created outside the registry (e.g. by an older version). Register it on first access.
+            task = self.import_task_folder(id)
+        return task["state"] if task else None
+
+    def get_ids(self, states=None):
+        query = "SELECT id FROM task"
+        values = []
+        if states:
+            query += " WHERE state IN ({})".format(", ".join("?" * len(states)))
+            values = list(states)
+        query += " ORDER BY CAST(id AS INTEGER)"
+        with self._connect() as conn:
+            return [row["id"] for row in conn.execute(query, values)]
+
+    def get_all(self, states=None):
+        query = "SELECT * FROM task"
+        values = []
+        if states:
+            query += " WHERE state IN ({})".format(", ".join("?" * len(states)))
+            values = list(states)
+        query += " ORDER BY CAST(id AS INTEGER)"
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, values)]
+
+    def count_by_state(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM task GROUP BY state")
+            return {row["state"]: row["n"] for row in rows}
+
+    def _state_from_markers(self, task_dir):
+        if os.path.isfile(os.path.join(task_dir, "FAILED")):
+            return TaskRegistry.FAILED
+        elif os.path.isfile(os.path.join(task_dir, "SUCCESS")):
+            return TaskRegistry.SUCCESS
+        elif os.path.isfile(os.path.join(task_dir, "ACTIVE")):
+            return TaskRegistry.QUEUED
+        return TaskRegistry.CREATED
+
+    def import_task_folder(self, id):
+        task_dir = os.path.join(self.work_folder, id)
+        if not os.path.isdir(task_dir):
+            return None
+        state = self._state_from_markers(task_dir)
+        created = os.path.getmtime(task_dir)
+        task = {
+            "id": id,
+            "state": state,
+            "priority": 0,
+            "created": created,
+            "started": None,
+            "finished": created if state in TaskRegistry.FINISHED_STATES else None,
+            "updated": time.time(),
+            "step": read_last_status(os.path.join(task_dir, "STATUS")),
+        }
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO task (id, state, priority, created, started, finished, updated, step) "
+                "VALUES (:id, :state, :priority, :created, :started, :finished, :updated, :step)",
+                task,
+            )
+        return task
+
+    def import_task_folders(self):
+        """
+        One-time import of task folders created before the registry existed
+        """
+        logger.info("Importing existing task folders in {} into task registry".format(self.work_folder))
+        n = 0
+        for folder in glob.iglob(os.path.join(self.work_folder, "[0-9]*")):
+            if not os.path.isdir(folder):
+                continue
+            self.import_task_folder(os.path.split(folder)[1])
+            n += 1
+        self.set_meta("imported", str(time.time()))
+        logger.info("Imported {} task folders into task registry".format(n))
+        return n
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from config import config
+
+    parser = argparse.ArgumentParser(description="Import existing task folders into the task registry")
+    parser.add_argument("--registry", default=config["task_registry"], dest="registry")
+    parser.add_argument("--work-folder", default=config["work_folder"], dest="work_folder")
+    args = parser.parse_args()
+
+    TaskRegistry(args.registry, args.work_folder).import_task_folders()
@@ -1,5 +1,16 @@
-import sys
+"""
+Remove '*'-alleles (overlapping deletions) from a vcf in one streaming pass.
+
+Genotypes referencing the '*'-allele are changed to refer to the reference instead. Alleles no longer referenced by
+any genotype are removed from ALT, and INFO and FORMAT fields declared with Number=A, R or G are trimmed accordingly
+(like `bcftools view --trim-alt-alleles`). If no alternate allele remains, ALT is set to '.'. Records are written in
+input order, records without '*'-allele unchanged.
+"""
+
 import re
+import sys
+
+HEADER_NUMBER_PATTERN = re.compile(r"^##(INFO|FORMAT)=<ID=([^,>]+),Number=([^,>]+)")
 
 
 def order_genotype(gt):
@@ -17,46 +28,126 @@ def order_genotype(gt):
     return f"{min(gt0,gt1)}/{max(gt0,gt1)}"
 
 
-def remove_star_alleles(f):
-    it = iter(f)
+def split_genotype(gt):
+    "Split genotype in alleles and separators. E.g. 0|1 -> ['0', '1'], ['|']"
+    if "|" not in gt:
+        alleles = gt.split("/")
+        return alleles, ["/"] * (len(alleles) - 1)
+    if "/" not in gt:
+        alleles = gt.split("|")
+        return alleles, ["|"] * (len(alleles) - 1)
+    alleles, separators = [""], []
+    for c in gt:
+        if c == "/" or c == "|":
+            alleles.append("")
+            separators.append(c)
+        else:
+            alleles[-1] += c
+    return alleles, separators
+
+
+def join_genotype(alleles, separators):
+    gt = alleles[0]
+    for sep, allele in zip(separators, alleles[1:]):
+        gt += sep + allele
+    return gt
+
 
-    # Iterate over header
+def trim_values(value, number, keep, ploidy):
+    """
+    Keep the values of the alleles in `keep` (allele indexes, reference included) of a field with Number=A, R or G.
+    Values not matching the expected number are left as is.
+    """
+    if value == ".":
+        return value
+    values = value.split(",")
+    if number == "A":
+        indexes = [a - 1 for a in keep[1:]]
+    elif number == "R" or (number == "G" and ploidy == 1):
+        indexes = keep
+    else:
+        # Diploid genotype order: index of genotype j/k (j <= k) is k * (k + 1) / 2 + j
+        indexes = [keep[k] * (keep[k] + 1) // 2 + keep[j] for k in range(len(keep)) for j in range(k + 1)]
+    if not indexes:
+        return "."
+    if max(indexes) >= len(values):
+        return value
+    return ",".join(values[i] for i in indexes)
+
+
+def read_header(it, output):
+    "Write the header to output, and return the Number=A/R/G INFO and FORMAT fields as dicts of ID to Number"
+    numbers = {"INFO": {}, "FORMAT": {}}
     for l in it:
-        print(l.rstrip("\n"))
+        output.write(l)
+        m = HEADER_NUMBER_PATTERN.match(l)
+        if m and m.group(3) in ("A", "R", "G"):
+            numbers[m.group(1)][m.group(2)] = m.group(3)
         if l.startswith("#CHROM"):
             break
+    return numbers["INFO"], numbers["FORMAT"]
+
+
+def remove_star_alleles(f, output=sys.stdout):
+    it = iter(f)
+    info_numbers, format_numbers = read_header(it, output)
 
-    # Iterate over body
     for line in it:
-        columns = line.split("\t")
+        columns = line.rstrip("\n").split("\t")
+        # Fast check on the raw ALT column, most records have no '*'-allele
+        if "*" not in columns[4]:
+            output.write(line)
+            continue
         alts = columns[4].split(",")
-        if "*" not in alts:
-            print(line)
+        if "*" not in alts or len(columns) < 10:
+            output.write(line)
             continue
-
-        # We fetch the allele index here to modify the genotype only
-        # Leave the removal of the star allele to bcf-tools
-        allele_index = alts.index("*")
         fmat = columns[8].split(":")
         if "GT" not in fmat:
             # This shouldn't happen, but leave it to other tools to handle
-            print(line)
+            output.write(line)
             continue
 
+        # Change genotypes referring to the star allele to refer to the reference instead.
+        # Note: This is not correct, but the overlapping deletion should also be in the VCF with a complementing genotype
+        star = str(alts.index("*") + 1)
         gt_index = fmat.index("GT")
-        for i in range(9, len(columns)):
-            fmat_data = columns[i].rstrip("\n").split(":")
+        samples = [c.split(":") for c in columns[9:]]
+        genotypes = []
+        used = set()
+        for data in samples:
+            alleles, separators = split_genotype(data[gt_index])
+            alleles = ["0" if a == star else a for a in alleles]
+            used.update(alleles)
+            genotypes.append((alleles, separators))
+
+        # Remove alleles not seen in any genotype
+        keep = [0] + [i for i in range(1, len(alts) + 1) if str(i) in used]
+        new_index = {str(old): str(new) for new, old in enumerate(keep)}
+        new_index["."] = "."
+        columns[4] = ",".join(alts[i - 1] for i in keep[1:]) or "."
 
-            # Change genotype referring to star allele to refer to reference instead.
-            # Note: This is not correct, but the overlapping deletion should also be in the VCF with a complementing genotype
-            gt_removed_star_allele = re.sub(str(allele_index + 1), "0", fmat_data[gt_index])
+        trimmed = len(keep) < len(alts) + 1
+        if trimmed and info_numbers and columns[7] != ".":
+            fields = columns[7].split(";")
+            for i, field in enumerate(fields):
+                key, _, value = field.partition("=")
+                if key in info_numbers and value:
+                    # Ploidy of INFO fields with Number=G is not known, assume diploid
+                    fields[i] = "{}={}".format(key, trim_values(value, info_numbers[key], keep, 2))
+            columns[7] = ";".join(fields)
 
-            # Order genotype (e.g. 1/0 -> 0/1)
-            fmat_data[gt_index] = order_genotype(gt_removed_star_allele)
-            columns[i] = ":".join(fmat_data)
+        trimmed_formats = [(i, format_numbers[f]) for i, f in enumerate(fmat) if f in format_numbers] if trimmed else []
+        for i, (data, (alleles, separators)) in enumerate(zip(samples, genotypes)):
+            gt = join_genotype([new_index.get(a, a) for a in alleles], separators)
+            data[gt_index] = order_genotype(gt)
+            for field_index, number in trimmed_formats:
+                if field_index < len(data):
+                    data[field_index] = trim_values(data[field_index], number, keep, len(alleles))
+            columns[9 + i] = ":".join(data)
 
-        # Print out fixed line
-        print("\t".join(columns))
+        # Write out fixed line
+        output.write("\t".join(columns) + "\n")
 
 
 if __name__ == "__main__":
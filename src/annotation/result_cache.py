@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+
+
+logger = logging.getLogger("anno")
+
+
+def _hash_file(h, path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of annotation results.
+
+    Entries are keyed on a hash of the input, the regions, the data versions (sources.json and vcfanno config) and the
+    pipeline version, and hold the final output.vcf and original.vcf of a successful task. Entries are evicted when
+    older than `max_age` seconds (since last use), and oldest first when the total size exceeds `max_size` bytes.
+    """
+
+    OUTPUT_VCF = "output.vcf"
+    ORIGINAL_VCF = "original.vcf"
+
+    def __init__(self, path, max_age=None, max_size=None, version_files=None):
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+        self.version_files = version_files or []
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, input_file, input_type, input_regions=None, convert_only=False):
+        h = hashlib.sha256()
+        h.update("{}\0{}\0".format(input_type, int(bool(convert_only))).encode("utf-8"))
+        if os.path.islink(input_file):
+            # Input linked from the sample repo. Avoid reading the full file on the request path, and key on the file
+            # identity instead.
+            st = os.stat(input_file)
+            h.update("{}\0{}\0{}\0".format(os.path.realpath(input_file), st.st_size, st.st_mtime_ns).encode("utf-8"))
+        else:
+            _hash_file(h, input_file)
+        h.update(b"\0regions\0")
+        if input_regions:
+            _hash_file(h, input_regions)
+        for version_file in self.version_files:
+            h.update("\0{}\0".format(os.path.basename(version_file)).encode("utf-8"))
+            if os.path.isfile(version_file):
+                _hash_file(h, version_file)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """
+        Return the path to the cache entry for `key`, or None if not cached
+        """
+        entry = self._entry(key)
+        if not os.path.isfile(os.path.join(entry, ResultCache.OUTPUT_VCF)):
+            return None
+        # Touch the entry, eviction is based on last use
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        logger.info("Result cache hit (key={})".format(key))
+        return entry
+
+    def put(self, key, output_vcf, original_vcf):
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return entry
+
+        os.makedirs(self.path, exist_ok=True)
+        # Populate a temporary folder, and rename it into place to make the entry visible atomically
+        tmp_entry = os.path.join(self.path, ".tmp-{}".format(uuid.uuid4().hex))
+        os.mkdir(tmp_entry)
+        try:
+            for src, name in [(output_vcf, ResultCache.OUTPUT_VCF), (original_vcf, ResultCache.ORIGINAL_VCF)]:
+                # Copied, not linked: the task may still rewrite its step outputs (e.g. when restarted). Entries are
+                # only hard-linked from the cache into the folders of new tasks.
+                shutil.copyfile(os.path.realpath(src), os.path.join(tmp_entry, name))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        logger.info("Stored result in cache (key={})".format(key))
+        self.evict()
+        return entry
+
+    @staticmethod
+    def _size(entry):
+        size = 0
+        for f in os.listdir(entry):
+            size += os.path.getsize(os.path.join(entry, f))
+        return size
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith(".tmp-"):
+                # Left behind by an interrupted put
+                if now - os.path.getmtime(entry) > 3600:
+                    shutil.rmtree(entry, ignore_errors=True)
+                continue
+            try:
+                entries.append((os.path.getmtime(entry), ResultCache._size(entry), entry))
+            except OSError:
+                continue
+
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, entry in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_large = self.max_size is not None and total_size > self.max_size
+            if not (expired or too_large):
+                continue
+            logger.info("Evicting result cache entry {}".format(os.path.basename(entry)))
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
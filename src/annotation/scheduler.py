@@ -0,0 +1,206 @@
+"""
+Cost-aware task scheduler.
+
+Every task is submitted with its estimated runtime (see Task.estimate_runtime), from which it gets an allocation of
+cores (passed to the pipeline as NUM_VEP_PROCESSES/NUM_VCFANNO_PROCESSES) and memory. Tasks start as soon as their
+allocation fits in the core and memory budget of the host, so many small tasks or a few large tasks run concurrently,
+without oversubscribing the CPUs.
+
+Queued tasks are started shortest job first, with aging: the score of a task is its estimated runtime minus
+`aging` seconds for every second it has waited, so large tasks are not starved by a stream of small tasks. The task
+with the lowest score is started first. If it does not fit yet, no other task is started before it, except priority
+tasks, which may also use the `priority_cores` cores held back from the other tasks.
+
+At most `max_tasks` normal tasks run concurrently. Priority tasks are not counted, and one priority task is always
+started, even if the budget is used by other tasks (as the former dedicated priority worker).
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+logger = logging.getLogger("anno")
+
+
+class Job(object):
+    def __init__(self, id, func, runtime, priority, cores, memory, submitted):
+        self.id = id
+        self.func = func
+        self.runtime = runtime
+        self.priority = priority
+        self.cores = cores
+        self.memory = memory
+        self.submitted = submitted
+        self.future = Future()
+
+
+class Scheduler(object):
+    def __init__(
+        self,
+        cores,
+        memory,
+        max_tasks=0,
+        task_cores=None,
+        priority_cores=1,
+        core_runtime=300.0,
+        task_memory=4.0,
+        memory_per_core=1.0,
+        aging=2.0,
+        clock=time.time,
+    ):
+        """
+        `cores` and `memory` (GB) are the budget of the host, `max_tasks` limits the number of concurrent normal
+        (not priority) tasks (0: no limit). A task gets one core per `core_runtime` seconds of estimated runtime, at
+        most `task_cores` (default: all cores but the priority cores), and `task_memory` + `memory_per_core` GB per
+        core.
+        """
+        self.cores = cores
+        self.memory = memory
+        self.max_tasks = max_tasks
+        self.priority_cores = min(priority_cores, cores - 1)
+        self.task_cores = min(task_cores or cores, cores - self.priority_cores)
+        self.core_runtime = core_runtime
+        self.task_memory = task_memory
+        self.memory_per_core = memory_per_core
+        self.aging = aging
+        self.clock = clock
+        self.cores_used = 0
+        self.memory_used = 0.0
+        self._queue = []
+        self._running = set()
+        self._paused = False
+        self._lock = threading.Lock()
+
+    def allocation(self, runtime, priority=False):
+        "Cores and memory (GB) for a task with an estimated runtime of `runtime` seconds"
+        max_cores = self.task_cores + (self.priority_cores if priority else 0)
+        cores = max(1, min(max_cores, int(math.ceil(runtime / self.core_runtime))))
+        # A task always fits on an idle host
+        memory = min(self.task_memory + cores * self.memory_per_core, self.memory)
+        return cores, memory
+
+    def submit(self, id, func, runtime, priority=False, submitted=None):
+        """
+        Queue `func(id, cores)`. Returns a Future, done when the task finished. `submitted` is the time the task was
+        first queued (default: now), used for aging.
+        """
+        cores, memory = self.allocation(runtime, priority=priority)
+        job = Job(id, func, runtime, priority, cores, memory, self.clock() if submitted is None else submitted)
+        with self._lock:
+            # A restarted task replaces its queued job
+            self._remove(id)
+            self._queue.append(job)
+            logger.info(
+                "Queued task {} (estimated runtime {:.0f}s, {} cores, {:.1f} GB, priority={})".format(
+                    id, runtime, cores, memory, priority
+                )
+            )
+            self._dispatch()
+        return job.future
+
+    @contextmanager
+    def paused(self):
+        "Queue tasks without starting them, e.g. to order recovered tasks before any of them starts"
+        with self._lock:
+            self._paused = True
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._paused = False
+                self._dispatch()
+
+    def _remove(self, id):
+        for job in [job for job in self._queue if job.id == id]:
+            self._queue.remove(job)
+            job.future.cancel()
+
+    def cancel(self, id):
+        "Remove a task from the queue. Its Future is cancelled. Running tasks are not affected."
+        with self._lock:
+            self._remove(id)
+
+    def score(self, job, now=None):
+        now = self.clock() if now is None else now
+        return job.runtime - self.aging * (now - job.submitted)
+
+    def _fits(self, job):
+        if job.priority:
+            # One priority task always runs, also on a host too small to hold back priority cores
+            if not any(running.priority for running in self._running):
+                return True
+        elif self.max_tasks and sum(1 for running in self._running if not running.priority) >= self.max_tasks:
+            return False
+        cores = self.cores - self.cores_used - (0 if job.priority else self.priority_cores)
+        return job.cores <= cores and job.memory <= self.memory - self.memory_used
+
+    def _dispatch(self):
+        # Called with the lock held, when a task is queued or finished
+        if self._paused:
+            return
+        now = self.clock()
+        blocked = False
+        for job in sorted(self._queue, key=lambda job: self.score(job, now)):
+            if blocked and not job.priority:
+                continue
+            if not self._fits(job):
+                # Do not let tasks with a higher score overtake this task
+                blocked = blocked or not job.priority
+                continue
+            self._queue.remove(job)
+            self._running.add(job)
+            self.cores_used += job.cores
+            self.memory_used += job.memory
+            threading.Thread(target=self._run, args=(job,), name="task-{}".format(job.id), daemon=True).start()
+
+    def _run(self, job):
+        result, error = None, None
+        try:
+            if not job.future.set_running_or_notify_cancel():
+                return
+            try:
+                result = job.func(job.id, job.cores)
+            except BaseException as e:
+                logger.exception("Task {} failed".format(job.id))
+                error = e
+        finally:
+            # Release the resources before the Future is done, so waiters see them released
+            with self._lock:
+                self._running.remove(job)
+                self.cores_used -= job.cores
+                self.memory_used -= job.memory
+                self._dispatch()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def stats(self):
+        "Queue depth and resource use"
+        with self._lock:
+            now = self.clock()
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "cores": self.cores,
+                "cores_used": self.cores_used,
+                "memory": self.memory,
+                "memory_used": self.memory_used,
+                "queue": [
+                    {
+                        "id": job.id,
+                        "estimated_runtime": job.runtime,
+                        "priority": job.priority,
+                        "cores": job.cores,
+                        "waiting": now - job.submitted,
+                    }
+                    for job in sorted(self._queue, key=lambda job: self.score(job, now))
+                ],
+                "tasks": [
+                    {"id": job.id, "estimated_runtime": job.runtime, "priority": job.priority, "cores": job.cores}
+                    for job in self._running
+                ],
+            }
@@ -0,0 +1,125 @@
+"""
+Run a pipeline step concurrently on shards of a VCF.
+
+The input VCF is split into contiguous shards of roughly equal size (each with the full header), the command is run on
+every shard with a limited number of concurrent jobs, and the shard outputs are concatenated in input order. The header
+of the first shard output is used for the result.
+
+Usage:
+    shard_vcf.py --input in.vcf --output out.vcf --shards 8 --jobs 4 --workdir shards -- vep -i {input} -o {output}
+"""
+
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def split_vcf(input_vcf, workdir, shards):
+    """
+    Split input_vcf into at most `shards` contiguous shards of roughly equal size. Returns the list of shard files.
+    Empty shards are not written.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    shard_files = []
+    with open(input_vcf, "r") as input:
+        header = []
+        line = input.readline()
+        while line and line.startswith("#"):
+            header.append(line)
+            line = input.readline()
+        header = "".join(header)
+
+        data_size = max(1, os.path.getsize(input_vcf) - len(header.encode("utf-8")))
+        shard_size = data_size / shards
+        written = 0
+        fd = None
+        while line:
+            if fd is None or (written >= shard_size * len(shard_files) and len(shard_files) < shards):
+                if fd is not None:
+                    fd.close()
+                shard_file = os.path.join(workdir, "shard_{:04d}.vcf".format(len(shard_files)))
+                shard_files.append(shard_file)
+                fd = open(shard_file, "w")
+                fd.write(header)
+            fd.write(line)
+            written += len(line.encode("utf-8"))
+            line = input.readline()
+        if fd is not None:
+            fd.close()
+    return shard_files
+
+
+def concat_vcfs(shard_outputs, output_vcf):
+    with open(output_vcf, "w") as output:
+        for i, shard_output in enumerate(shard_outputs):
+            with open(shard_output, "r") as fd:
+                for line in fd:
+                    if line.startswith("#"):
+                        if i == 0:
+                            output.write(line)
+                        continue
+                    output.write(line)
+
+
+def run_shard(command, shard_file, stdout=False):
+    shard_output = shard_file[: -len(".vcf")] + ".out.vcf"
+    shard_log = shard_file[: -len(".vcf")] + ".log"
+    cmd = [arg.replace("{input}", shard_file).replace("{output}", shard_output) for arg in command]
+    with open(shard_log, "w") as log:
+        if stdout:
+            with open(shard_output, "w") as out:
+                returncode = subprocess.call(cmd, stdout=out, stderr=log)
+        else:
+            returncode = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+    return returncode, shard_output, shard_log
+
+
+def run_sharded(input_vcf, output_vcf, command, shards, jobs, workdir, stdout=False):
+    shard_files = split_vcf(input_vcf, workdir, shards)
+    if not shard_files:
+        raise RuntimeError("No records in {}".format(input_vcf))
+    print("Split {} into {} shards, running {} concurrently".format(input_vcf, len(shard_files), jobs))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda shard_file: run_shard(command, shard_file, stdout=stdout), shard_files))
+
+    failed = False
+    for shard_file, (returncode, _, shard_log) in zip(shard_files, results):
+        with open(shard_log, "r") as log:
+            print("## {} (exit code {}) ##".format(os.path.basename(shard_file), returncode))
+            print(log.read())
+        failed = failed or returncode != 0
+    if failed:
+        raise RuntimeError("One or more shards failed")
+
+    concat_vcfs([shard_output for _, shard_output, _ in results], output_vcf)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    argv = sys.argv[1:]
+    if "--" not in argv:
+        print(__doc__)
+        sys.exit(1)
+    i = argv.index("--")
+    argv, command = argv[:i], argv[i + 1 :]
+
+    parser = argparse.ArgumentParser(description="Run a command on shards of a VCF")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--shards", required=True, type=int)
+    parser.add_argument("--jobs", type=int, default=None, help="number of concurrent shards (default: --shards)")
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--stdout", action="store_true", help="command writes its output to stdout")
+    args = parser.parse_args(argv)
+
+    run_sharded(
+        args.input,
+        args.output,
+        command,
+        args.shards,
+        args.jobs or args.shards,
+        args.workdir,
+        stdout=args.stdout,
+    )
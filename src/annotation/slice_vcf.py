@@ -0,0 +1,174 @@
+"""
+Slice a sorted vcf on regions (bed), keeping whole decomposed multiallelic blocks.
+
+A record is kept if it overlaps a region (as `bedtools intersect -u`, the record spanning its REF allele), or if
+another record of its multiallelic block (records with the same OLD_MULTIALLELIC tag, added by `vt decompose`) does.
+The regions are indexed per contig as sorted, merged intervals, searched with binary search.
+
+The vcf is read in a single streaming pass. Records of a block are held back until the block is decided: kept as
+soon as one of its records overlaps a region, dropped when the input has passed the last position a record of the
+block can have (the end of the original multiallelic REF allele; normalization only moves records left, or right
+within the REF allele). Records are written in input order.
+
+Usage:
+    python3 src/annotation/slice_vcf.py --input input.vcf --regions regions.bed --output output.vcf
+"""
+
+import bisect
+import collections
+import logging
+import sys
+
+logger = logging.getLogger("anno")
+
+MULTIALLELIC_TAG = "OLD_MULTIALLELIC"
+
+
+class RegionIndex(object):
+    def __init__(self, intervals):
+        "`intervals`: iterable of (contig, start, end), 0-based and end exclusive"
+        by_contig = collections.defaultdict(list)
+        for contig, start, end in intervals:
+            by_contig[contig].append((start, end))
+        self.starts = {}
+        self.ends = {}
+        for contig, contig_intervals in by_contig.items():
+            starts, ends = [], []
+            for start, end in sorted(contig_intervals):
+                # Merge overlapping intervals, so the ends are sorted too
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[contig] = starts
+            self.ends[contig] = ends
+
+    @staticmethod
+    def from_bed(path):
+        def intervals():
+            with open(path) as f:
+                for l in f:
+                    if l.startswith(("#", "track", "browser")) or not l.strip():
+                        continue
+                    contig, start, end = l.split("\t", 3)[:3]
+                    yield contig, int(start), int(end)
+
+        return RegionIndex(intervals())
+
+    def overlaps(self, contig, start, end):
+        starts = self.starts.get(contig)
+        if not starts:
+            return False
+        # Last interval starting before the end
+        i = bisect.bisect_left(starts, end) - 1
+        return i >= 0 and self.ends[contig][i] > start
+
+
+def multiallelic_block(info):
+    "Return the OLD_MULTIALLELIC tag of the INFO column, or None"
+    if MULTIALLELIC_TAG not in info:
+        return None
+    for field in info.split(";"):
+        if field.startswith(MULTIALLELIC_TAG + "="):
+            return field
+    return None
+
+
+def block_end(block):
+    """
+    Return the last position a record of the block can have, from the tag value (contig:pos:REF/ALT/ALT). None if
+    the tag can not be parsed, the block then ends with the contig.
+    """
+    try:
+        _, pos, alleles = block.split("=", 1)[1].rsplit(":", 2)
+        return int(pos) + len(alleles.split("/")[0])
+    except ValueError:
+        return None
+
+
+class _Block(object):
+    __slots__ = ("keep", "contig", "end")
+
+    def __init__(self, contig, end):
+        self.keep = None
+        self.contig = contig
+        self.end = end
+
+
+def slice_vcf(input, regions, output):
+    """
+    Write the records of `input` (sorted) overlapping `regions` (RegionIndex), and their multiallelic blocks.
+    Returns the number of records written.
+    """
+    # Records in input order, as (line, block), where block is None for decided records
+    pending = collections.deque()
+    blocks = {}
+    written = 0
+
+    def flush():
+        nonlocal written
+        while pending:
+            line, block = pending[0]
+            if block is not None and block.keep is None:
+                break
+            pending.popleft()
+            if block is None or block.keep:
+                output.write(line)
+                written += 1
+
+    def expire(contig, pos):
+        # Blocks that can not get more records once the (sorted) input is at contig:pos
+        for tag, block in list(blocks.items()):
+            if block.contig != contig or (block.end is not None and block.end < pos):
+                if block.keep is None:
+                    block.keep = False
+                del blocks[tag]
+
+    for line in input:
+        if line.startswith("#"):
+            output.write(line)
+            continue
+        if not line.strip():
+            continue
+        contig, pos, _, ref, _, _, _, info = line.split("\t", 8)[:8]
+        pos = int(pos)
+        if blocks:
+            expire(contig, pos)
+
+        overlaps = regions.overlaps(contig, pos - 1, pos - 1 + len(ref))
+        tag = multiallelic_block(info)
+        if tag is None:
+            if overlaps:
+                pending.append((line, None))
+        else:
+            block = blocks.get(tag)
+            if block is None:
+                block = blocks[tag] = _Block(contig, block_end(tag))
+            if overlaps:
+                block.keep = True
+            pending.append((line, block))
+        flush()
+
+    # End of input, the remaining blocks are complete
+    for block in blocks.values():
+        if block.keep is None:
+            block.keep = False
+    flush()
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Slice vcf on regions, keeping whole multiallelic blocks")
+    parser.add_argument("--input", required=True, help="sorted input vcf")
+    parser.add_argument("--regions", required=True, help="regions (bed)")
+    parser.add_argument("--output", required=True, help="output vcf")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    regions = RegionIndex.from_bed(args.regions)
+    with open(args.input) as input, open(args.output, "w") as output:
+        written = slice_vcf(input, regions, output)
+    logger.info("Wrote {} records".format(written))
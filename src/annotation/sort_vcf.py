@@ -0,0 +1,217 @@
+"""
+Sort a vcf and remove duplicate lines, with the same output as `vcf-sort -c | uniq`.
+
+Most inputs (caller output) are already sorted. The input is read once: the lines are copied (without duplicate lines)
+while the records are sorted. From the first record out of order, the lines copied so far and the rest of the input
+are sorted with an external merge sort: the records are sorted in chunks of at most `chunk_size` bytes, written to
+temporary files and merged, so memory use is bounded for any input size.
+
+The order is that of `vcf-sort -c` (`sort -k1,1V -k2,2n`): contigs in natural order (1, 2, 10, MT, X), then
+position, then the whole line for records on the same position.
+
+Usage:
+    python3 src/annotation/sort_vcf.py --input input.vcf --output output.vcf
+"""
+
+import heapq
+import itertools
+import logging
+import re
+import shutil
+import sys
+import tempfile
+
+logger = logging.getLogger("anno")
+
+CHUNK_SIZE = 256 * 1024**2
+
+DIGITS_PATTERN = re.compile(r"(\d+)")
+# File name suffix, compared separately by version sort (e.g. .tar.gz)
+SUFFIX_PATTERN = re.compile(r"(?:\.[A-Za-z~][A-Za-z0-9~]*)*$")
+# Compares equal to the end of a string
+END = ((0,), 0)
+
+_CONTIG_KEYS = {}
+
+
+def _char_order(c):
+    # Character order of GNU version sort: '~' before the end of a string, letters before other characters
+    if c == "~":
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _version_key(s):
+    # Alternating non-digit parts (as character orders, terminated by the end of string order 0) and numbers
+    parts = DIGITS_PATTERN.split(s)
+    key = []
+    for i in range(0, len(parts), 2):
+        number = int(parts[i + 1]) if i + 1 < len(parts) else 0
+        key.append((tuple(_char_order(c) for c in parts[i]) + (0,), number))
+    while key and key[-1] == END:
+        key.pop()
+    key.append(END)
+    return tuple(key)
+
+
+def contig_key(chrom):
+    "Natural (version) sort key of a contig name, as `sort -V`"
+    key = _CONTIG_KEYS.get(chrom)
+    if key is None:
+        prefix = chrom[: SUFFIX_PATTERN.search(chrom).start()]
+        # Contigs with identical keys (e.g. 1 and 01) are not ordered by name, but by position and line
+        key = (_version_key(prefix), _version_key(chrom))
+        _CONTIG_KEYS[chrom] = key
+    return key
+
+
+def _position(pos):
+    # As `sort -n`: leading digits, 0 if none
+    i = 0
+    while i < len(pos) and pos[i].isdigit():
+        i += 1
+    return int(pos[:i]) if i else 0
+
+
+def record_key(line):
+    fields = line.split("\t", 2)
+    return (contig_key(fields[0]), _position(fields[1]) if len(fields) > 1 else 0, line)
+
+
+def _lines(f):
+    for l in f:
+        if not l.endswith("\n"):
+            l += "\n"
+        yield l
+
+
+def _while_sorted(lines, unsorted):
+    # Yield the lines while sorted (see is_sorted), the first line out of order is appended to `unsorted`
+    previous = None
+    for l in lines:
+        if l.startswith("#"):
+            if previous is not None:
+                unsorted.append(l)
+                return
+        elif l.strip():
+            key = record_key(l)
+            if previous is not None and key < previous:
+                unsorted.append(l)
+                return
+            previous = key
+        yield l
+
+
+def is_sorted(lines):
+    """
+    Check that the records are sorted, with all header lines before the first record. Blank lines are ignored.
+    """
+    unsorted = []
+    for _ in _while_sorted(lines, unsorted):
+        pass
+    return not unsorted
+
+
+def write_unique(lines, output):
+    "Write lines, skipping blank lines and lines identical to the previous line (as `uniq`)"
+    previous = None
+    for l in lines:
+        if l != previous and l.strip():
+            output.write(l)
+        previous = l
+
+
+def _sorted_chunk(records, tmp_dir):
+    records.sort(key=record_key)
+    f = tempfile.TemporaryFile("w+", dir=tmp_dir, prefix="sort_vcf_")
+    f.writelines(records)
+    f.seek(0)
+    return f
+
+
+def merge_sort(lines, output, chunk_size=CHUNK_SIZE, tmp_dir=None):
+    header = []
+    chunks = []
+    records = []
+    size = 0
+    try:
+        for l in lines:
+            if l.startswith("#"):
+                header.append(l)
+                continue
+            records.append(l)
+            size += len(l)
+            if size >= chunk_size:
+                chunks.append(_sorted_chunk(records, tmp_dir))
+                records = []
+                size = 0
+
+        write_unique(header, output)
+        if not chunks:
+            records.sort(key=record_key)
+            write_unique(records, output)
+        else:
+            if records:
+                chunks.append(_sorted_chunk(records, tmp_dir))
+            logger.info("Merging {} sorted chunks".format(len(chunks)))
+            write_unique(heapq.merge(*chunks, key=record_key), output)
+    finally:
+        for f in chunks:
+            f.close()
+
+
+def sort_vcf(input, output, chunk_size=CHUNK_SIZE, tmp_dir=None):
+    """
+    Sort `input` to `output` (paths, or '-' for stdin/stdout). Returns True if the input was already sorted.
+    """
+    f = sys.stdin if input == "-" else open(input, "r")
+    # Lines for standard output are kept in a temporary file until the input is known to be sorted
+    spool = tempfile.TemporaryFile("w+", dir=tmp_dir, prefix="sort_vcf_") if output == "-" else None
+    out = spool or open(output, "w+")
+    copied = None
+    try:
+        lines = _lines(f)
+        unsorted = []
+        write_unique(_while_sorted(lines, unsorted), out)
+        already_sorted = not unsorted
+        out.seek(0)
+        if not already_sorted:
+            # Sort the lines copied so far with the rest of the input
+            if spool is None:
+                copied = tempfile.TemporaryFile("w+", dir=tmp_dir, prefix="sort_vcf_")
+                shutil.copyfileobj(out, copied)
+                copied.seek(0)
+                out.seek(0)
+                out.truncate()
+            else:
+                copied = spool
+            all_lines = itertools.chain(copied, unsorted, lines)
+            merge_sort(all_lines, sys.stdout if spool else out, chunk_size=chunk_size, tmp_dir=tmp_dir)
+        elif spool is not None:
+            shutil.copyfileobj(spool, sys.stdout)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+        out.close()
+        if copied is not None:
+            copied.close()
+        if spool is not None:
+            sys.stdout.flush()
+    logger.info("Input {}sorted".format("already " if already_sorted else "not "))
+    return already_sorted
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sort vcf and remove duplicate lines (as vcf-sort -c | uniq)")
+    parser.add_argument("--input", default="-", help="input vcf (default: stdin)")
+    parser.add_argument("--output", default="-", help="output vcf (default: stdout)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="bytes of records sorted in memory")
+    parser.add_argument("--tmp-dir", default=None, help="directory for temporary files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    sort_vcf(args.input, args.output, chunk_size=args.chunk_size, tmp_dir=args.tmp_dir)
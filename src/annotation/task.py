@@ -1,17 +1,26 @@
 import errno
-import glob
+import json
 import logging
 import os
 import shutil
 import subprocess
+import threading
 import time
+import zlib
 from collections import OrderedDict
+from concurrent.futures import CancelledError
 from functools import wraps
 
 import psutil
 from config import config
+from . import inotify
 from .command import Command
-from api.util.util import validate_target
+from .pipeline import TIMINGS_FILE
+from .registry import TaskRegistry, read_last_status
+from .result_cache import ResultCache
+from .scheduler import Scheduler
+from .vcf_index import get_index
+from api.util.util import SpooledFile, validate_target
 
 
 logger = logging.getLogger("anno")
@@ -59,6 +68,186 @@ def mkdir_p(path):
             raise
 
 
+def _remove_task_outputs(task_dir, resume):
+    "Remove the status and outputs of an interrupted or finished task, before it is queued again"
+    # Step folders are kept when resuming. Steps completed with unchanged input are then skipped by annotate.sh
+    if not resume:
+        for f in os.listdir(task_dir):
+            if os.path.isdir(os.path.join(task_dir, f)):
+                shutil.rmtree(os.path.join(task_dir, f))
+
+    for f in ["STATUS", "SUCCESS", "FAILED", "output.vcf", "output.vcf.gz", "output.vcf.gz.tbi", "output.vcf.idx"]:
+        if os.path.isfile(os.path.join(task_dir, f)):
+            os.unlink(os.path.join(task_dir, f))
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry():
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            mkdir_p(config["work_folder"])
+            _REGISTRY = TaskRegistry(config["task_registry"], config["work_folder"])
+    return _REGISTRY
+
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def get_scheduler():
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = Scheduler(**config["scheduler"])
+            logger.info(
+                "Initiated scheduler with {} cores, {:.1f} GB memory (max tasks: {})".format(
+                    _SCHEDULER.cores, _SCHEDULER.memory, _SCHEDULER.max_tasks or "no limit"
+                )
+            )
+    return _SCHEDULER
+
+
+# Completion events for tasks queued in this process, set by Task.run/Task.cancel when the task finishes.
+# Waiters block on these instead of polling the task folder.
+_COMPLETION_EVENTS = dict()
+_COMPLETION_LOCK = threading.Lock()
+
+
+def _register_completion(id):
+    with _COMPLETION_LOCK:
+        _COMPLETION_EVENTS[id] = threading.Event()
+
+
+def _notify_completion(id):
+    with _COMPLETION_LOCK:
+        event = _COMPLETION_EVENTS.pop(id, None)
+    if event is not None:
+        event.set()
+
+
+# Lines appended to a streamed result, after the records (see Task.stream_result)
+STREAM_TRAILER = "##ANNO_STATUS={}\n"
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _parse_timestamp(timestamp):
+    # STATUS timestamps have nanoseconds (annotate.sh) or microseconds (pipeline.py)
+    return time.mktime(time.strptime(timestamp[:19], "%Y-%m-%d %H:%M:%S")) + float("0" + timestamp[19:])
+
+
+def _streamed_output(task_dir):
+    """
+    Return the output file of the final annotation step (VCFANNO, or VARIANT_CACHE_MERGE with the variant cache),
+    once the step writes it in this run (not left from a previous run). None until then.
+    """
+    try:
+        with open(os.path.join(task_dir, "STATUS")) as f:
+            lines = [l.rstrip("\n").split("\t") for l in f if l.strip()]
+    except IOError:
+        return None
+    steps = [l[1] for l in lines if len(l) == 3]
+    step = "VARIANT_CACHE_MERGE" if "VARIANT_CACHE_SPLIT" in steps else "VCFANNO"
+    started = None
+    for timestamp, name, mode in (l for l in lines if len(l) == 3):
+        if name == step and mode == "STARTED":
+            started = _parse_timestamp(timestamp)
+        elif name == step and mode in ["DONE", "SKIPPED"]:
+            started = 0
+    output = os.path.join(task_dir, step, "output.vcf")
+    # File timestamps can lag the clock by a few milliseconds
+    if started is None or not os.path.isfile(output) or os.path.getmtime(output) < started - 1:
+        return None
+    return output
+
+
+_RESULT_CACHE = None
+
+
+def get_result_cache():
+    global _RESULT_CACHE
+    with _REGISTRY_LOCK:
+        if _RESULT_CACHE is None:
+            _RESULT_CACHE = ResultCache(
+                config["result_cache"]["path"],
+                max_age=config["result_cache"]["max_age"],
+                max_size=config["result_cache"]["max_size"],
+                version_files=[
+                    os.path.join(config["anno_data"], "sources.json"),
+                    os.path.join(config["anno_data"], "vcfanno_config.toml"),
+                    config["version_file"],
+                ],
+            )
+    return _RESULT_CACHE
+
+
+# Bytes of records read to estimate the number of records of an input
+ESTIMATE_SAMPLE_SIZE = 1024 * 1024
+
+
+def _read_uncompressed(path, chunk_size=64 * 1024):
+    """
+    Yield (data, position) for the chunks of a file, decompressed if gzip (or BGZF) compressed. `position` is the
+    number of bytes of the file read.
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+        f.seek(0)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+        position = 0
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            position += len(chunk)
+            if decompressor is None:
+                yield chunk, position
+                continue
+            data = b""
+            while chunk:
+                data += decompressor.decompress(chunk)
+                chunk = decompressor.unused_data
+                if chunk:
+                    # Next gzip member
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            yield data, position
+
+
+def estimate_record_count(path, sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    Estimate the number of records (non-empty lines after the lines starting with '#') of a file, from its size and the
+    average length of the records in the first `sample_size` bytes after the header. Exact for smaller files. The
+    uncompressed size of gzip compressed files is estimated from the compression ratio of the bytes read.
+    """
+    size = os.path.getsize(path)
+    header_size = 0
+    sampled = 0
+    records = 0
+    read = 0
+    rest = b""
+    for data, position in _read_uncompressed(path):
+        read += len(data)
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            if records == 0 and (line.startswith(b"#") or not line.strip()):
+                header_size += len(line) + 1
+                continue
+            sampled += len(line) + 1
+            if line.strip():
+                records += 1
+            if sampled >= sample_size:
+                return int(round(records * (read * float(size) / position - header_size) / sampled))
+    if rest.strip() and not (records == 0 and rest.startswith(b"#")):
+        records += 1
+    return records
+
+
+def is_priority_runtime(runtime):
+    "Whether a task with an estimated runtime of `runtime` seconds may run in the priority queue"
+    return runtime <= config["priority"]["max_runtime"]
+
+
 def generate_id():
     id = str(int(time.time() * 1e6))
     return id
@@ -68,10 +257,9 @@ class Task(object):
     @staticmethod
     def write_target_files(work_dir, target_data):
         target_files = dict()
-        for k, (filename, content) in target_data["files"].items():
-            filename = os.path.join(work_dir, filename)
-            with open(filename, "w") as f:
-                f.write(content)
+        for k, upload in target_data["files"].items():
+            filename = os.path.join(work_dir, upload.filename)
+            upload.move(filename)
             target_files[k] = filename
 
         target_env = dict()
@@ -80,6 +268,52 @@ class Task(object):
 
         return target_env
 
+    @staticmethod
+    def lookup_result_cache(task_dir, input_file, input_type, input_regions=None, convert_only=False):
+        """
+        Look up the task input in the result cache. On a hit, the cached files are linked into the task folder, and
+        the path to the cache entry is returned.
+        """
+        if not config["result_cache"]["enabled"]:
+            return None
+        result_cache = get_result_cache()
+        key = result_cache.key(input_file, input_type, input_regions=input_regions, convert_only=convert_only)
+        with open(os.path.join(task_dir, "RESULT_CACHE_KEY"), "w") as f:
+            f.write(key)
+
+        entry = result_cache.get(key)
+        if entry is None:
+            return None
+        try:
+            for name in [ResultCache.OUTPUT_VCF, ResultCache.ORIGINAL_VCF]:
+                dst = os.path.join(task_dir, "cached_" + name)
+                try:
+                    os.link(os.path.join(entry, name), dst)
+                except OSError:
+                    shutil.copyfile(os.path.join(entry, name), dst)
+        except OSError:
+            # Entry evicted in the meantime
+            logger.warning("Unable to use result cache entry {}, running annotation".format(entry))
+            for name in [ResultCache.OUTPUT_VCF, ResultCache.ORIGINAL_VCF]:
+                if os.path.isfile(os.path.join(task_dir, "cached_" + name)):
+                    os.unlink(os.path.join(task_dir, "cached_" + name))
+            return None
+        return entry
+
+    @staticmethod
+    def store_result_cache(task_dir):
+        key_file = os.path.join(task_dir, "RESULT_CACHE_KEY")
+        if not config["result_cache"]["enabled"] or not os.path.isfile(key_file):
+            return
+        if os.path.isfile(os.path.join(task_dir, "cached_output.vcf")):
+            return
+        with open(key_file, "r") as f:
+            key = f.read().strip()
+        try:
+            get_result_cache().put(key, os.path.join(task_dir, "output.vcf"), os.path.join(task_dir, "original.vcf"))
+        except OSError:
+            logger.exception("Unable to store result of {} in result cache".format(task_dir))
+
     @staticmethod
     def create_task(
         vcf=None,
@@ -95,6 +329,7 @@ class Task(object):
         mkdir_p(task_dir)
 
         priority = False
+        runtime = None
         target_env = dict(target_data["variables"])
         target_env.update(Task.write_target_files(task_dir, target_data))
 
@@ -105,24 +340,29 @@ class Task(object):
         if regions is not None:
             input_regions = os.path.join(task_dir, "regions.bed")
 
-            with open(input_regions, "w") as f:
-                f.write(regions)
+            if isinstance(regions, SpooledFile):
+                regions.move(input_regions)
+            else:
+                with open(input_regions, "w") as f:
+                    f.write(regions)
 
         if vcf:
             input_vcf = os.path.join(task_dir, "input.vcf")
-            if os.path.isfile(vcf):
+            # Uploaded files are moved into the task folder, other files (e.g. samples) are linked
+            if isinstance(vcf, SpooledFile):
+                vcf.move(input_vcf)
+            elif os.path.isfile(vcf):
                 os.symlink(vcf, input_vcf)
-                line_count = int(
-                    subprocess.check_output(
-                        "wc -l {} | cut -d' ' -f1".format(vcf), shell=True
-                    )
-                )
-                priority = line_count < 1000
             else:
                 with open(input_vcf, "w") as f:
                     f.write(vcf)
-                priority = vcf.count("\n") < 1000
 
+            cached_result = Task.lookup_result_cache(
+                task_dir, input_vcf, "vcf", input_regions=input_regions, convert_only=convert_only
+            )
+            runtime = Task.estimate_input_runtime(
+                input_vcf, "vcf", convert_only=convert_only, cached=bool(cached_result)
+            )
             Command.create_from_vcf(
                 task_dir,
                 input_vcf,
@@ -130,15 +370,25 @@ class Task(object):
                 convert_only=convert_only,
                 target=target,
                 target_env=target_env,
+                cached_result=cached_result,
+                engine=config["pipeline_engine"],
             )
 
         elif hgvsc:
 
             input_hgvsc = os.path.join(task_dir, "input.txt")
-            with open(input_hgvsc, "w") as f:
-                f.write(hgvsc)
-            priority = hgvsc.count("\n") < 100
+            if isinstance(hgvsc, SpooledFile):
+                hgvsc.move(input_hgvsc)
+            else:
+                with open(input_hgvsc, "w") as f:
+                    f.write(hgvsc)
 
+            cached_result = Task.lookup_result_cache(
+                task_dir, input_hgvsc, "hgvsc", input_regions=input_regions, convert_only=convert_only
+            )
+            runtime = Task.estimate_input_runtime(
+                input_hgvsc, "hgvsc", convert_only=convert_only, cached=bool(cached_result)
+            )
             Command.create_from_hgvsc(
                 task_dir,
                 input_hgvsc,
@@ -146,19 +396,65 @@ class Task(object):
                 convert_only=convert_only,
                 target=target,
                 target_env=target_env,
+                cached_result=cached_result,
+                engine=config["pipeline_engine"],
             )
         else:
             raise RuntimeError("Missing data for argument vcf or hgvsc")
 
+        priority = is_priority_runtime(runtime)
+        get_registry().add(task_id, priority, estimated_runtime=runtime)
         return task_id, priority
 
+    @staticmethod
+    def estimate_runtime(variants, input_type, convert_only=False, cached=False):
+        "Estimated runtime (seconds) of a task with `variants` input variants (lines for hgvsc), see config['priority']"
+        if cached:
+            # Result reused from the result cache
+            return 0.0
+        cost = config["priority"]
+        runtime = cost["task_seconds"]
+        if input_type == "hgvsc":
+            runtime += variants * cost["conversion_seconds_per_hgvsc"]
+        if not convert_only:
+            runtime += variants * cost["vep_seconds_per_variant"]
+        return runtime
+
+    @staticmethod
+    def estimate_input_runtime(input_file, input_type, convert_only=False, cached=False):
+        variants = estimate_record_count(input_file)
+        runtime = Task.estimate_runtime(variants, input_type, convert_only=convert_only, cached=cached)
+        logger.info(
+            "Estimated runtime {:.0f}s for {} ({} variants)".format(runtime, os.path.basename(input_file), variants)
+        )
+        return runtime
+
+    @staticmethod
+    @check_task(provide_task_dir=True)
+    def get_estimated_runtime(id, task_dir=None):
+        "Estimated runtime stored in the registry, or estimated from the input of tasks registered without it"
+        task = get_registry().get(id)
+        if task and task.get("estimated_runtime") is not None:
+            return task["estimated_runtime"]
+        for name, input_type in [("input.vcf", "vcf"), ("input.txt", "hgvsc")]:
+            input_file = os.path.join(task_dir, name)
+            if os.path.isfile(input_file):
+                return Task.estimate_input_runtime(input_file, input_type)
+        return config["priority"]["task_seconds"]
+
     @staticmethod
     @check_task(provide_task_dir=True)
-    def run(id, task_dir=None):
+    def run(id, cores=None, task_dir=None):
         if not Task.is_finished(id):
+            get_registry().set_state(id, TaskRegistry.RUNNING)
+            env = dict(os.environ)
+            if cores:
+                # Cores allocated by the scheduler
+                env["NUM_VEP_PROCESSES"] = env["NUM_VCFANNO_PROCESSES"] = str(cores)
             p = subprocess.Popen(
                 ["bash", os.path.join(task_dir, "cmd.sh")],
                 stdout=None if config["verbose"] else open("/dev/null", "a"),
+                env=env,
             )
             with open(os.path.join(task_dir, "PID"), "w") as f:
                 f.write(str(p.pid))
@@ -173,61 +469,51 @@ class Task(object):
                 return
 
             os.unlink(os.path.join(task_dir, "ACTIVE"))
-            if p.returncode == 0:
-                subprocess.call(
-                    "touch {}".format(os.path.join(task_dir, "SUCCESS")), shell=True
-                )
-            else:
-                subprocess.call(
-                    "touch {}".format(os.path.join(task_dir, "FAILED")), shell=True
-                )
+            state = TaskRegistry.SUCCESS if p.returncode == 0 else TaskRegistry.FAILED
+            # Update the registry before the marker file, which wakes waiters in other processes (see wait_for_task)
+            get_registry().set_state(id, state, step=read_last_status(os.path.join(task_dir, "STATUS")))
+            subprocess.call("touch {}".format(os.path.join(task_dir, state)), shell=True)
+            _notify_completion(id)
+            # After waiters are woken, they do not need to wait for the result to be copied into the cache
+            if state == TaskRegistry.SUCCESS:
+                Task.store_result_cache(task_dir)
 
     @staticmethod
     def get_all_task_ids():
-        pattern = config["work_folder"] + "/[0-9]*"
-        ids = []
-        for folder in glob.iglob(pattern):
-            if not os.path.isdir(folder):
-                continue
-            id = os.path.split(folder)[1]
-            ids.append(id)
-        return ids
+        return get_registry().get_ids()
 
     @staticmethod
     def get_active_task_ids():
-        return [id for id in Task.get_all_task_ids() if not Task.is_finished(id)]
+        return get_registry().get_ids(TaskRegistry.ACTIVE_STATES)
 
     @staticmethod
     def get_failed_task_ids():
-        return [id for id in Task.get_all_task_ids() if Task.is_failed(id)]
+        return get_registry().get_ids([TaskRegistry.FAILED])
 
     @staticmethod
     def get_successful_task_ids():
-        return [id for id in Task.get_all_task_ids() if Task.is_successful(id)]
+        return get_registry().get_ids([TaskRegistry.SUCCESS])
 
     @staticmethod
     @check_task(provide_task_dir=True)
-    def queue(id, priority, wait=False, task_dir=None):
+    def queue(id, priority, wait=False, queued=None, task_dir=None):
         subprocess.call("touch {}/ACTIVE".format(task_dir), shell=True)
         ts = subprocess.check_output("date '+%Y-%m-%d %H:%M:%S.%N'", shell=True)
         status_file = os.path.join(task_dir, "STATUS")
         with open(status_file, "w") as f:
             f.write("\t".join([ts.decode("utf-8").strip(), "QUEUED", ""]) + "\n")
-        from api import WORKERPOOL
-
-        if not priority:
-            logger.info("NO PRIORITY: NORMAL QUEUE (id={})".format(id))
-            worker = WORKERPOOL["NORMAL"].apply_async(Task.run, (id,))
-        else:
-            if len(WORKERPOOL["NORMAL"]._cache) < WORKERPOOL["NORMAL"]._processes:
-                logger.info("PRIORITY: NORMAL QUEUE (id={})".format(id))
-                worker = WORKERPOOL["NORMAL"].apply_async(Task.run, (id,))
-            else:
-                logger.info("PRIORITY: PRIORITY QUEUE (id={})".format(id))
-                worker = WORKERPOOL["PRIORITY"].apply_async(Task.run, (id,))
+        get_registry().queue(id, priority, queued=queued)
+        _register_completion(id)
+        future = get_scheduler().submit(
+            id, Task.run, Task.get_estimated_runtime(id), priority=priority, submitted=queued
+        )
 
         if wait:
-            worker.get()
+            try:
+                future.result()
+            except CancelledError:
+                # Cancelled or restarted before it started
+                pass
 
     @staticmethod
     @check_task(provide_task_dir=True)
@@ -237,9 +523,7 @@ class Task(object):
             return {}
         else:
             if not full:
-                status = subprocess.check_output(["tail", "-1", status_file]).decode("utf-8").strip()
-                status = " ".join(status.split("\t")[1:])
-                return {id: status}
+                return {id: read_last_status(status_file)}
             else:
                 d = OrderedDict()
                 with open(status_file, "rt") as s:
@@ -247,43 +531,129 @@ class Task(object):
                         vals = l.strip().split("\t")
                         k, v = vals[0], " ".join(vals[1:])
                         d[k] = v
-                return {
-                    id: {
-                        "status": d,
-                        "active": not Task.is_finished(id),
-                        "error": Task.is_failed(id),
-                    }
+                status = {
+                    "status": d,
+                    "active": not Task.is_finished(id),
+                    "error": Task.is_failed(id),
                 }
+                # Per-step timings are only available for tasks run by the Python pipeline engine
+                timings_file = os.path.join(task_dir, TIMINGS_FILE)
+                if os.path.isfile(timings_file):
+                    with open(timings_file, "r") as f:
+                        status["timings"] = json.load(f, object_pairs_hook=OrderedDict)
+                return {id: status}
         return {}
 
     @staticmethod
     def get_status_all(full=False):
+        if full:
+            status = dict()
+            for id in Task.get_all_task_ids():
+                status.update(Task.get_status(id, full=full))
+            return status
+
+        # The last status of finished tasks is stored in the registry, only active tasks need to read their STATUS file
         status = dict()
-        for id in Task.get_all_task_ids():
-            status.update(Task.get_status(id, full=full))
+        for task in get_registry().get_all():
+            if task["state"] in TaskRegistry.ACTIVE_STATES:
+                task["step"] = read_last_status(os.path.join(config["work_folder"], task["id"], "STATUS"))
+            if task["step"] is not None:
+                status[task["id"]] = task["step"]
         return status
 
     @staticmethod
     @check_task(provide_task_dir=True)
-    def get_result(id, task_dir=None):
-        return os.path.join(task_dir, "output.vcf")
+    def get_result(id, compressed=False, task_dir=None):
+        """
+        Path of the output vcf. With `compressed`, the BGZF compressed output (output.vcf.gz, written with the bgzip
+        option of the pipeline), or None if not available. Its tabix index is given by `get_result_index`.
+        """
+        if not compressed:
+            return os.path.join(task_dir, "output.vcf")
+        result = os.path.join(task_dir, "output.vcf.gz")
+        return result if os.path.isfile(result) else None
 
     @staticmethod
-    @check_task()
-    def is_finished(id):
-        return Task.is_failed(id) or Task.is_successful(id)
+    @check_task(provide_task_dir=True)
+    def get_result_index(id, task_dir=None):
+        "Path of the tabix index of the compressed output vcf, or None if not available"
+        index = os.path.join(task_dir, "output.vcf.gz.tbi")
+        return index if os.path.isfile(index) else None
 
     @staticmethod
     @check_task(provide_task_dir=True)
-    def is_failed(id, task_dir=None):
-        failed_file = os.path.join(task_dir, "FAILED")
-        return os.path.isfile(failed_file)
+    def query_result(id, regions, task_dir=None):
+        """
+        Header and records of the output vcf overlapping `regions` (contig, start, end; 1-based, inclusive), as lines.
+        Uses the coordinate index built at the end of the pipeline (built here if missing, e.g. for older tasks).
+        """
+        result = os.path.join(task_dir, "output.vcf")
+        index = get_index(result)
+        with open(result, "rb") as f:
+            yield index.header(f)
+            for line in index.query_regions(f, regions):
+                yield line
 
     @staticmethod
     @check_task(provide_task_dir=True)
-    def is_successful(id, task_dir=None):
-        success_file = os.path.join(task_dir, "SUCCESS")
-        return os.path.isfile(success_file)
+    def stream_result(id, poll_interval=0.5, task_dir=None):
+        """
+        Yield the output vcf in chunks while the task runs, starting as soon as the final annotation step writes its
+        output. The output is followed until the task finishes, and then ended with a line with the state of the task
+        (STREAM_TRAILER). If the task finishes before the final step started (e.g. conversion only, result cache),
+        output.vcf is sent when done.
+        """
+        f = None
+        last = b"\n"
+        try:
+            while True:
+                # Check the state before reading, so all output written before the task finished is read
+                finished = Task.is_finished(id)
+                if f is None and not finished:
+                    streamed = _streamed_output(task_dir)
+                    if streamed is not None:
+                        f = open(streamed, "rb")
+                data = f.read(STREAM_CHUNK_SIZE) if f is not None else b""
+                if data:
+                    last = data
+                    yield data
+                elif finished:
+                    break
+                else:
+                    time.sleep(poll_interval)
+
+            successful = Task.is_successful(id)
+            if successful and f is None:
+                with open(Task.get_result(id), "rb") as f:
+                    for data in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                        last = data
+                        yield data
+            elif successful and os.path.realpath(f.name) != os.path.realpath(Task.get_result(id)):
+                logger.error("Streamed {}, but the result of task {} is {}".format(f.name, id, Task.get_result(id)))
+                successful = False
+        finally:
+            if f is not None:
+                f.close()
+
+        if not last.endswith(b"\n"):
+            yield b"\n"
+        state = TaskRegistry.SUCCESS if successful else TaskRegistry.FAILED
+        yield STREAM_TRAILER.format(state).encode()
+
+    @staticmethod
+    @check_task()
+    def is_finished(id):
+        return get_registry().get_state(id) in TaskRegistry.FINISHED_STATES
+
+    @staticmethod
+    @check_task()
+    def is_failed(id):
+        return get_registry().get_state(id) == TaskRegistry.FAILED
+
+    @staticmethod
+    @check_task()
+    def is_successful(id):
+        return get_registry().get_state(id) == TaskRegistry.SUCCESS
 
     @staticmethod
     @check_task(provide_task_dir=True)
@@ -305,19 +675,37 @@ class Task(object):
         return log
 
     @staticmethod
-    @check_task()
-    def wait_for_task(id):
+    @check_task(provide_task_dir=True)
+    def wait_for_task(id, task_dir=None):
         logger.info("Waiting for task to finish (task_id=%s)" % id)
-        n = 0
-        while not Task.is_finished(id):
-            time.sleep(0.5)
-            n += 1
-            if n % 200 == 0:
-                logger.warning(
-                    "Task with id {} appears to be taking longer than expected...".format(
-                        id
-                    )
+
+        def warn():
+            logger.warning(
+                "Task with id {} appears to be taking longer than expected...".format(
+                    id
                 )
+            )
+
+        # Fetch the event before checking the state, so that a completion in between is not missed
+        with _COMPLETION_LOCK:
+            event = _COMPLETION_EVENTS.get(id)
+        if Task.is_finished(id):
+            return
+
+        if event is not None:
+            # Task is run by this process
+            while not event.wait(100):
+                warn()
+        elif inotify.available():
+            # Task is run by another process, wait for the marker files written on completion
+            inotify.wait_for_files(task_dir, ["SUCCESS", "FAILED"], timeout=100, on_timeout=warn)
+        else:
+            n = 0
+            while not Task.is_finished(id):
+                time.sleep(0.5)
+                n += 1
+                if n % 200 == 0:
+                    warn()
 
     @staticmethod
     @check_task(provide_task_dir=True)
@@ -327,6 +715,7 @@ class Task(object):
         pid_file = os.path.join(task_dir, "PID")
         status_file = os.path.join(task_dir, "STATUS")
 
+        get_scheduler().cancel(id)
         if os.path.isfile(pid_file):
             with open(pid_file, "r") as f:
                 pid = f.read().strip()
@@ -338,12 +727,14 @@ class Task(object):
         except OSError:
             pass
 
+        get_registry().set_state(id, TaskRegistry.FAILED, step="CANCELLED")
         subprocess.call("touch {}".format(os.path.join(task_dir, "FAILED")), shell=True)
+        _notify_completion(id)
         assert Task.is_finished(id), "Task {} not finished correctly".format(id)
 
         ts = subprocess.check_output("date '+%Y-%m-%d %H:%M:%S.%N'", shell=True)
         with open(status_file, "a") as f:
-            f.write("\t".join([ts.strip(), "CANCELLED", ""]) + "\n")
+            f.write("\t".join([ts.decode("utf-8").strip(), "CANCELLED", ""]) + "\n")
 
     @staticmethod
     @check_task(provide_task_dir=True)
@@ -352,21 +743,56 @@ class Task(object):
             Task.cancel(id)
 
         shutil.rmtree(task_dir)
+        get_registry().remove(id)
 
     @staticmethod
     @check_task(provide_task_dir=True)
-    def restart(id, priority=False, task_dir=None):
-        logger.info("Restarting task {}".format(id))
+    def restart(id, priority=False, resume=None, queued=None, task_dir=None):
+        if resume is None:
+            resume = config["resume_tasks"]
+        logger.info("Restarting task {} (resume={})".format(id, resume))
         # Remove files generated by interrupted or finished task
         if not Task.is_finished(id):
             Task.cancel(id)
+        _remove_task_outputs(task_dir, resume)
+        Task.queue(id, priority, queued=queued)
 
-        for f in os.listdir(task_dir):
-            if os.path.isdir(os.path.join(task_dir, f)):
-                shutil.rmtree(os.path.join(task_dir, f))
-
-        for f in ["STATUS", "SUCCESS", "FAILED", "output.vcf"]:
-            if os.path.isfile(os.path.join(task_dir, f)):
-                os.unlink(os.path.join(os.path.join(task_dir, f)))
+    @staticmethod
+    @check_task(provide_task_dir=True)
+    def recover(id, priority=False, queued=None, task_dir=None):
+        """
+        Queue a task that was active when the API stopped. Unlike restart, the task is not cancelled, and stays queued
+        in the registry. Its pipeline is killed if still running (e.g. only the API process was restarted), so it is not
+        run twice in the same task folder.
+        """
+        logger.info("Recovering task {}".format(id))
+        pid_file = os.path.join(task_dir, "PID")
+        if os.path.isfile(pid_file):
+            with open(pid_file, "r") as f:
+                pid = int(f.read().strip())
+            try:
+                # The PID may have been reused by another process since the task ran
+                running = os.path.join(task_dir, "cmd.sh") in psutil.Process(pid).cmdline()
+            except psutil.Error:
+                running = False
+            if running:
+                logger.info("Killing pipeline of task {} (PID {})".format(id, pid))
+                _kill_recursive(pid)
+            os.unlink(pid_file)
+        if os.path.isfile(os.path.join(task_dir, "ACTIVE")):
+            os.unlink(os.path.join(task_dir, "ACTIVE"))
+        _remove_task_outputs(task_dir, config["resume_tasks"])
+        Task.queue(id, priority, queued=queued)
 
-        Task.queue(id, priority)
+    @staticmethod
+    def recover_active_tasks():
+        """
+        Queue the tasks that were active when the API stopped, from the queue in the registry. Tasks keep their
+        priority and place in the queue (the time they were first queued), and are all queued before any of them
+        starts.
+        """
+        queue = get_registry().get_queue()
+        logger.info("Recovering {} active tasks".format(len(queue)))
+        with get_scheduler().paused():
+            for task in queue:
+                Task.recover(task["id"], priority=bool(task["priority"]), queued=task["queued"] or task["created"])
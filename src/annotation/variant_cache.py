@@ -0,0 +1,282 @@
+"""
+Per-variant cache of the INFO fields added by the annotation steps (VEP and vcfanno).
+
+The pipeline splits its input in records with cached annotation and records without (`split`). Only the latter are
+annotated, and the two sets are merged back in input order (`merge`), storing the new annotations in the cache.
+
+The cache is keyed on (CHROM, POS, REF, ALT), with one database per data version. The data version is a hash of the
+annotation data sources (sources.json), the vcfanno config and the pipeline version, so the cache is invalidated
+whenever one of these change.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS variant (
+    key TEXT PRIMARY KEY,
+    annotation TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS header (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    line TEXT NOT NULL
+);
+"""
+
+BATCH_SIZE = 900
+
+
+def data_version(version_files):
+    h = hashlib.sha256()
+    for version_file in version_files:
+        h.update("{}\0".format(os.path.basename(version_file)).encode("utf-8"))
+        if os.path.isfile(version_file):
+            with open(version_file, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def variant_key(columns):
+    "Key for a data line split on tab, or None if the record should not be cached"
+    alt = columns[4]
+    # Multiallelic, symbolic and breakend records are always annotated
+    if "," in alt or "<" in alt or "[" in alt or "]" in alt or alt == "*":
+        return None
+    return "{}:{}:{}:{}".format(columns[0], columns[1], columns[3], alt)
+
+
+def info_ids(header_lines):
+    ids = []
+    for line in header_lines:
+        if line.startswith("##INFO=<ID="):
+            ids.append(line[len("##INFO=<ID=") :].split(",", 1)[0])
+    return ids
+
+
+def header_name(line):
+    "Identifier of a meta-information line, e.g. INFO/CSQ for ##INFO=<ID=CSQ,...> and VEP for ##VEP=..."
+    if line.startswith("##INFO=<ID="):
+        return "INFO/" + info_ids([line])[0]
+    return line[2:].split("=", 1)[0]
+
+
+def add_info(info, annotation):
+    if not annotation:
+        return info
+    if info in (".", ""):
+        return annotation
+    return info + ";" + annotation
+
+
+def iter_vcf(fd):
+    """
+    Split a VCF into its header lines (without #CHROM line), #CHROM line and a generator of data lines
+    """
+    header = []
+    chrom_line = None
+    for line in fd:
+        if line.startswith("##"):
+            header.append(line.rstrip("\n"))
+            continue
+        if line.startswith("#"):
+            chrom_line = line.rstrip("\n")
+            break
+        raise RuntimeError("Missing #CHROM line in VCF")
+
+    def records():
+        for line in fd:
+            if line.strip():
+                yield line.rstrip("\n")
+
+    return header, chrom_line, records()
+
+
+def without_info(line):
+    "Data line without the INFO column, identifying a record before and after annotation"
+    columns = line.split("\t")
+    return columns[:7] + columns[8:]
+
+
+def batched(iterator, n):
+    batch = []
+    for item in iterator:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class VariantCache(object):
+    def __init__(self, cache_dir, version):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "variants_{}.sqlite".format(version))
+        # Databases for other data versions are invalid
+        for f in os.listdir(cache_dir):
+            if f.startswith("variants_") and not f.startswith(os.path.basename(self.path)):
+                try:
+                    os.unlink(os.path.join(cache_dir, f))
+                except OSError:
+                    pass
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=120)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, keys):
+        keys = [k for k in keys if k is not None]
+        if not keys:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, annotation FROM variant WHERE key IN ({})".format(", ".join("?" * len(keys))), keys
+            )
+            return dict(rows.fetchall())
+
+    def store(self, annotations):
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO variant (key, annotation) VALUES (?, ?)", annotations)
+
+    def get_header(self):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT line FROM header ORDER BY position")]
+
+    def store_header(self, lines):
+        # Keep the header lines of the last annotation run, lines like ##VEP=... differ between runs
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO header (name, position, line) VALUES (?, ?, ?)",
+                [(header_name(line), i, line) for i, line in enumerate(lines)],
+            )
+
+    def split(self, input_vcf, cached_vcf, uncached_vcf):
+        """
+        Write records with cached annotation (annotation added to INFO) to `cached_vcf`, and the remaining records to
+        `uncached_vcf`. Both files get the header of the input.
+        """
+        # If nothing is cached for this data version yet, every record is a miss
+        cache_header = self.get_header()
+        with open(input_vcf, "r") as input, open(cached_vcf, "w") as cached, open(uncached_vcf, "w") as uncached:
+            header, chrom_line, records = iter_vcf(input)
+            for fd in [cached, uncached]:
+                fd.write("\n".join(header + [chrom_line]) + "\n")
+
+            for batch in batched(records, BATCH_SIZE):
+                split_batch = [line.split("\t") for line in batch]
+                keys = [variant_key(columns) for columns in split_batch]
+                found = self.lookup(keys) if cache_header else {}
+                for line, columns, key in zip(batch, split_batch, keys):
+                    if key is not None and key in found:
+                        self.hits += 1
+                        columns[7] = add_info(columns[7], found[key])
+                        cached.write("\t".join(columns) + "\n")
+                    else:
+                        self.misses += 1
+                        uncached.write(line + "\n")
+
+    def merge(self, input_vcf, cached_vcf, annotated_vcf, output_vcf):
+        """
+        Merge cached and newly annotated records back in the order of `input_vcf` (the input to `split`), and store
+        the annotation of the newly annotated records.
+        """
+        with open(input_vcf, "r") as input, open(cached_vcf, "r") as cached, open(annotated_vcf, "r") as annotated:
+            input_header, _, input_records = iter_vcf(input)
+            _, _, cached_records = iter_vcf(cached)
+            annotated_header, chrom_line, annotated_records = iter_vcf(annotated)
+
+            # Annotation fields are the INFO fields defined by the annotation steps, i.e. not present in the input
+            input_header_lines = set(input_header)
+            annotation_ids = set(info_ids(annotated_header)) - set(info_ids(input_header))
+            new_header = [line for line in annotated_header if line not in input_header_lines]
+
+            # Annotation header lines are missing from the annotated header if all records were cached
+            annotated_names = set(header_name(line) for line in annotated_header)
+            header = annotated_header + [line for line in self.get_header() if header_name(line) not in annotated_names]
+
+            new_annotations = []
+            next_cached = next(cached_records, None)
+            with open(output_vcf, "w") as output:
+                output.write("\n".join(header + [chrom_line]) + "\n")
+                for line in input_records:
+                    columns = line.split("\t", 5)
+                    key = variant_key(columns)
+
+                    # Cached records are a subset of the input in input order, so only the next one can match
+                    if key is not None and next_cached is not None and without_info(next_cached) == without_info(line):
+                        output.write(next_cached + "\n")
+                        next_cached = next(cached_records, None)
+                        continue
+
+                    annotated_line = next(annotated_records, None)
+                    if annotated_line is None:
+                        raise RuntimeError("Annotated VCF is missing records (expected {})".format(line))
+                    annotated_columns = annotated_line.split("\t")
+                    if annotated_columns[:2] != columns[:2]:
+                        raise RuntimeError(
+                            "Annotated record {} does not match input record {}".format(
+                                "\t".join(annotated_columns[:5]), "\t".join(columns[:5])
+                            )
+                        )
+                    if key is not None:
+                        annotation = ";".join(
+                            v for v in annotated_columns[7].split(";") if v.split("=", 1)[0] in annotation_ids
+                        )
+                        new_annotations.append((key, annotation))
+                    output.write(annotated_line + "\n")
+
+            if next_cached is not None or next(annotated_records, None) is not None:
+                raise RuntimeError("Annotated VCFs contain records not present in input")
+
+        if new_annotations:
+            self.store_header(new_header)
+            for batch in batched(new_annotations, BATCH_SIZE):
+                self.store(batch)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-variant annotation cache")
+    parser.add_argument("--cache-dir", required=True, dest="cache_dir")
+    parser.add_argument(
+        "--version-file",
+        action="append",
+        dest="version_files",
+        default=[],
+        help="file(s) defining the data version of the cache (e.g. sources.json)",
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    split_parser = subparsers.add_parser("split", help="split input on cached and uncached records")
+    split_parser.add_argument("--input", required=True)
+    split_parser.add_argument("--cached", required=True)
+    split_parser.add_argument("--uncached", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="merge cached and annotated records, and update cache")
+    merge_parser.add_argument("--input", required=True)
+    merge_parser.add_argument("--cached", required=True)
+    merge_parser.add_argument("--annotated", required=True)
+    merge_parser.add_argument("--output", required=True)
+
+    args = parser.parse_args()
+    cache = VariantCache(args.cache_dir, data_version(args.version_files))
+    if args.action == "split":
+        cache.split(args.input, args.cached, args.uncached)
+        print("Variant cache hits: {}, misses: {}".format(cache.hits, cache.misses), file=sys.stderr)
+    else:
+        cache.merge(args.input, args.cached, args.annotated, args.output)
@@ -0,0 +1,187 @@
+"""
+Coordinate index of a sorted (uncompressed) vcf, for region queries on task results.
+
+Like the linear index of tabix, every contig is divided in windows of WINDOW_SIZE bases, and the index holds the file
+offset of the first record overlapping each window (a record spans its REF allele). Windows without records get the
+offset of the previous window. A query seeks to the offset of the window of its start, and reads records until it is
+past its end, so only the records around the region are read. The index is stored as json next to the vcf, with the
+size and modification time of the vcf it was built for.
+
+Usage:
+    python3 src/annotation/vcf_index.py --input output.vcf [--output output.vcf.idx]
+    python3 src/annotation/vcf_index.py --input output.vcf --region 1:100-200
+"""
+
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger("anno")
+
+WINDOW_SIZE = 1 << 14
+INDEX_SUFFIX = ".idx"
+
+
+def _record_span(line):
+    "1-based, inclusive (start, end) of a record"
+    fields = line.split(b"\t", 4)
+    pos = int(fields[1])
+    return pos, pos + max(len(fields[3]), 1) - 1
+
+
+def _stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+class VcfIndex(object):
+    def __init__(self, contigs, header_size, window_size=WINDOW_SIZE, vcf_stat=None):
+        # contig -> offsets of the windows, and size of the header in bytes
+        self.contigs = contigs
+        self.header_size = header_size
+        self.window_size = window_size
+        self.vcf_stat = vcf_stat
+
+    @staticmethod
+    def build(vcf_path, window_size=WINDOW_SIZE):
+        contigs = {}
+        header_size = 0
+        offset = 0
+        vcf_stat = _stat(vcf_path)
+        with open(vcf_path, "rb") as f:
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                if line.startswith(b"#"):
+                    header_size = offset
+                    continue
+                if not line.strip():
+                    continue
+                contig = line.split(b"\t", 1)[0].decode()
+                start, end = _record_span(line)
+                offsets = contigs.setdefault(contig, [])
+                last_window = end // window_size
+                if len(offsets) <= last_window:
+                    # Windows without records before this one keep the offset of the previous window
+                    fill = offsets[-1] if offsets else line_offset
+                    while len(offsets) < start // window_size:
+                        offsets.append(fill)
+                    while len(offsets) <= last_window:
+                        offsets.append(line_offset)
+        return VcfIndex(contigs, header_size, window_size=window_size, vcf_stat=vcf_stat)
+
+    @staticmethod
+    def load(index_path):
+        with open(index_path) as f:
+            data = json.load(f)
+        return VcfIndex(
+            data["contigs"], data["header_size"], window_size=data["window_size"], vcf_stat=tuple(data["vcf_stat"])
+        )
+
+    def save(self, index_path):
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "contigs": self.contigs,
+                    "header_size": self.header_size,
+                    "window_size": self.window_size,
+                    "vcf_stat": self.vcf_stat,
+                },
+                f,
+            )
+        os.rename(tmp_path, index_path)
+
+    def is_current(self, vcf_path):
+        "Check that the index was built for the vcf as it is now"
+        return self.vcf_stat is not None and tuple(self.vcf_stat) == _stat(vcf_path)
+
+    def offset(self, contig, start):
+        "Offset to start reading records overlapping contig:start, or None if no records can overlap"
+        offsets = self.contigs.get(contig)
+        if not offsets:
+            return None
+        window = start // self.window_size
+        return offsets[min(window, len(offsets) - 1)]
+
+    def header(self, f):
+        f.seek(0)
+        return f.read(self.header_size)
+
+    def _records(self, f, contig, start, end):
+        offset = self.offset(contig, start)
+        if offset is None:
+            return
+        f.seek(offset)
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            if line.split(b"\t", 1)[0].decode() != contig:
+                break
+            record_start, record_end = _record_span(line)
+            if record_start > end:
+                break
+            if record_end >= start:
+                yield line_offset, line
+
+    def query(self, f, contig, start, end):
+        "Records (lines, as bytes) of `f` (the vcf, opened in binary mode) overlapping contig:start-end (1-based)"
+        for _, line in self._records(f, contig, start, end):
+            yield line
+
+    def query_regions(self, f, regions):
+        """
+        Records overlapping any of `regions` (contig, start, end; 1-based, inclusive), in file order and without
+        duplicates
+        """
+        records = {}
+        for contig, start, end in regions:
+            records.update(self._records(f, contig, start, end))
+        return [records[offset] for offset in sorted(records)]
+
+
+def index_path(vcf_path):
+    return vcf_path + INDEX_SUFFIX
+
+
+def get_index(vcf_path):
+    "Load the index of a vcf, (re)building and storing it if missing or outdated"
+    path = index_path(vcf_path)
+    if os.path.isfile(path):
+        try:
+            index = VcfIndex.load(path)
+            if index.is_current(vcf_path):
+                return index
+        except (ValueError, KeyError):
+            pass
+    logger.info("Building coordinate index of {}".format(vcf_path))
+    index = VcfIndex.build(vcf_path)
+    index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a coordinate index of a sorted vcf, or query a region")
+    parser.add_argument("--input", required=True, help="sorted vcf")
+    parser.add_argument("--output", help="index file (default: input + {})".format(INDEX_SUFFIX))
+    parser.add_argument("--region", help="write the header and the records overlapping region (contig:start-end)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    if args.region:
+        contig, interval = args.region.rsplit(":", 1)
+        start, end = [int(v) for v in interval.split("-")]
+        index = get_index(args.input)
+        with open(args.input, "rb") as f:
+            sys.stdout.buffer.write(index.header(f))
+            for line in index.query(f, contig, start, end):
+                sys.stdout.buffer.write(line)
+    else:
+        index = VcfIndex.build(args.input)
+        index.save(args.output or index_path(args.input))
+        logger.info("Indexed {} contigs".format(len(index.contigs)))
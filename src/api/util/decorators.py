@@ -1,6 +1,12 @@
 from functools import wraps
 from flask import request
 import json
+import os
+import shutil
+import tempfile
+
+from config import config
+from api.util.util import SpooledFile
 
 
 def parse_request(required, special):
@@ -14,37 +20,45 @@ def parse_request(required, special):
                 if json_data:
                     data["variables"] = json_data
 
-            # Fetch files
-
-            data["files"].update(
-                {k: (v.filename, v.read().decode("utf-8")) for k, v in request.files.items()}
-            )
-
-            for k in request.form:
-                data["variables"].update(
-                    {k: json.loads(request.form[k].replace("'", '"'))}
+            # Fetch files. Files are spooled to disk in chunks, in a folder for this request. Files not moved to a task
+            # folder are removed with it when the request is done.
+            spool_dir = None
+            if request.files:
+                os.makedirs(config["upload_folder"], exist_ok=True)
+                spool_dir = tempfile.mkdtemp(dir=config["upload_folder"])
+            try:
+                data["files"].update(
+                    {k: SpooledFile.spool(v.stream, spool_dir, v.filename) for k, v in request.files.items()}
                 )
 
-            # Strip required
-            if not all(
-                k in list(data["files"].keys()) + list(data["variables"].keys()) for k in required
-            ):
-                raise AssertionError(
-                    "One or more required fields are missing: {}".format(required)
-                )
+                for k in request.form:
+                    data["variables"].update(
+                        {k: json.loads(request.form[k].replace("'", '"'))}
+                    )
+
+                # Strip required
+                if not all(
+                    k in list(data["files"].keys()) + list(data["variables"].keys()) for k in required
+                ):
+                    raise AssertionError(
+                        "One or more required fields are missing: {}".format(required)
+                    )
 
-            args = list(args)
-            for k in required + special:
-                if k in data["files"]:
-                    args.append(data["files"].pop(k)[1])
-                elif k in data["variables"]:
-                    args.append(data["variables"].pop(k))
-                else:
-                    args.append(None)
+                args = list(args)
+                for k in required + special:
+                    if k in data["files"]:
+                        args.append(data["files"].pop(k))
+                    elif k in data["variables"]:
+                        args.append(data["variables"].pop(k))
+                    else:
+                        args.append(None)
 
-            # Sort remaining into files or variables
-            kwargs["data"] = data
-            return func(*args, **kwargs)
+                # Sort remaining into files or variables
+                kwargs["data"] = data
+                return func(*args, **kwargs)
+            finally:
+                if spool_dir is not None:
+                    shutil.rmtree(spool_dir, ignore_errors=True)
 
         return inner
 
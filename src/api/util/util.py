@@ -1,5 +1,8 @@
+import io
 import os
 import re
+import shutil
+import tempfile
 
 import logging
 
@@ -13,26 +16,80 @@ RE_HGVSC = re.compile(r".+:c\..+")
 
 RE_SEQPILOT = re.compile(r".*Transcript.*\tc. HGVS|.*c. HGVS.*\tTranscript")
 
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledFile(object):
+    """
+    Uploaded file, spooled to disk in chunks (see parse_request), so uploads are not held in memory. Moved to the task
+    folder by Task.create_task.
+    """
+
+    def __init__(self, path, filename=None):
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+
+    @staticmethod
+    def spool(stream, directory, filename=None):
+        fd, path = tempfile.mkstemp(dir=directory, prefix="upload_")
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(stream, f, SPOOL_CHUNK_SIZE)
+        return SpooledFile(path, filename)
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+    def move(self, path):
+        shutil.move(self.path, path)
+        self.path = path
+
+
+# Number of lines (after the vcf header) the input type is detected from
+DETECT_LINES = 1000
+
+
+def iter_lines(data):
+    """
+    Lines (without line endings) of a string or file, as `data.strip().split("\n")` but without copying the data.
+    Leading and trailing blank lines are skipped.
+    """
+    if isinstance(data, str):
+        data = io.StringIO(data)
+    # The last non-blank line and the blank lines after it, yielded when followed by another non-blank line
+    last = None
+    blank = []
+    for l in data:
+        l = l.rstrip("\n")
+        if last is None:
+            l = l.lstrip()
+        if not l.strip():
+            if last is not None:
+                blank.append(l)
+            continue
+        if last is not None:
+            yield last
+            yield from blank
+            blank = []
+        last = l
+    yield last.rstrip() if last is not None else ""
+
 
 def is_genomic(data):
-    for l in data.split("\n"):
+    for l in iter_lines(data):
         if RE_GENOMIC.match(l) is None:
             return False, l
     return True, None
 
 
 def is_seqpilot(data):
-    header_line = None
-    for l in data.split("\n"):
-        if l and not header_line:
-            header_line = l
-            break
-
-    return RE_SEQPILOT.match(l) is not None
+    for l in iter_lines(data):
+        return RE_SEQPILOT.match(l) is not None
+    return False
 
 
 def is_hgvsc(data):
-    for l in data.split("\n"):
+    for l in iter_lines(data):
         if RE_HGVSC.match(l) is None:
             return False, l
     return True, None
@@ -42,54 +99,163 @@ def is_vcf(data):
     return RE_VCF.search(data) is not None
 
 
-def genomic_to_vcf(data):
-    header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE"
-    data_line = "{CHROM}\t{POS}\t.\t{REF}\t{ALT}\t.\tPASS\t.\t{FORMAT}\t{SAMPLE}"
-    vcf_data = header
-    gt_mapping = {"het": "0/1", "homo": "1/1", "hom": "1/1"}
+GENOMIC_VCF_HEADER = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE"
+GENOMIC_VCF_LINE = "{CHROM}\t{POS}\t.\t{REF}\t{ALT}\t.\tPASS\t.\t{FORMAT}\t{SAMPLE}"
+GT_MAPPING = {"het": "0/1", "homo": "1/1", "hom": "1/1"}
 
-    for l in data.split("\n"):
-        m = RE_GENOMIC.match(l).groupdict()
 
+def iter_genomic_to_vcf(lines):
+    "Convert genomic lines (13-32532632-A-G (het)) to vcf lines, one at a time. Raises ValueError on other lines."
+    yield from GENOMIC_VCF_HEADER.split("\n")
+    for l in lines:
+        m = RE_GENOMIC.match(l)
+        if m is None:
+            raise ValueError("Not genomic: {}".format(l))
+        m = m.groupdict()
         gt = m.pop("GT", None)
         m["FORMAT"] = "GT" if gt else "."
-        m["SAMPLE"] = gt_mapping.get(gt, ".")
-        vcf_data += "\n" + data_line.format(**m)
-    return vcf_data
+        m["SAMPLE"] = GT_MAPPING.get(gt, ".")
+        yield GENOMIC_VCF_LINE.format(**m)
 
 
-def _get_type_and_convert_data(data):
-    data = data.strip()
-
-    if is_vcf(data):
-        return "vcf", data
-
-    if is_seqpilot(data):
-        return "hgvsc", data
-
-    genomic, failing_line_genomic = is_genomic(data)
-    if genomic:
-        return "vcf", genomic_to_vcf(data)
-
-    hgvsc, failing_line_hgvsc = is_hgvsc(data)
-    if hgvsc:
-        return "hgvsc", data
-
+def genomic_to_vcf(data):
+    return "\n".join(iter_genomic_to_vcf(iter_lines(data)))
+
+
+def detect_type(lines):
+    """
+    Input type (vcf, seqpilot, genomic or hgvsc) from the head of the input: the vcf header, or the first DETECT_LINES
+    lines. None if undetermined. The rest of the input is checked when converted.
+    """
+    head = []
+    for l in lines:
+        head.append(l)
+        if not l.startswith("#") and len(head) >= DETECT_LINES:
+            break
+    if is_vcf("\n".join(head)):
+        return "vcf"
+    if is_seqpilot(head):
+        return "seqpilot"
+    if is_genomic(head)[0]:
+        return "genomic"
+    if is_hgvsc(head)[0]:
+        return "hgvsc"
+    return None
+
+
+def _type_error(lines):
+    "Error for input of undetermined type, from all `lines()` (only used when the input is not valid)"
+    genomic, failing_line_genomic = is_genomic(lines())
+    hgvsc, failing_line_hgvsc = is_hgvsc(lines())
     if failing_line_hgvsc == failing_line_genomic:
-        raise RuntimeError(
+        return RuntimeError(
             "Unable to determine input type (vcf, seqpilot, genomic, or hgvsc). Not genomic or hgvsc: {}.".format(
                 failing_line_genomic
             )
         )
     else:
-        raise RuntimeError(
+        return RuntimeError(
             "Unable to determine input type (vcf, seqpilot, genomic, or hgvsc). Not genomic: {}. Not hgvsc: {}.".format(
                 failing_line_genomic, failing_line_hgvsc
             )
         )
 
 
+def _get_type_and_convert_data(data):
+    data = data.strip()
+
+    type = detect_type(iter_lines(data))
+    if type == "vcf":
+        return "vcf", data
+    if type == "seqpilot":
+        return "hgvsc", data
+    if type == "genomic":
+        try:
+            return "vcf", genomic_to_vcf(data)
+        except ValueError:
+            pass
+    if type == "hgvsc" and is_hgvsc(data)[0]:
+        return "hgvsc", data
+    # The #CHROM line is not necessarily in the head of a string input
+    if type is None and is_vcf(data):
+        return "vcf", data
+    raise _type_error(lambda: data)
+
+
+def read_header(path):
+    "Header lines of a (possible) vcf, without reading further than the first line not starting with '#'"
+    header = []
+    with open(path, encoding="utf-8") as f:
+        for l in f:
+            if l.strip() and not l.startswith("#"):
+                break
+            header.append(l)
+    return "".join(header)
+
+
+def replace_spaces(input, output):
+    "Streaming version of the space replacement of extract_data, for uploaded vcfs"
+    with open(input, encoding="utf-8") as fin, open(output, "w", encoding="utf-8") as fout:
+        body = False
+        for l in fin:
+            if not l.strip():
+                continue
+            if not body and not l.startswith("#"):
+                body = True
+            if body and "\t" in l:
+                l = l.replace(" ", "--")
+            fout.write(l if l.endswith("\n") else l + "\n")
+
+
+def _convert_lines(lines, type):
+    "Check and convert the lines of a variant list of the detected type, one at a time. Raises ValueError if invalid."
+    if type == "genomic":
+        yield from iter_genomic_to_vcf(lines)
+    elif type == "seqpilot":
+        yield from lines
+    elif type == "hgvsc":
+        for l in lines:
+            if RE_HGVSC.match(l) is None:
+                raise ValueError("Not hgvsc: {}".format(l))
+            yield l
+    else:
+        raise ValueError("Unable to determine input type")
+
+
+def _extract_file(upload):
+    # Only the header is read to detect a vcf
+    if is_vcf(read_header(upload.path)):
+        vcf = SpooledFile(upload.path + ".vcf", upload.filename)
+        replace_spaces(upload.path, vcf.path)
+        os.unlink(upload.path)
+        return vcf, None
+
+    def lines():
+        with open(upload.path, encoding="utf-8") as f:
+            yield from iter_lines(f)
+
+    # Variant lists (seqpilot, genomic, hgvsc) are checked and converted line by line, into a new file
+    type = detect_type(lines())
+    output = SpooledFile(upload.path + (".vcf" if type == "genomic" else ".txt"), upload.filename)
+    try:
+        with open(output.path, "w", encoding="utf-8") as f:
+            for l in _convert_lines(lines(), type):
+                f.write(l + "\n")
+    except ValueError:
+        # The input does not match the type detected from its head, check all lines for the error message
+        raise _type_error(lines)
+    os.unlink(upload.path)
+    return (output, None) if type == "genomic" else (None, output)
+
+
 def extract_data(data):
+    """
+    Detect the type of the input, and return it as (vcf, None) or (None, hgvsc). Uploaded files (SpooledFile) are
+    processed on disk if they are vcfs, and returned as SpooledFile.
+    """
+    if isinstance(data, SpooledFile):
+        return _extract_file(data)
+
     type, data = _get_type_and_convert_data(data)
     if type == "vcf":
         # Replace spaces within columns, due to a VEP bug in VEP 79
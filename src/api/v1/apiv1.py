@@ -26,12 +26,16 @@ class ApiV1(object):
             resources.process.ProcessResource, "/api/v1/process/<int:id>"
         )
 
+        self._add_resource(resources.region.RegionResource, "/api/v1/process/<int:id>/region")
+
         self._add_resource(resources.debug.DebugResource, "/api/v1/debug/<int:id>")
 
         self._add_resource(resources.cancel.CancelResource, "/api/v1/cancel/<int:id>")
 
         self._add_resource(resources.diagnose.DiagnoseResource, "/api/v1/diagnose")
 
+        self._add_resource(resources.queue.QueueResource, "/api/v1/queue")
+
         self._add_resource(resources.configresource.ConfigResource, "/api/v1/config")
 
         self._add_resource(
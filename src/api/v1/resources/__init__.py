@@ -1,10 +1,12 @@
 from . import annotate
 from . import process
+from . import region
 from . import status
 from . import reset
 from . import debug
 from . import cancel
 from . import diagnose
+from . import queue
 from . import configresource
 from . import convert
 from . import annotate_sample
@@ -4,6 +4,7 @@ from annotation.task import Task
 from api.util.decorators import parse_request
 from api.util.util import extract_data, str2bool
 from api.v1.resource import Resource
+from api.v1.resources.process import stream_result
 
 
 class AnnotateResource(Resource):
@@ -15,6 +16,8 @@ class AnnotateResource(Resource):
             target = targets
 
         wait = str2bool(request.args.get("wait", False))
+        # With wait, send the result while the task runs
+        stream = str2bool(request.args.get("stream", False))
 
         # Create task object
         vcf, hgvsc = extract_data(input)
@@ -22,8 +25,10 @@ class AnnotateResource(Resource):
         task_id, task_priority = Task.create_task(
             vcf=vcf, hgvsc=hgvsc, regions=regions, target=target, target_data=data
         )
-        Task.queue(task_id, task_priority, wait=wait)
+        Task.queue(task_id, task_priority, wait=wait and not stream)
         if not wait:
             return make_response(jsonify({"task_id": task_id}), 202)
+        elif stream:
+            return stream_result(task_id)
         else:
             return send_file(Task.get_result(task_id))
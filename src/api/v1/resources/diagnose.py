@@ -3,7 +3,8 @@ import subprocess
 
 from flask import make_response
 
-from annotation.task import Task
+from annotation.registry import TaskRegistry
+from annotation.task import get_registry, get_scheduler
 from api.v1.resource import Resource
 from config import config
 
@@ -40,19 +41,11 @@ def check_output(cmd, on_error="N/A"):
 
 class DiagnoseResource(Resource):
     def get(self):
-        all_task_ids = list(Task.get_status_all().keys())
-        total = len(all_task_ids)
-        finalized = 0
-        failed = 0
-        active = 0
-
-        for id in all_task_ids:
-            if Task.is_finished(id):
-                finalized += 1
-                if Task.is_failed(id):
-                    failed += 1
-            else:
-                active += 1
+        counts = get_registry().count_by_state()
+        total = sum(counts.values())
+        finalized = sum(counts.get(state, 0) for state in TaskRegistry.FINISHED_STATES)
+        failed = counts.get(TaskRegistry.FAILED, 0)
+        active = sum(counts.get(state, 0) for state in TaskRegistry.ACTIVE_STATES)
 
         res = "TASKS\n"
         res += "\tTotal: " + str(total) + "\n"
@@ -60,6 +53,13 @@ class DiagnoseResource(Resource):
         res += "\tFailed: " + str(failed) + "\n"
         res += "\tActive: " + str(active) + "\n"
 
+        queue = get_scheduler().stats()
+        res += "\nQUEUE\n"
+        res += "\tQueued: " + str(queue["queued"]) + "\n"
+        res += "\tRunning: " + str(queue["running"]) + "\n"
+        res += "\tCores used: {}/{}\n".format(queue["cores_used"], queue["cores"])
+        res += "\tMemory used: {:.1f}/{:.1f} GB\n".format(queue["memory_used"], queue["memory"])
+
         uta = "UTA " + os.environ["UTA_DB_URL"]
         seqrepo = "SEQREPO " + os.environ["HGVS_SEQREPO_DIR"]
 
@@ -1,6 +1,9 @@
-from flask import send_file
+import zlib
+
+from flask import Response, make_response, request, send_file
 
 from annotation.task import Task
+from api.util.util import str2bool
 from api.v1.resource import Resource
 
 
@@ -11,10 +14,61 @@ def raise_failed(id):
         raise RuntimeError(log)
 
 
+def accepts_gzip():
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
+
+
+def gzip_chunks(chunks):
+    "Gzip encode a stream, flushing every chunk so the client receives it without delay"
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_result(id):
+    """
+    Response streaming the result while the task runs (chunked transfer encoding), ended with a line with the state of
+    the task (##ANNO_STATUS=SUCCESS or FAILED). Gzip encoded if the client accepts it.
+    """
+    chunks = Task.stream_result(id)
+    gzip = accepts_gzip()
+    response = Response(gzip_chunks(chunks) if gzip else chunks, mimetype="text/plain")
+    if gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    # Do not buffer the response in proxies (nginx)
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 class ProcessResource(Resource):
     def get(self, id):
+        """
+        Result of the task. `?format=vcf.gz` and `?format=tbi` give the BGZF compressed output and its tabix index
+        (only for tasks run with the bgzip option). The vcf is sent gzip encoded to clients accepting it, if the
+        compressed output is available. With `?stream=true`, the vcf is sent while the task runs (see stream_result).
+        """
         id = str(id)
+        format = request.args.get("format", "vcf")
+        if format not in ["vcf", "vcf.gz", "tbi"]:
+            return make_response("Unknown format {}, expected vcf, vcf.gz or tbi".format(format), 400)
+        if format == "vcf" and str2bool(request.args.get("stream", False)):
+            return stream_result(id)
         Task.wait_for_task(id)
         raise_failed(id)
-        result_file = Task.get_result(id)
-        return send_file(result_file)
+
+        compressed_file = Task.get_result(id, compressed=True)
+        if format == "vcf":
+            if compressed_file is None or not accepts_gzip():
+                return send_file(Task.get_result(id))
+            # BGZF is valid (multi-member) gzip, and can be sent as is
+            response = send_file(compressed_file, mimetype="text/plain", conditional=False)
+            response.headers["Content-Encoding"] = "gzip"
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+
+        result_file = compressed_file if format == "vcf.gz" else Task.get_result_index(id)
+        if result_file is None:
+            return make_response("No compressed result for task {}, the task was run without bgzip".format(id), 404)
+        return send_file(result_file, mimetype="application/octet-stream", as_attachment=True)
@@ -0,0 +1,9 @@
+from flask import jsonify
+
+from annotation.task import get_scheduler
+from api.v1.resource import Resource
+
+
+class QueueResource(Resource):
+    def get(self):
+        return jsonify(get_scheduler().stats())
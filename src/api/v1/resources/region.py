@@ -0,0 +1,50 @@
+from flask import Response, make_response, request
+
+from annotation.task import Task
+from api.v1.resource import Resource
+from api.v1.resources.process import raise_failed
+
+
+def parse_bed(data):
+    "Regions (contig, start, end; 1-based, inclusive) of a bed file"
+    regions = []
+    for l in data.splitlines():
+        if l.startswith(("#", "track", "browser")) or not l.strip():
+            continue
+        contig, start, end = l.split("\t", 3)[:3]
+        regions.append((contig, int(start) + 1, int(end)))
+    return regions
+
+
+class RegionResource(Resource):
+    """
+    Records of the result of a task overlapping regions, with the header. Records are looked up in the coordinate
+    index of the result (annotation/vcf_index.py), so only the records around the regions are read.
+
+    GET: a single region, ?chrom=&start=&end= (1-based, inclusive)
+    POST: regions as a bed file (request body, or file `regions`)
+    """
+
+    def _query(self, id, regions):
+        id = str(id)
+        Task.wait_for_task(id)
+        raise_failed(id)
+        return Response(Task.query_result(id, regions), mimetype="text/plain")
+
+    def get(self, id):
+        try:
+            regions = [(request.args["chrom"], int(request.args["start"]), int(request.args["end"]))]
+        except (KeyError, ValueError):
+            return make_response("Expected chrom, start and end (integers)", 400)
+        return self._query(id, regions)
+
+    def post(self, id):
+        if "regions" in request.files:
+            data = request.files["regions"].read().decode("utf-8")
+        else:
+            data = request.get_data(as_text=True)
+        try:
+            regions = parse_bed(data)
+        except ValueError:
+            return make_response("Invalid bed file", 400)
+        return self._query(id, regions)
@@ -2,12 +2,15 @@ import os
 import shutil
 from api.v1.resource import Resource
 from config import config
-from annotation.task import Task
+from annotation.task import Task, get_registry
 
 
 def remove_files():
     for d in os.listdir(config["work_folder"]):
-        shutil.rmtree(os.path.join(config["work_folder"], d))
+        path = os.path.join(config["work_folder"], d)
+        # Leave the task registry (and its journal) in place, it is cleared below
+        if os.path.isdir(path):
+            shutil.rmtree(path)
 
 
 class ResetResource(Resource):
@@ -16,5 +19,6 @@ class ResetResource(Resource):
             Task.cancel(id)
 
         remove_files()
+        get_registry().clear()
 
         return "", 204
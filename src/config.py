@@ -1,8 +1,83 @@
 import os
 
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CPU_COUNT = os.cpu_count() or 1
+MEMORY_GB = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+
 config = {
     "verbose": bool(int(os.environ.get("VERBOSE", 1))),
     "work_folder": os.environ["WORKFOLDER"],
+    "task_registry": os.environ.get("TASK_REGISTRY", os.path.join(os.environ["WORKFOLDER"], "tasks.sqlite")),
+    # Resume interrupted tasks from the last completed pipeline step, instead of starting from scratch
+    "resume_tasks": bool(int(os.environ.get("RESUME_TASKS", 1))),
+    # Run tasks with the bash pipeline (annotate.sh) or the Python pipeline engine (annotation/pipeline.py)
+    "pipeline_engine": os.environ.get("PIPELINE_ENGINE", "bash"),
     "annotate_script": os.path.join(os.path.split(os.path.abspath(__file__))[0], "annotation/annotate.sh"),
-    "convert": {"fail_on_conversion_error": True, "replace_ref_if_mismatch": True},
+    "anno_data": os.environ.get("ANNO_DATA", os.path.join(ROOT_DIR, "data")),
+    "version_file": os.path.join(ROOT_DIR, "version"),
+    # Uploaded files are spooled to disk here, before they are moved to the task folder (same file system)
+    "upload_folder": os.environ.get("UPLOAD_FOLDER", os.path.join(os.environ["WORKFOLDER"], "uploads")),
+    # Cost model for the task priority: tasks with an estimated runtime (seconds) of at most `max_runtime` may run in
+    # the priority queue. The runtime is estimated from the (estimated) number of variants of the input.
+    "priority": {
+        "max_runtime": float(os.environ.get("PRIORITY_MAX_RUNTIME", 60)),
+        # Fixed cost of a task (pipeline and VEP startup)
+        "task_seconds": float(os.environ.get("PRIORITY_TASK_SECONDS", 20)),
+        "vep_seconds_per_variant": float(os.environ.get("PRIORITY_VEP_SECONDS_PER_VARIANT", 0.04)),
+        "conversion_seconds_per_hgvsc": float(os.environ.get("PRIORITY_CONVERSION_SECONDS_PER_HGVSC", 0.36)),
+    },
+    # Budget of the task scheduler (annotation/scheduler.py). Tasks get cores and memory (GB) from their estimated
+    # runtime, and run concurrently as long as they fit in the budget. `priority_cores` cores are only used by
+    # priority tasks.
+    "scheduler": {
+        "cores": int(os.environ.get("SCHEDULER_CORES", CPU_COUNT)),
+        "memory": float(os.environ.get("SCHEDULER_MEMORY", MEMORY_GB)),
+        # Maximum number of concurrent normal tasks (0: no limit), as the former WORKERS worker threads. One priority
+        # task can always run in addition, as the former priority worker thread.
+        "max_tasks": int(os.environ.get("SCHEDULER_MAX_TASKS", os.environ.get("WORKERS", 1))),
+        "priority_cores": int(os.environ.get("SCHEDULER_PRIORITY_CORES", 1)),
+        # Maximum cores of a task (NUM_VEP_PROCESSES/NUM_VCFANNO_PROCESSES), default: all but the priority cores
+        "task_cores": int(os.environ.get("SCHEDULER_TASK_CORES", 0)) or None,
+        # One core per `core_runtime` seconds of estimated runtime
+        "core_runtime": float(os.environ.get("SCHEDULER_CORE_RUNTIME", 300)),
+        "task_memory": float(os.environ.get("SCHEDULER_TASK_MEMORY", 4)),
+        "memory_per_core": float(os.environ.get("SCHEDULER_MEMORY_PER_CORE", 1)),
+        # Seconds subtracted from the estimated runtime of a queued task per second waited
+        "aging": float(os.environ.get("SCHEDULER_AGING", 2)),
+    },
+    # Reuse the annotated output of earlier tasks with identical input, regions and data versions
+    "result_cache": {
+        "enabled": bool(int(os.environ.get("RESULT_CACHE", 1))),
+        "path": os.environ.get("RESULT_CACHE_PATH", os.path.join(os.environ["WORKFOLDER"], "result_cache")),
+        "max_age": float(os.environ.get("RESULT_CACHE_MAX_AGE", 30 * 24 * 3600)),
+        "max_size": int(os.environ.get("RESULT_CACHE_MAX_SIZE", 50 * 1024**3)),
+    },
+    "convert": {
+        "fail_on_conversion_error": True,
+        "replace_ref_if_mismatch": True,
+        # Seconds before the conversion of a single hgvsc is aborted with a TimeoutError
+        "timeout": float(os.environ.get("CONVERSION_TIMEOUT", 30)),
+        # Local socket of the conversion service (conversion/service.py). Conversion runs in-process if not available.
+        "socket": os.environ.get("CONVERSION_SOCKET", os.path.join(os.environ["WORKFOLDER"], "run", "conversion.sock")),
+        # Only the user of the service and this group (default: the group of the service) may connect to the socket,
+        # i.e. the user or group running the tasks
+        "socket_group": os.environ.get("CONVERSION_SOCKET_GROUP") or None,
+        "workers": int(os.environ.get("CONVERSION_WORKERS", 2)),
+        # Convert inputs of at least `parallel_min_lines` lines with a pool of `parallel_workers` processes
+        "parallel_workers": int(os.environ.get("CONVERSION_PARALLEL_WORKERS", 4)),
+        "parallel_min_lines": int(os.environ.get("CONVERSION_PARALLEL_MIN_LINES", 50)),
+        # Local UTA snapshot (conversion/uta_snapshot.py), used instead of the UTA database if it exists
+        "uta_snapshot": os.environ.get(
+            "UTA_SNAPSHOT",
+            os.path.join(os.environ.get("ANNO_DATA", os.path.join(ROOT_DIR, "data")), "uta_snapshot", "uta.sqlite"),
+        ),
+        # Persistent cache of hgvsc conversions, shared between tasks
+        "cache": {
+            "enabled": bool(int(os.environ.get("CONVERSION_CACHE", 1))),
+            "path": os.environ.get(
+                "CONVERSION_CACHE_PATH", os.path.join(os.environ["WORKFOLDER"], "conversion_cache.sqlite")
+            ),
+            "max_entries": int(os.environ.get("CONVERSION_CACHE_MAX_ENTRIES", 500000)),
+        },
+    },
 }
@@ -0,0 +1,226 @@
+"""
+Persistent cache of HGVSc to vcf conversions, shared between tasks.
+
+Conversions are keyed on the normalized HGVSc (gene name removed) and a version, which is a hash of the UTA and
+seqrepo versions, the reference genome and the conversion settings affecting the result. The cache stores the vcf
+position (chr, pos, ref, alt), or the error for HGVSc that can not be converted. Least recently used entries are
+evicted when the cache holds more than `max_entries` conversions.
+
+Lookups only read the database. The last use of the found entries and the hit/miss counters are buffered, and written
+together with stored conversions (flush). Conversions of other versions are purged, and the cache evicted, by
+`maintain`: when the conversion service starts, and every EVICT_INTERVAL stored conversions.
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("anno")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversion (
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    vcf TEXT,
+    error_type TEXT,
+    error TEXT,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, version)
+);
+CREATE INDEX IF NOT EXISTS conversion_last_used ON conversion (last_used);
+CREATE TABLE IF NOT EXISTS counter (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+BATCH_SIZE = 500
+# Maintain the cache every EVICT_INTERVAL stored conversions
+EVICT_INTERVAL = 100
+
+# Databases with the schema created by this process
+_INITIALIZED = set()
+
+
+def conversion_version(anno_data, fasta, replace_ref_if_mismatch):
+    with open(os.path.join(anno_data, "sources.json")) as f:
+        sources = json.load(f)
+    h = hashlib.sha256()
+    for v in [
+        sources.get("uta", {}).get("version"),
+        sources.get("seqrepo", {}).get("version"),
+        os.path.basename(fasta or ""),
+        int(bool(replace_ref_if_mismatch)),
+    ]:
+        h.update("{}\0".format(v).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class CachedError(object):
+    "A cached conversion error, re-raised as the original exception type"
+
+    def __init__(self, error_type, message):
+        self.error_type = error_type
+        self.message = message
+
+    def exception(self, hgvsc):
+        module, _, name = self.error_type.rpartition(".")
+        try:
+            cls = getattr(importlib.import_module(module), name)
+        except (ImportError, AttributeError, ValueError):
+            cls = RuntimeError
+        return cls("{}: {}".format(hgvsc, self.message))
+
+
+class ConversionCache(object):
+    def __init__(self, path, version, max_entries=None):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stored = 0
+        # Buffered last use of found entries, and hit/miss counts
+        self._used = {}
+        self._counts = {"hits": 0, "misses": 0}
+        if self.path not in _INITIALIZED or not os.path.exists(self.path):
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with self._connect() as conn:
+                conn.executescript(SCHEMA)
+            _INITIALIZED.add(self.path)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _write_buffered(self, conn):
+        if self._used:
+            conn.executemany(
+                "UPDATE conversion SET last_used = ? WHERE key = ? AND version = ?",
+                [(used, key, self.version) for key, used in self._used.items()],
+            )
+            self._used = {}
+        counts = [(name, n, n) for name, n in self._counts.items() if n]
+        if counts:
+            conn.executemany(
+                "INSERT INTO counter (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                counts,
+            )
+            self._counts = {"hits": 0, "misses": 0}
+
+    def flush(self):
+        "Write the buffered last use and counters"
+        if not self._used and not any(self._counts.values()):
+            return
+        with self._connect() as conn:
+            self._write_buffered(conn)
+
+    def get_many(self, keys):
+        """
+        Return dict of key to vcf dict, or CachedError, for the cached keys
+        """
+        keys = list(set(keys))
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), BATCH_SIZE):
+                batch = keys[i : i + BATCH_SIZE]
+                rows = conn.execute(
+                    "SELECT key, vcf, error_type, error FROM conversion WHERE version = ? AND key IN ({})".format(
+                        ", ".join("?" * len(batch))
+                    ),
+                    [self.version] + batch,
+                ).fetchall()
+                for key, vcf, error_type, error in rows:
+                    found[key] = json.loads(vcf) if vcf is not None else CachedError(error_type, error)
+        now = time.time()
+        self._used.update((key, now) for key in found)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        self._counts["hits"] += len(found)
+        self._counts["misses"] += len(keys) - len(found)
+        if len(self._used) >= BATCH_SIZE:
+            self.flush()
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put(self, key, vcf=None, error_type=None, error=None):
+        "Store a conversion, either a vcf dict or an error (exception class and message)"
+        if error_type is not None:
+            error_type = "{}.{}".format(error_type.__module__, error_type.__name__)
+            values = (key, self.version, None, error_type, error, time.time())
+        else:
+            values = (key, self.version, json.dumps(vcf), None, None, time.time())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO conversion (key, version, vcf, error_type, error, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                values,
+            )
+            self._write_buffered(conn)
+        self._stored += 1
+        if self._stored % EVICT_INTERVAL == 0:
+            self.maintain()
+
+    def maintain(self):
+        "Purge conversions of other versions, which will not be used again, and evict"
+        with self._connect() as conn:
+            purged = conn.execute("DELETE FROM conversion WHERE version != ?", (self.version,)).rowcount
+        if purged:
+            logger.info("Purged {} conversions of other versions from cache".format(purged))
+        self.evict()
+
+    def evict(self):
+        if self.max_entries is None:
+            return
+        # Evict by the actual last use
+        self.flush()
+        with self._connect() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM conversion").fetchone()[0]
+            if count > self.max_entries:
+                logger.info("Evicting {} conversions from cache".format(count - self.max_entries))
+                conn.execute(
+                    "DELETE FROM conversion WHERE rowid IN (SELECT rowid FROM conversion ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def stats(self):
+        self.flush()
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counter").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM conversion").fetchone()[0]
+        return {"entries": entries, "hits": counters.get("hits", 0), "misses": counters.get("misses", 0)}
+
+
+def open_cache():
+    "Open the conversion cache configured in config['convert']['cache'], or None if disabled or not available"
+    from config import config
+
+    cache_config = config["convert"]["cache"]
+    if not cache_config["enabled"]:
+        return None
+    try:
+        return ConversionCache(
+            cache_config["path"],
+            conversion_version(
+                os.environ["ANNO_DATA"], os.environ.get("FASTA"), config["convert"]["replace_ref_if_mismatch"]
+            ),
+            max_entries=cache_config["max_entries"],
+        )
+    except Exception:
+        # The cache is an optimization only
+        logger.exception("Unable to open conversion cache, converting without cache")
+        return None
@@ -1,4 +1,6 @@
-import signal
+import threading
+import time
+from contextlib import contextmanager
 
 from . import vcfhelper
 
@@ -122,9 +124,49 @@ class TimeoutError(Exception):
     pass
 
 
-def timeout_handler(*args, **kwargs):
-    signal.alarm(0)
-    raise TimeoutError("Function timed out")
+# Deadline of the conversion running in the current thread, see `deadline`
+_deadline = threading.local()
 
 
-signal.signal(signal.SIGALRM, timeout_handler)
+@contextmanager
+def deadline(seconds):
+    """
+    Cooperative timeout for the code run in this context: `check_deadline` raises TimeoutError once `seconds` have
+    passed. Unlike signal.alarm, this works in any thread and process, so conversions can run concurrently.
+    """
+    previous = getattr(_deadline, "at", None)
+    at = time.monotonic() + seconds
+    _deadline.at = at if previous is None else min(at, previous)
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+def check_deadline():
+    at = getattr(_deadline, "at", None)
+    if at is not None and time.monotonic() > at:
+        raise TimeoutError("Function timed out")
+
+
+class DeadlineDataProvider(object):
+    """
+    Wraps an hgvs data provider, checking the deadline of the calling thread before and after every call. Variants
+    that hang in hgvs do so in loops fetching transcript data or sequence, which are interrupted by the checks.
+    """
+
+    def __init__(self, hdp):
+        self._hdp = hdp
+
+    def __getattr__(self, name):
+        attr = getattr(self._hdp, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            check_deadline()
+            result = attr(*args, **kwargs)
+            check_deadline()
+            return result
+
+        return call
@@ -1,5 +1,8 @@
+import json
 import re
-from conversion.exporters import SeqPilotExporter, HGVScExporter
+import socket
+
+from config import config
 
 RE_SEQPILOT = re.compile(r".*Transcript.*\tc. HGVS|.*c. HGVS.*\tTranscript")
 
@@ -19,14 +22,21 @@ def _is_seqpilot_format(input):
         return False
 
 
-def convert_to_vcf(input, output):
+def create_exporter(input, output, resources=None):
+    # Imported here, as importing hgvs is slow and not needed when converting through the conversion service
+    from conversion.exporters import SeqPilotExporter, HGVScExporter
+
     # Determine if input is a SeqPilot export by looking at the header line
     is_seqpilot = _is_seqpilot_format(input)
 
     if is_seqpilot:
-        exporter = SeqPilotExporter(input, output_vcf=output)
+        return SeqPilotExporter(input, output_vcf=output, resources=resources)
     else:
-        exporter = HGVScExporter(input, output_vcf=output)
+        return HGVScExporter(input, output_vcf=output, resources=resources)
+
+
+def convert_to_vcf(input, output, resources=None):
+    exporter = create_exporter(input, output, resources=resources)
 
     # Convert input file to vcf
     exporter.parse()
@@ -35,11 +45,62 @@ def convert_to_vcf(input, output):
     return exporter.report()
 
 
+def format_report(stats):
+    "Conversion report, from the stats of an exporter (Exporter.stats), or the merged stats of several"
+    s = "Number of lines successfully written: %d" % stats["successful"]
+    if stats["errors"]:
+        s += "\nErrors:\n"
+        for k, n in sorted(stats["errors"].items(), key=lambda item: -item[1]):
+            s += "{:<30}\t{:>6}\n".format(k, n)
+    else:
+        s += " (no errors)\n"
+    if stats.get("cache_hits") is not None:
+        s += "Conversion cache hits: %d, misses: %d\n" % (stats["cache_hits"], stats["cache_misses"])
+    return s
+
+
+def convert_with_service(input, output, socket_path=None):
+    """
+    Convert input file through the conversion service (see conversion/service.py), which keeps the hgvs tools
+    loaded between tasks. Returns None if the service is not available.
+    """
+    socket_path = socket_path or config["convert"]["socket"]
+    with open(input, "r") as f:
+        request = json.dumps({"input": f.read()}) + "\n"
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(5)
+        s.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError, socket.timeout):
+        s.close()
+        return None
+
+    with s:
+        # Conversion may take a long time, no timeout after connecting
+        s.settimeout(None)
+        s.sendall(request.encode("utf-8"))
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile("r", encoding="utf-8") as f:
+            response = f.read()
+    if not response:
+        raise RuntimeError("No response from conversion service at {}".format(socket_path))
+    response = json.loads(response)
+    if "error" in response:
+        raise RuntimeError("{}: {}".format(response["type"], response["error"]))
+
+    with open(output, "w") as f:
+        f.write(response["vcf"])
+    return response["report"]
+
+
 if __name__ == "__main__":
     import sys
 
     input = sys.argv[1]
     output = sys.argv[2]
 
-    exporter = convert_to_vcf(input, output)
-    print(exporter)
+    report = convert_with_service(input, output)
+    if report is None:
+        report = convert_to_vcf(input, output)
+    print(report)
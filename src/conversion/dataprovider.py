@@ -0,0 +1,63 @@
+"""
+hgvs data provider reading the transcript data from a local UTA snapshot (see conversion/uta_snapshot.py), instead
+of querying the UTA postgres database for every variant. Sequences are fetched from seqrepo, as with the UTA data
+provider.
+"""
+
+import hgvs.dataproviders.interface
+from hgvs.dataproviders.seqfetcher import SeqFetcher
+
+from .uta_snapshot import UTASnapshot
+
+
+class UTASnapshotDataProvider(hgvs.dataproviders.interface.Interface):
+    required_version = "1.1"
+
+    def __init__(self, path):
+        self.snapshot = UTASnapshot(path)
+        self.seqfetcher = SeqFetcher()
+        super(UTASnapshotDataProvider, self).__init__()
+
+    def close(self):
+        self.snapshot.close()
+
+    def data_version(self):
+        return self.snapshot.data_version()
+
+    def schema_version(self):
+        return self.snapshot.schema_version()
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        return self.seqfetcher.fetch_seq(ac, start_i, end_i)
+
+    def get_acs_for_protein_seq(self, seq):
+        # Protein sequences are not part of the snapshot
+        return []
+
+    def get_gene_info(self, gene):
+        return self.snapshot.get_gene_info(gene)
+
+    def get_pro_ac_for_tx_ac(self, tx_ac):
+        return self.snapshot.get_pro_ac_for_tx_ac(tx_ac)
+
+    def get_similar_transcripts(self, tx_ac):
+        # Transcript similarity is not part of the snapshot
+        return []
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        return self.snapshot.get_tx_exons(tx_ac, alt_ac, alt_aln_method)
+
+    def get_tx_for_gene(self, gene):
+        return self.snapshot.get_tx_for_gene(gene)
+
+    def get_tx_for_region(self, alt_ac, alt_aln_method, start_i, end_i):
+        return self.snapshot.get_tx_for_region(alt_ac, alt_aln_method, start_i, end_i)
+
+    def get_tx_identity_info(self, tx_ac):
+        return self.snapshot.get_tx_identity_info(tx_ac)
+
+    def get_tx_info(self, tx_ac, alt_ac, alt_aln_method):
+        return self.snapshot.get_tx_info(tx_ac, alt_ac, alt_aln_method)
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self.snapshot.get_tx_mapping_options(tx_ac)
@@ -1,9 +1,10 @@
-import signal
 import re
 import os
 import datetime
 import tempfile
 import json
+import multiprocessing
+import pickle
 from collections import defaultdict
 
 # Module for converting data
@@ -20,9 +21,13 @@ import pysam
 
 from config import config
 from .vcf_writer import VcfWriter
+from .convert import format_report
+from .conversion_cache import CachedError, open_cache
+from .dataprovider import UTASnapshotDataProvider
 from .conversion_utils import (
     var_g_to_vcf,
-    timeout_handler,
+    deadline,
+    DeadlineDataProvider,
     VcfInvalidVariantError,
     HGVScInvalidVariantError,
 )
@@ -31,15 +36,6 @@ import logging
 
 logger = logging.getLogger("anno")
 
-# Some HGVSc variants might hang during conversion. Setting a handler for
-# timeout errors. This can be triggered with:
-#
-#   signal.alarm(5)
-#   time.sleep(6)  # <-- Triggers the timeout handler which raises a TimeoutError
-#   signal.alarm(0) # <-- Reset the timeout criteria. Functions run after this will not time out.
-#
-signal.signal(signal.SIGALRM, timeout_handler)
-
 if "HGVS_SEQREPO_DIR" not in os.environ:
     with open(os.path.join(os.environ["ANNO_DATA"], "sources.json")) as sources_file:
         sources = json.load(sources_file)
@@ -60,6 +56,32 @@ if "UTA_DB_URL" not in os.environ:
         os.environ["UTA_DB_URL"] = "postgresql://uta_admin@localhost:{}/uta/uta_{}".format(port, uta_version)
 
 
+class ConversionResources(object):
+    """
+    The tools required for converting hgvsc to vcf. These are expensive to create (database connection, assembly
+    mapper and reference genome), and can be shared between exporters (see conversion/service.py).
+
+    The transcript data is read from the local UTA snapshot if available, otherwise from the UTA database.
+    """
+
+    def __init__(self):
+        self.FASTA = pysam.FastaFile(os.environ["FASTA"])
+        self.HGVS_PARSER = hgvs.parser.Parser()
+        if os.path.isfile(config["convert"]["uta_snapshot"]):
+            self.UTA_CONNECTION = UTASnapshotDataProvider(config["convert"]["uta_snapshot"])
+        else:
+            self.UTA_CONNECTION = hgvs.dataproviders.uta.connect()
+        # Some HGVSc variants might hang during conversion. The mapper checks the conversion deadline (see
+        # Exporter._convert_hgvsc) on every data provider call, and raises a TimeoutError when passed.
+        self.VARIANT_MAPPER = hgvs.assemblymapper.AssemblyMapper(
+            DeadlineDataProvider(self.UTA_CONNECTION), assembly_name="GRCh37", replace_reference=True
+        )
+
+    def close(self):
+        self.UTA_CONNECTION.close()
+        self.FASTA.close()
+
+
 class Exporter(object):
     """
     Base class for exporters.
@@ -69,14 +91,21 @@ class Exporter(object):
     # NM_000059.3(BRCA2):c.486_488delGAG -> NM_000059.3:c.486_488delGAG
     HGVSC_REPLACE_PATTERN = re.compile(r"\(.*\)")
 
-    def __init__(self, input, output_vcf=None):
-        # Create the tools required for converting hgvsc to vcf
-        self.FASTA = pysam.FastaFile(os.environ["FASTA"])
-        self.HGVS_PARSER = hgvs.parser.Parser()
-        self.UTA_CONNECTION = hgvs.dataproviders.uta.connect()
-        self.VARIANT_MAPPER = hgvs.assemblymapper.AssemblyMapper(
-            self.UTA_CONNECTION, assembly_name="GRCh37", replace_reference=True
-        )
+    def __init__(self, input, output_vcf=None, resources=None, workers=None, use_cache=True):
+        # Create the tools required for converting hgvsc to vcf, unless shared resources are given
+        self._owns_resources = resources is None
+        # Number of worker processes for large inputs. Exporters with shared resources (e.g. in the conversion
+        # service, which runs in daemon processes) always convert in-process.
+        if workers is None:
+            workers = config["convert"]["parallel_workers"]
+        self.workers = workers if resources is None else 1
+        if resources is None:
+            resources = ConversionResources()
+        self.resources = resources
+        self.FASTA = resources.FASTA
+        self.HGVS_PARSER = resources.HGVS_PARSER
+        self.UTA_CONNECTION = resources.UTA_CONNECTION
+        self.VARIANT_MAPPER = resources.VARIANT_MAPPER
 
         self.data = open(input, "r")
 
@@ -95,6 +124,17 @@ class Exporter(object):
         self.errors = defaultdict(list)
         self.successful = 0
 
+        self.cache = open_cache() if use_cache else None
+
+    @staticmethod
+    def _cache_key(hgvsc):
+        return Exporter.HGVSC_REPLACE_PATTERN.sub("", hgvsc)
+
+    @staticmethod
+    def _is_cacheable_error(e):
+        # Only errors given by the HGVSc and the data versions, not e.g. timeouts or database errors
+        return isinstance(e, (hgvs.exceptions.HGVSError, HGVScInvalidVariantError))
+
     def __convert(self, hgvsc):
         hgvsc = Exporter.HGVSC_REPLACE_PATTERN.sub("", hgvsc)
         try:
@@ -128,28 +168,132 @@ class Exporter(object):
         Convert hgvsc to hgvsg, using the hgvs module (https://github.com/biocommons/hgvs)
         """
 
-        signal.alarm(30)  # Set a 30 second timeout for the commands below
         try:
-            var_g = self.__convert(hgvsc)
+            with deadline(config["convert"]["timeout"]):
+                return self.__convert(hgvsc)
         except Exception as e:
-            signal.alarm(0)
             raise type(e)("{}: {}".format(hgvsc, getattr(e, 'message', repr(e))))
-        signal.alarm(0)
-        return var_g
 
     def iter_data(self):
         for l in self.data:
             yield l.strip()
 
+    def convert_all(self, hgvscs, comment):
+        """
+        Convert hgvscs to vcf dicts, yielding (vcf_data, None) or (None, exception) for every hgvsc in input order.
+        Cached conversions are looked up in one go, and large inputs are converted by a pool of worker processes, each
+        with its own database connection and mapper. The conversions of the workers are stored in the cache here.
+        """
+        cached = {}
+        if self.cache is not None:
+            try:
+                cached = self.cache.get_many([Exporter._cache_key(hgvsc) for hgvsc in hgvscs])
+            except Exception:
+                logger.exception("Conversion cache lookup failed")
+        uncached = [hgvsc for hgvsc in hgvscs if Exporter._cache_key(hgvsc) not in cached]
+        converted = self._convert_uncached(uncached, comment)
+
+        for hgvsc in hgvscs:
+            result = cached.get(Exporter._cache_key(hgvsc))
+            if result is None:
+                yield next(converted)
+                continue
+            try:
+                yield self._to_vcfdict(hgvsc, result, comment), None
+            except Exception as e:
+                yield None, e
+
+        if self.cache is not None:
+            try:
+                self.cache.flush()
+            except Exception:
+                logger.exception("Unable to update conversion cache")
+
+    def _convert_uncached(self, hgvscs, comment):
+        if self.workers <= 1 or len(hgvscs) < config["convert"]["parallel_min_lines"]:
+            for hgvsc in hgvscs:
+                try:
+                    yield self.hgvsc_to_vcfdict(hgvsc, comment, lookup=False), None
+                except Exception as e:
+                    yield None, e
+            return
+
+        workers = min(self.workers, len(hgvscs))
+        pool = multiprocessing.Pool(processes=workers, initializer=_init_worker)
+        try:
+            # imap returns the results in input order
+            chunksize = max(1, min(16, len(hgvscs) // (4 * workers)))
+            for hgvsc, (vcf_data, error) in zip(hgvscs, pool.imap(_worker_hgvsc_to_vcf, hgvscs, chunksize)):
+                self._store_conversion(hgvsc, vcf_data=vcf_data, error=error)
+                if error is not None:
+                    yield None, error
+                    continue
+                try:
+                    yield self._complete_vcfdict(dict(vcf_data), hgvsc, comment), None
+                except Exception as e:
+                    yield None, e
+        finally:
+            pool.terminate()
+            pool.join()
+
     def parse(self):
         raise NotImplementedError("Must be implemented in subclass")
 
     def get(self):
         return open(self.vcf_writer.path, "r")
 
-    def hgvsc_to_vcfdict(self, hgvsc, comment):
-        var_g = self._convert_hgvsc(hgvsc)
-        vcf_data = var_g_to_vcf(var_g, self.FASTA)
+    def _hgvsc_to_vcf(self, hgvsc, lookup=True):
+        """
+        Convert hgvsc to the vcf position (chr, pos, ref, alt), using the conversion cache if available
+        """
+        key = Exporter._cache_key(hgvsc)
+        if self.cache is not None and lookup:
+            try:
+                cached = self.cache.get(key)
+            except Exception:
+                logger.exception("Conversion cache lookup failed")
+                cached = None
+            if isinstance(cached, CachedError):
+                raise cached.exception(hgvsc)
+            if cached is not None:
+                return cached
+
+        try:
+            vcf_data = var_g_to_vcf(self._convert_hgvsc(hgvsc), self.FASTA)
+        except Exception as e:
+            self._store_conversion(hgvsc, error=e)
+            raise
+        self._store_conversion(hgvsc, vcf_data=vcf_data)
+        return vcf_data
+
+    def _store_conversion(self, hgvsc, vcf_data=None, error=None):
+        "Store the vcf position, or the error, of a conversion in the cache"
+        if self.cache is None:
+            return
+        key = Exporter._cache_key(hgvsc)
+        try:
+            if error is None:
+                self.cache.put(key, vcf=vcf_data)
+            elif Exporter._is_cacheable_error(error):
+                # Store the message without the hgvsc prefix added by _convert_hgvsc
+                message = getattr(error, "message", str(error))
+                if message.startswith(hgvsc + ": "):
+                    message = message[len(hgvsc) + 2 :]
+                self.cache.put(key, error_type=type(error), error=message)
+        except Exception:
+            logger.exception("Unable to store conversion in cache")
+
+    def _to_vcfdict(self, hgvsc, result, comment):
+        "Create vcf dict from a cached conversion"
+        if isinstance(result, CachedError):
+            raise result.exception(hgvsc)
+        return self._complete_vcfdict(dict(result), hgvsc, comment)
+
+    def hgvsc_to_vcfdict(self, hgvsc, comment, lookup=True):
+        vcf_data = dict(self._hgvsc_to_vcf(hgvsc, lookup=lookup))
+        return self._complete_vcfdict(vcf_data, hgvsc, comment)
+
+    def _complete_vcfdict(self, vcf_data, hgvsc, comment):
         if vcf_data["ref"] == vcf_data["alt"]:
             raise VcfInvalidVariantError(
                 "Not a variant. Reference {} matches alternate {}.".format(
@@ -166,20 +310,18 @@ class Exporter(object):
         )
         return vcf_data
 
+    def stats(self):
+        stats = {"successful": self.successful, "errors": {k: len(v) for k, v in self.errors.items()}}
+        if self.cache is not None:
+            stats.update({"cache_hits": self.cache.hits, "cache_misses": self.cache.misses})
+        return stats
+
     def report(self):
-        s = "Number of lines successfully written: %d" % self.successful
-        if self.errors:
-            s += "\nErrors:\n"
-            for k, v in sorted(
-                list(self.errors.items()), cmp=lambda x, y: len(y[1]) - len(x[1])
-            ):
-                s += "{:<30}\t{:>6}\n".format(k, len(v))
-        else:
-            s += " (no errors)\n"
-        return s
+        return format_report(self.stats())
 
     def __del__(self):
-        self.UTA_CONNECTION.close()
+        if self._owns_resources:
+            self.resources.close()
         self.data.close()
 
 
@@ -206,12 +348,12 @@ class HGVScExporter(Exporter):
     def parse(self, comment="HGVScExport"):
         gt_mapping = {"het": "0/1", "homo": "1/1", "hom": "1/1"}
         with self.vcf_writer:
-            for hgvsc, gt in self.iter_data():
-                try:
-                    vcf_data = self.hgvsc_to_vcfdict(hgvsc, comment)
-                except Exception as e:
+            data = list(self.iter_data())
+            converted = self.convert_all([hgvsc for hgvsc, _ in data], comment)
+            for (hgvsc, gt), (vcf_data, e) in zip(data, converted):
+                if e is not None:
                     if config["convert"]["fail_on_conversion_error"]:
-                        raise
+                        raise e
                     logger.warning(e.__class__.__name__, hgvsc, getattr(e, 'message', repr(e)))
                     self.errors[e.__class__.__name__].append((hgvsc, getattr(e, 'message', repr(e))))
                     continue
@@ -242,22 +384,18 @@ class SeqPilotExporter(Exporter):
     def parse(self, comment="SeqPilotExport"):
         gt_mapping = {"het": "0/1", "homo": "1/1", "hom": "1/1"}
         with self.vcf_writer:
-            for line in self.iter_data():
-
-                hgvsc = "{tx}:{hgvsc}".format(
-                    tx=line["Transcript"], hgvsc=line["c. HGVS"]
-                )
+            data = list(self.iter_data())
+            hgvscs = ["{tx}:{hgvsc}".format(tx=line["Transcript"], hgvsc=line["c. HGVS"]) for line in data]
+            for line, hgvsc, (vcf_data, e) in zip(data, hgvscs, self.convert_all(hgvscs, comment)):
                 try:
                     gt = re.findall(r"[ACGT]*\((.*)\)", line["Nuc Change"])[0]
                     gt_vcf = gt_mapping[gt]
                 except Exception:
                     gt_vcf = "./."
 
-                try:
-                    vcf_data = self.hgvsc_to_vcfdict(hgvsc, comment)
-                except Exception as e:
+                if e is not None:
                     if config["convert"]["fail_on_conversion_error"]:
-                        raise
+                        raise e
                     logger.warning("%s: %s" % (hgvsc, str(e)))
                     self.errors[e.__class__.__name__].append((hgvsc, getattr(e, 'message', repr(e))))
                     continue
@@ -268,3 +406,31 @@ class SeqPilotExporter(Exporter):
                 self.successful += 1
 
         assert self.successful > 0, "No lines written to vcf"
+
+
+# Exporter of a conversion worker process (see Exporter.convert_all), or the error from creating it
+_WORKER_EXPORTER = None
+_WORKER_ERROR = None
+
+
+def _init_worker():
+    global _WORKER_EXPORTER, _WORKER_ERROR
+    try:
+        # Cache lookups and stores are done by the parent exporter
+        _WORKER_EXPORTER = Exporter(os.devnull, output_vcf=os.devnull, workers=1, use_cache=False)
+    except Exception as e:
+        # Reported for every hgvsc, rather than having the pool restart the worker in a loop
+        _WORKER_ERROR = e
+
+
+def _worker_hgvsc_to_vcf(hgvsc):
+    try:
+        if _WORKER_ERROR is not None:
+            raise _WORKER_ERROR
+        return _WORKER_EXPORTER._hgvsc_to_vcf(hgvsc, lookup=False), None
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError("{}: {}".format(type(e).__name__, e))
+        return None, e
@@ -0,0 +1,184 @@
+"""
+Conversion service, converting HGVSc input to vcf for the CONVERT step of the pipeline.
+
+Starting a conversion is expensive: importing hgvs, connecting to the UTA database, creating the assembly mapper
+and opening the reference genome take longer than converting a typical request. The service keeps a pool of worker
+processes with these resources loaded, and accepts requests on a local (unix) socket.
+
+Protocol: the client sends one json object {"input": <file content>} and closes its end for writing. The service
+replies with {"vcf": <vcf content>, "report": <report>}, or {"error": <message>, "type": <exception name>}.
+
+Inputs of at least `parallel_min_lines` lines (config["convert"]) are split in consecutive parts, one per worker,
+which are converted concurrently and joined in input order.
+
+Usage:
+    python3 src/conversion/service.py [--socket $WORKFOLDER/run/conversion.sock] [--group anno] [--workers 2]
+"""
+
+import grp
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socketserver
+import tempfile
+
+from config import config
+from conversion.conversion_cache import open_cache
+from conversion.convert import RE_SEQPILOT, format_report
+
+logger = logging.getLogger("anno")
+
+# Resources of the worker process, created by _init_worker
+_RESOURCES = None
+
+
+def _init_worker():
+    # Import and connect once per worker, not per request
+    global _RESOURCES
+    try:
+        from conversion.exporters import ConversionResources
+
+        _RESOURCES = ConversionResources()
+    except Exception:
+        # E.g. database not ready yet. Retried on the first request, rather than restarting the worker in a loop.
+        logger.exception("Unable to initialize conversion worker")
+
+
+def _convert(input):
+    global _RESOURCES
+    from conversion.convert import create_exporter
+
+    tmp_dir = tempfile.mkdtemp(prefix="anno_conversion_")
+    try:
+        input_file = os.path.join(tmp_dir, "input.txt")
+        output_file = os.path.join(tmp_dir, "output.vcf")
+        with open(input_file, "w") as f:
+            f.write(input)
+        if _RESOURCES is None:
+            from conversion.exporters import ConversionResources
+
+            _RESOURCES = ConversionResources()
+        exporter = create_exporter(input_file, output_file, resources=_RESOURCES)
+        exporter.parse()
+        with open(output_file, "r") as f:
+            return {"vcf": f.read(), "report": exporter.report(), "stats": exporter.stats()}
+    except Exception as e:
+        # Reconnect on database errors (e.g. database restarted), the connection may be unusable
+        if _RESOURCES is not None and type(e).__module__.startswith("psycopg2"):
+            _RESOURCES.close()
+            _RESOURCES = None
+        return {"error": getattr(e, "message", str(e)), "type": type(e).__name__}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def split_input(input, parts, min_lines):
+    """
+    Split input in up to `parts` parts of consecutive lines. SeqPilot exports keep their header line in every part.
+    Inputs of less than `min_lines` lines are not split.
+    """
+    lines = input.splitlines(True)
+    header = []
+    if lines and RE_SEQPILOT.match(lines[0].strip()):
+        header, lines = lines[:1], lines[1:]
+    if parts <= 1 or len(lines) < min_lines:
+        return [input]
+    size = -(-len(lines) // parts)
+    return ["".join(header + lines[i : i + size]) for i in range(0, len(lines), size)]
+
+
+def merge_responses(responses):
+    "Join the responses for the parts of an input, in input order"
+    for response in responses:
+        if "error" in response:
+            return response
+    vcf = responses[0]["vcf"]
+    for response in responses[1:]:
+        vcf += "".join(l for l in response["vcf"].splitlines(True) if not l.startswith("#"))
+    stats = {"successful": 0, "errors": {}}
+    for response in responses:
+        part_stats = response["stats"]
+        stats["successful"] += part_stats["successful"]
+        for k, n in part_stats["errors"].items():
+            stats["errors"][k] = stats["errors"].get(k, 0) + n
+        for k in ["cache_hits", "cache_misses"]:
+            if part_stats.get(k) is not None:
+                stats[k] = stats.get(k, 0) + part_stats[k]
+    return {"vcf": vcf, "report": format_report(stats), "stats": stats}
+
+
+class ConversionRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.read().decode("utf-8"))
+            parts = split_input(request["input"], self.server.workers, config["convert"]["parallel_min_lines"])
+            if len(parts) == 1:
+                response = self.server.pool.apply(_convert, (parts[0],))
+            else:
+                logger.info("Converting input of {} lines in {} parts".format(request["input"].count("\n"), len(parts)))
+                # map returns the responses in input order
+                response = merge_responses(self.server.pool.map(_convert, parts, chunksize=1))
+        except Exception as e:
+            logger.exception("Conversion request failed")
+            response = {"error": str(e), "type": type(e).__name__}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class ConversionService(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers, group=None):
+        """
+        Listen on `socket_path`, which only the user of the service and the members of `group` (default: the group of
+        the service) may connect to
+        """
+        gid = grp.getgrnam(group).gr_gid if group else -1
+        run_dir = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.isdir(run_dir):
+            os.makedirs(run_dir)
+            os.chmod(run_dir, 0o750)
+            os.chown(run_dir, -1, gid)
+        # Remove socket left behind by a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.workers = workers
+        self.pool = multiprocessing.Pool(processes=workers, initializer=_init_worker)
+        socketserver.ThreadingUnixStreamServer.__init__(self, socket_path, ConversionRequestHandler)
+        # Tasks may run as a different user of the group
+        os.chown(socket_path, -1, gid)
+        os.chmod(socket_path, 0o660)
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        self.pool.terminate()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run conversion service")
+    parser.add_argument("--socket", default=config["convert"]["socket"], help="path of unix socket to listen on")
+    parser.add_argument(
+        "--group", default=config["convert"]["socket_group"], help="group allowed to connect (default: own group)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=config["convert"]["workers"], help="number of conversion worker processes"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Purge and evict the conversion cache once, rather than for every conversion
+    cache = open_cache()
+    if cache is not None:
+        cache.maintain()
+    service = ConversionService(args.socket, args.workers, group=args.group)
+    logger.info("Conversion service listening on {} ({} workers)".format(args.socket, args.workers))
+    try:
+        service.serve_forever()
+    finally:
+        service.server_close()
@@ -0,0 +1,304 @@
+"""
+Local snapshot of the UTA (universal transcript archive) data used to map HGVSc to genomic positions.
+
+The UTA postgres database holds far more than the conversion needs (sequences, alignments to patches, protein data).
+The snapshot is a read-only SQLite file with the transcripts, the exon alignments to the assembly sequences and
+the gene info, and is memory mapped by every process reading it. It is created from the UTA database by
+`sync_data.py --generate --dataset uta_snapshot`, and used by `conversion.dataprovider.UTASnapshotDataProvider`.
+
+Usage:
+    python3 src/conversion/uta_snapshot.py --output uta_20210129.sqlite [--db-url postgresql://...] [--assembly GRCh37]
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+logger = logging.getLogger("anno")
+
+SCHEMA = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE transcript (
+    tx_ac TEXT PRIMARY KEY,
+    hgnc TEXT,
+    cds_start_i INTEGER,
+    cds_end_i INTEGER,
+    lengths TEXT
+);
+CREATE TABLE exon (
+    tx_ac TEXT NOT NULL,
+    alt_ac TEXT NOT NULL,
+    alt_aln_method TEXT NOT NULL,
+    alt_strand INTEGER NOT NULL,
+    ord INTEGER NOT NULL,
+    tx_start_i INTEGER NOT NULL,
+    tx_end_i INTEGER NOT NULL,
+    alt_start_i INTEGER NOT NULL,
+    alt_end_i INTEGER NOT NULL,
+    cigar TEXT
+);
+CREATE TABLE gene (
+    hgnc TEXT PRIMARY KEY,
+    maploc TEXT,
+    descr TEXT,
+    summary TEXT,
+    aliases TEXT,
+    added TEXT
+);
+CREATE TABLE associated_accessions (
+    tx_ac TEXT NOT NULL,
+    pro_ac TEXT NOT NULL,
+    origin TEXT
+);
+"""
+
+# Created after loading the data, which is faster than updating the indexes on every insert
+INDEXES = """
+CREATE INDEX exon_tx ON exon (tx_ac, alt_ac, alt_aln_method);
+CREATE INDEX exon_alt ON exon (alt_ac, alt_aln_method, alt_start_i);
+CREATE INDEX transcript_hgnc ON transcript (hgnc);
+CREATE INDEX associated_accessions_tx ON associated_accessions (tx_ac);
+"""
+
+# Queries on the UTA database (schema 1.1), see hgvs.dataproviders.uta
+EXPORT_QUERIES = {
+    "transcript": """
+        SELECT T.ac, T.hgnc, T.cds_start_i, T.cds_end_i, D.lengths
+        FROM transcript T LEFT JOIN tx_def_summary_v D ON D.tx_ac = T.ac
+    """,
+    "exon": """
+        SELECT tx_ac, alt_ac, alt_aln_method, alt_strand, ord, tx_start_i, tx_end_i, alt_start_i, alt_end_i, cigar
+        FROM tx_exon_aln_v
+        WHERE alt_ac = ANY(%s) AND exon_aln_id IS NOT NULL
+    """,
+    "gene": "SELECT hgnc, maploc, descr, summary, aliases, added FROM gene",
+    "associated_accessions": "SELECT tx_ac, pro_ac, origin FROM associated_accessions",
+}
+
+BATCH_SIZE = 10000
+# Memory map up to 4 GB of the snapshot, the pages are shared between all processes reading it
+MMAP_SIZE = 4 * 1024**3
+
+
+class Row(dict):
+    "Row accessible by column name and by index, like the rows returned by the UTA data provider"
+
+    def __init__(self, columns, values):
+        dict.__init__(self, zip(columns, values))
+        self._values = list(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return dict.__getitem__(self, key)
+
+
+def _parse_db_url(db_url):
+    # postgresql://uta_admin@localhost:5432/uta/uta_20210129
+    url = urlparse(db_url)
+    database, _, schema = url.path.strip("/").partition("/")
+    return {
+        "host": url.hostname,
+        "port": url.port or 5432,
+        "user": url.username,
+        "password": url.password,
+        "dbname": database,
+        "schema": schema or None,
+    }
+
+
+def _default_db_url():
+    if "UTA_DB_URL" in os.environ:
+        return os.environ["UTA_DB_URL"]
+    import json
+
+    with open(os.path.join(os.environ["ANNO_DATA"], "sources.json")) as sources_file:
+        uta_version = json.load(sources_file)["uta"]["version"]
+    port = os.getenv("PGPORT", 5432)
+    return "postgresql://uta_admin@localhost:{}/uta/uta_{}".format(port, uta_version)
+
+
+def export(db_url, output, assemblies=("GRCh37",)):
+    """
+    Export the UTA data needed for mapping transcripts to the given assemblies from the database at `db_url` to
+    a new snapshot at `output`. The snapshot is written to a temporary file and moved in place when complete.
+    """
+    import psycopg2
+    from bioutils.assemblies import make_ac_name_map
+
+    params = _parse_db_url(db_url)
+    schema = params.pop("schema")
+    alt_acs = sorted(set(ac for assembly in assemblies for ac in make_ac_name_map(assembly)))
+
+    tmp_output = output + ".tmp"
+    if os.path.exists(tmp_output):
+        os.unlink(tmp_output)
+    pg_conn = psycopg2.connect(**params)
+    conn = sqlite3.connect(tmp_output)
+    try:
+        conn.executescript(SCHEMA)
+        with pg_conn.cursor() as cursor:
+            if schema:
+                cursor.execute("SET search_path = {}".format(schema))
+            cursor.execute("SELECT key, value FROM meta WHERE key = 'schema_version'")
+            meta = {"data_version": schema, "schema_version": cursor.fetchone()[1], "assemblies": ",".join(assemblies)}
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", list(meta.items()))
+
+        for table, query in EXPORT_QUERIES.items():
+            # Server side cursor, the tables do not fit comfortably in memory
+            with pg_conn.cursor(name="export_{}".format(table)) as cursor:
+                cursor.execute(query, (alt_acs,) if table == "exon" else None)
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(BATCH_SIZE)
+                    if not rows:
+                        break
+                    if table == "transcript":
+                        rows = [row[:4] + (_join(row[4]),) for row in rows]
+                    elif table == "gene":
+                        rows = [row[:4] + (_join(row[4]), str(row[5]) if row[5] is not None else None) for row in rows]
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO {} VALUES ({})".format(table, ", ".join("?" * len(rows[0]))), rows
+                    )
+                    count += len(rows)
+            logger.info("Exported {} rows from {}".format(count, table))
+
+        conn.executescript(INDEXES)
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+        pg_conn.close()
+    os.rename(tmp_output, output)
+
+
+def _join(values):
+    return ",".join(str(v) for v in values) if values is not None else None
+
+
+def _split(value, type=str):
+    return [type(v) for v in value.split(",")] if value else None
+
+
+class UTASnapshot(object):
+    """
+    Read-only access to a UTA snapshot. Each thread gets its own connection to the (memory mapped) database file.
+    """
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise IOError("UTA snapshot not found: {}".format(path))
+        self.path = path
+        self._local = threading.local()
+        self.meta = dict(self._connection().execute("SELECT key, value FROM meta").fetchall())
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True)
+            conn.execute("PRAGMA mmap_size = {}".format(MMAP_SIZE))
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _fetchall(self, query, params=()):
+        cursor = self._connection().execute(query, params)
+        columns = [c[0] for c in cursor.description]
+        return [Row(columns, values) for values in cursor.fetchall()]
+
+    def _fetchone(self, query, params=()):
+        rows = self._fetchall(query, params)
+        return rows[0] if rows else None
+
+    def data_version(self):
+        return self.meta["data_version"]
+
+    def schema_version(self):
+        return self.meta["schema_version"]
+
+    def get_gene_info(self, gene):
+        row = self._fetchone("SELECT * FROM gene WHERE hgnc = ?", (gene,))
+        if row is not None:
+            row = Row(list(row), [row[k] if k != "aliases" else _split(row[k]) for k in row])
+        return row
+
+    def get_tx_exons(self, tx_ac, alt_ac, alt_aln_method):
+        rows = self._fetchall(
+            "SELECT T.hgnc, E.tx_ac, E.alt_ac, E.alt_aln_method, E.alt_strand, E.ord, E.tx_start_i, E.tx_end_i, "
+            "E.alt_start_i, E.alt_end_i, E.cigar FROM exon E LEFT JOIN transcript T ON T.tx_ac = E.tx_ac "
+            "WHERE E.tx_ac = ? AND E.alt_ac = ? AND E.alt_aln_method = ? ORDER BY E.alt_start_i",
+            (tx_ac, alt_ac, alt_aln_method),
+        )
+        return rows or None
+
+    def get_tx_info(self, tx_ac, alt_ac, alt_aln_method):
+        return self._fetchone(
+            "SELECT T.hgnc, T.cds_start_i, T.cds_end_i, E.tx_ac, E.alt_ac, E.alt_aln_method "
+            "FROM exon E JOIN transcript T ON T.tx_ac = E.tx_ac "
+            "WHERE E.tx_ac = ? AND E.alt_ac = ? AND E.alt_aln_method = ? LIMIT 1",
+            (tx_ac, alt_ac, alt_aln_method),
+        )
+
+    def get_tx_identity_info(self, tx_ac):
+        row = self._fetchone(
+            "SELECT tx_ac, tx_ac AS alt_ac, 'transcript' AS alt_aln_method, cds_start_i, cds_end_i, lengths, hgnc "
+            "FROM transcript WHERE tx_ac = ? AND lengths IS NOT NULL",
+            (tx_ac,),
+        )
+        if row is not None:
+            row = Row(list(row), [row[k] if k != "lengths" else _split(row[k], int) for k in row])
+        return row
+
+    def get_tx_mapping_options(self, tx_ac):
+        return self._fetchall(
+            "SELECT DISTINCT tx_ac, alt_ac, alt_aln_method FROM exon WHERE tx_ac = ? ORDER BY alt_ac, alt_aln_method",
+            (tx_ac,),
+        )
+
+    def get_tx_for_gene(self, gene):
+        return self._fetchall(
+            "SELECT T.hgnc, T.cds_start_i, T.cds_end_i, E.tx_ac, E.alt_ac, E.alt_aln_method "
+            "FROM (SELECT DISTINCT tx_ac, alt_ac, alt_aln_method FROM exon) E JOIN transcript T ON T.tx_ac = E.tx_ac "
+            "WHERE T.hgnc = ? AND T.cds_start_i IS NOT NULL ORDER BY E.tx_ac, E.alt_ac",
+            (gene,),
+        )
+
+    def get_tx_for_region(self, alt_ac, alt_aln_method, start_i, end_i):
+        return self._fetchall(
+            "SELECT tx_ac, alt_ac, alt_strand, alt_aln_method, MIN(alt_start_i) AS start_i, MAX(alt_end_i) AS end_i "
+            "FROM exon WHERE alt_ac = ? AND alt_aln_method = ? "
+            "GROUP BY tx_ac, alt_ac, alt_strand, alt_aln_method "
+            "HAVING MIN(alt_start_i) < ? AND ? <= MAX(alt_end_i) ORDER BY tx_ac",
+            (alt_ac, alt_aln_method, end_i, start_i),
+        )
+
+    def get_pro_ac_for_tx_ac(self, tx_ac):
+        row = self._fetchone(
+            "SELECT pro_ac FROM associated_accessions WHERE tx_ac = ? ORDER BY pro_ac DESC LIMIT 1", (tx_ac,)
+        )
+        return row["pro_ac"] if row is not None else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export UTA snapshot for HGVSc conversion")
+    parser.add_argument("--output", required=True, help="snapshot file to write")
+    parser.add_argument("--db-url", default=None, help="UTA database url (default: UTA_DB_URL or from sources.json)")
+    parser.add_argument(
+        "--assembly", action="append", default=None, help="export alignments to this assembly (default: GRCh37)"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    export(args.db_url or _default_db_url(), args.output, assemblies=tuple(args.assembly or ["GRCh37"]))
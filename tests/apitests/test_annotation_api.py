@@ -65,6 +65,52 @@ def test_annotate(client, input, endpoint, wait):
     assert ret["status"][last_item] == "FINALIZED"
 
 
+def test_upload_spooled(client, tmpdir, monkeypatch):
+    from annotation.task import Task
+    from api.util.util import SPOOL_CHUNK_SIZE, SpooledFile
+
+    # Larger than the uploads werkzeug keeps in memory (500 KB)
+    with open(LARGE_TEST_VCF, "r") as f:
+        lines = f.readlines()
+    header = [l for l in lines if l.startswith("#")]
+    records = [l for l in lines if not l.startswith("#")]
+    data = "".join(header + records * 8)
+    assert len(data) > 500 * 1024
+    upload = str(tmpdir.join("large.vcf"))
+    with open(upload, "w") as f:
+        f.write(data)
+
+    # The upload is copied to disk in chunks, and never read into memory
+    reads = []
+    spool = SpooledFile.spool
+
+    class RecordingStream(object):
+        def __init__(self, stream):
+            self.stream = stream
+
+        def read(self, size=-1):
+            reads.append(size)
+            return self.stream.read(size)
+
+    monkeypatch.setattr(SpooledFile, "spool", staticmethod(lambda stream, *args: spool(RecordingStream(stream), *args)))
+    monkeypatch.setattr(SpooledFile, "read", lambda self: pytest.fail("Upload read into memory"))
+
+    response = client.post_files("annotate", {"input": open(upload, "rb")})
+    assert response.status_code == 202
+    task_id = return_value(response)["task_id"]
+    try:
+        assert reads and all(0 < size <= SPOOL_CHUNK_SIZE for size in reads)
+        input_vcf = os.path.join(config["work_folder"], task_id, "input.vcf")
+        assert not os.path.islink(input_vcf)
+        with open(input_vcf, "r") as f:
+            assert f.read() == data
+        # Nothing left in the upload folder when the request is done
+        assert os.listdir(config["upload_folder"]) == []
+    finally:
+        if not Task.is_finished(task_id):
+            Task.cancel(task_id)
+
+
 @pytest.mark.parametrize("endpoint", ["diagnose", "samples", "config"])
 def test_info_endpoints(client, endpoint):
     response = client.get(endpoint)
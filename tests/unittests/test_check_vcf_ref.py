@@ -0,0 +1,73 @@
+import pytest
+
+from annotation import check_vcf_ref
+from annotation.check_vcf_ref import IncorrectReferenceError, VCFCheckRef
+
+SEQUENCES = {"1": "ACGTACGTAC" * 10, "2": "TTGGCCAA" * 10, "X": "GATTACA" * 10}
+
+
+@pytest.fixture
+def fasta(tmpdir):
+    import pysam
+
+    path = str(tmpdir.join("genome.fa"))
+    with open(path, "w") as f:
+        for chrom, seq in SEQUENCES.items():
+            f.write(">{}\n{}\n".format(chrom, seq))
+    pysam.faidx(path)
+    return path
+
+
+def write_vcf(tmpdir, records):
+    path = str(tmpdir.join("input.vcf"))
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for chrom, pos, ref in records:
+            f.write("{}\t{}\t.\t{}\tA\t.\t.\t.\n".format(chrom, pos, ref))
+    return path
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_check(tmpdir, fasta, processes):
+    vcf = write_vcf(tmpdir, [("1", 1, "ACG"), ("1", 98, "TAC"), ("2", 5, "CCAA"), ("X", 2, "A")])
+    VCFCheckRef(fasta, processes=processes).check(vcf)
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_all_mismatches_reported(tmpdir, fasta, processes):
+    vcf = write_vcf(tmpdir, [("1", 1, "ACG"), ("1", 2, "A"), ("2", 5, "CCAA"), ("X", 2, "G"), ("MT", 1, "A")])
+    assert VCFCheckRef(fasta, processes=processes).find_mismatches(vcf) == [
+        (4, "1", 2, "A", "C"),
+        (6, "X", 2, "G", "A"),
+        (7, "MT", 1, "A", None),
+    ]
+    with pytest.raises(IncorrectReferenceError, match="for 3 variant"):
+        VCFCheckRef(fasta, processes=processes).check(vcf)
+
+
+def test_windowed_fetch(tmpdir, fasta, monkeypatch):
+    # References crossing the window border, and records not in position order
+    monkeypatch.setattr(check_vcf_ref, "WINDOW_SIZE", 4)
+    records = [
+        ("1", pos, SEQUENCES["1"][pos - 1 : pos - 1 + length]) for pos, length in [(50, 1), (3, 5), (9, 3), (99, 2)]
+    ]
+    vcf = write_vcf(tmpdir, records + [("1", 100, "CA")])
+    assert VCFCheckRef(fasta, processes=1).find_mismatches(vcf) == [(7, "1", 100, "CA", "C")]
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_contigs_not_consecutive(tmpdir, fasta, processes):
+    vcf = write_vcf(tmpdir, [("1", 1, "ACG"), ("2", 5, "CCAA"), ("1", 2, "A"), ("2", 1, "T")])
+    with open(vcf, "a") as f:
+        f.write("\n")
+    contigs = check_vcf_ref.index_contigs(vcf)
+    assert [(chrom, len(runs)) for chrom, runs in contigs.items()] == [("1", 2), ("2", 2)]
+    assert list(check_vcf_ref.read_records(vcf, contigs["1"])) == [(3, 0, "ACG"), (5, 1, "A")]
+    assert VCFCheckRef(fasta, processes=processes).find_mismatches(vcf) == [(5, "1", 2, "A", "C")]
+
+
+def test_processes_default(fasta, monkeypatch):
+    monkeypatch.delenv("NUM_VEP_PROCESSES", raising=False)
+    assert VCFCheckRef(fasta).processes == 1
+    monkeypatch.setenv("NUM_VEP_PROCESSES", "4")
+    assert VCFCheckRef(fasta).processes == 4
@@ -181,3 +181,25 @@ def test_identity(exporter):
     for hgvsc, position in cases.items():
         with pytest.raises(VcfInvalidVariantError):
             exporter.hgvsc_to_vcfdict(hgvsc, "")
+
+
+def test_parallel_conversion(exporter, monkeypatch):
+    from config import config
+
+    monkeypatch.setitem(config["convert"], "fail_on_conversion_error", False)
+    monkeypatch.setitem(config["convert"], "parallel_min_lines", 1)
+    hgvscs = [
+        "NM_003159.2:c.1296_1298del",
+        "NM_000431.3:c.78+8G=",
+        "NM_057179.2:c.229_234dupCAGCGC",
+        "NM_007294.3:c.3339_3341del",
+        "NM_000527.4:c.1205dup",
+    ]
+
+    def convert(workers):
+        exporter.workers = workers
+        return [(d, None if e is None else type(e).__name__) for d, e in exporter.convert_all(hgvscs, "")]
+
+    serial = convert(1)
+    assert serial[1] == (None, "VcfInvalidVariantError")
+    assert convert(3) == serial
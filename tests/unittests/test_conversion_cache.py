@@ -0,0 +1,65 @@
+import pytest
+
+from conversion.conversion_cache import CachedError, ConversionCache
+
+VCF = {"chr": "17", "pos": 41244206, "ref": "TTCA", "alt": "T"}
+
+
+class ConversionError(Exception):
+    pass
+
+
+def test_get_put(tmpdir):
+    cache = ConversionCache(str(tmpdir.join("cache.sqlite")), "v1")
+    assert cache.get("NM_007294.3:c.3339_3341del") is None
+    cache.put("NM_007294.3:c.3339_3341del", vcf=VCF)
+    cache.put("NM_007294.3:c.foo", error_type=ConversionError, error="invalid")
+
+    found = cache.get_many(["NM_007294.3:c.3339_3341del", "NM_007294.3:c.foo", "NM_000059.3:c.1A>G"])
+    assert found["NM_007294.3:c.3339_3341del"] == VCF
+    assert isinstance(found["NM_007294.3:c.foo"], CachedError)
+    assert "NM_000059.3:c.1A>G" not in found
+
+    with pytest.raises(ConversionError, match="NM_007294.3\\(BRCA1\\):c.foo: invalid"):
+        raise found["NM_007294.3:c.foo"].exception("NM_007294.3(BRCA1):c.foo")
+
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.stats() == {"entries": 2, "hits": 2, "misses": 2}
+
+
+def test_version(tmpdir):
+    path = str(tmpdir.join("cache.sqlite"))
+    ConversionCache(path, "v1").put("NM_007294.3:c.3339_3341del", vcf=VCF)
+    assert ConversionCache(path, "v1").get("NM_007294.3:c.3339_3341del") == VCF
+    cache = ConversionCache(path, "v2")
+    assert cache.get("NM_007294.3:c.3339_3341del") is None
+    # Conversions of other versions are only purged by maintain
+    assert cache.stats()["entries"] == 1
+    cache.maintain()
+    assert cache.stats()["entries"] == 0
+    assert ConversionCache(path, "v1").get("NM_007294.3:c.3339_3341del") is None
+
+
+def test_lookups_buffered(tmpdir):
+    path = str(tmpdir.join("cache.sqlite"))
+    cache = ConversionCache(path, "v1")
+    cache.put("a", vcf=VCF)
+    assert cache.get_many(["a", "b"]) == {"a": VCF}
+    assert ConversionCache(path, "v1").stats() == {"entries": 1, "hits": 0, "misses": 0}
+
+    # Written with the next stored conversion, or flush
+    cache.put("b", vcf=VCF)
+    assert ConversionCache(path, "v1").stats() == {"entries": 2, "hits": 1, "misses": 1}
+    assert cache.get("c") is None
+    cache.flush()
+    assert ConversionCache(path, "v1").stats() == {"entries": 2, "hits": 1, "misses": 2}
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = ConversionCache(str(tmpdir.join("cache.sqlite")), "v1", max_entries=2)
+    for key in ["a", "b", "c"]:
+        cache.put(key, vcf=VCF)
+    # Use "a", making "b" the least recently used
+    assert cache.get("a") == VCF
+    cache.evict()
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
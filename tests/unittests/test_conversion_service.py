@@ -0,0 +1,113 @@
+import grp
+import os
+import stat
+import threading
+
+import pytest
+
+from config import config
+from conversion import service
+from conversion.convert import convert_with_service
+
+
+def fake_init_worker():
+    pass
+
+
+def fake_convert(input):
+    if "invalid" in input:
+        return {"error": "Unable to extract hgvsc from invalid", "type": "HGVScInvalidVariantError"}
+    lines = [l for l in input.splitlines() if l.startswith("NM_") or l.startswith("nm_")]
+    stats = {"successful": len(lines), "errors": {}, "cache_hits": 0, "cache_misses": len(lines)}
+    vcf = "#CHROM\n" + "".join("{}\t{}\n".format(l.upper(), os.getpid()) for l in lines)
+    return {"vcf": vcf, "report": service.format_report(stats), "stats": stats}
+
+
+@pytest.fixture
+def conversion_service(tmpdir, monkeypatch):
+    monkeypatch.setattr(service, "_init_worker", fake_init_worker)
+    monkeypatch.setattr(service, "_convert", fake_convert)
+    monkeypatch.setitem(config["convert"], "parallel_min_lines", 10)
+    socket_path = str(tmpdir.join("conversion.sock"))
+    s = service.ConversionService(socket_path, 2)
+    thread = threading.Thread(target=s.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    s.shutdown()
+    s.server_close()
+
+
+def test_convert_with_service(tmpdir, conversion_service):
+    input = tmpdir.join("input.txt")
+    input.write("nm_000059.3:c.486_488delgag\n")
+    output = str(tmpdir.join("output.vcf"))
+    report = convert_with_service(str(input), output, socket_path=conversion_service)
+    assert report == "Number of lines successfully written: 1 (no errors)\nConversion cache hits: 0, misses: 1\n"
+    with open(output) as f:
+        assert f.read().split("\t")[0] == "#CHROM\nNM_000059.3:C.486_488DELGAG"
+
+
+def test_large_input_converted_in_parts(tmpdir, conversion_service):
+    hgvscs = ["NM_000059.3:c.{}A>G".format(i) for i in range(1, 26)]
+    input = tmpdir.join("input.txt")
+    input.write("\n".join(hgvscs) + "\n")
+    output = str(tmpdir.join("output.vcf"))
+    report = convert_with_service(str(input), output, socket_path=conversion_service)
+    assert report == "Number of lines successfully written: 25 (no errors)\nConversion cache hits: 0, misses: 25\n"
+    with open(output) as f:
+        lines = f.read().splitlines()
+    # One header, records in input order
+    assert lines[0] == "#CHROM"
+    assert [l.split("\t")[0] for l in lines[1:]] == [hgvsc.upper() for hgvsc in hgvscs]
+
+
+def test_socket_permissions(tmpdir, monkeypatch):
+    monkeypatch.setattr(service, "_init_worker", fake_init_worker)
+    group = grp.getgrgid(os.getgid()).gr_name
+    socket_path = str(tmpdir.join("run", "conversion.sock"))
+    s = service.ConversionService(socket_path, 1, group=group)
+    try:
+        # Not accessible to other users
+        assert stat.S_IMODE(os.stat(str(tmpdir.join("run"))).st_mode) == 0o750
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o660
+        assert os.stat(socket_path).st_gid == os.getgid()
+    finally:
+        s.server_close()
+    assert not os.path.exists(socket_path)
+
+
+def test_split_input():
+    lines = ["NM_000059.3:c.{}A>G\n".format(i) for i in range(5)]
+    assert service.split_input("".join(lines), 2, 10) == ["".join(lines)]
+    assert service.split_input("".join(lines), 2, 5) == ["".join(lines[:3]), "".join(lines[3:])]
+    # SeqPilot header in every part
+    header = "Transcript\tc. HGVS\n"
+    assert service.split_input(header + "".join(lines), 2, 5) == [
+        header + "".join(lines[:3]),
+        header + "".join(lines[3:]),
+    ]
+
+
+def test_merge_responses():
+    def response(records, errors):
+        stats = {"successful": len(records), "errors": errors}
+        return {"vcf": "##fileformat=VCFv4.1\n#CHROM\n" + "".join(records), "report": "", "stats": stats}
+
+    merged = service.merge_responses([response(["a\n"], {"HGVSError": 1}), response(["b\n", "c\n"], {"HGVSError": 2})])
+    assert merged["vcf"] == "##fileformat=VCFv4.1\n#CHROM\na\nb\nc\n"
+    assert merged["stats"] == {"successful": 3, "errors": {"HGVSError": 3}}
+    error = {"error": "failed", "type": "HGVSError"}
+    assert service.merge_responses([response(["a\n"], {}), error]) == error
+
+
+def test_convert_with_service_error(tmpdir, conversion_service):
+    input = tmpdir.join("input.txt")
+    input.write("invalid\n")
+    with pytest.raises(RuntimeError, match="HGVScInvalidVariantError: Unable to extract hgvsc from invalid"):
+        convert_with_service(str(input), str(tmpdir.join("output.vcf")), socket_path=conversion_service)
+
+
+def test_service_not_running(tmpdir):
+    input = tmpdir.join("input.txt")
+    input.write("NM_000059.3:c.486_488delGAG\n")
+    assert convert_with_service(str(input), str(tmpdir.join("output.vcf")), str(tmpdir.join("missing.sock"))) is None
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from conversion.conversion_utils import DeadlineDataProvider, TimeoutError, check_deadline, deadline
+
+
+class SlowDataProvider(object):
+    data_version = "uta_20210129"
+
+    def get_seq(self, ac, start_i=None, end_i=None):
+        time.sleep(0.05)
+        return "ACGT"
+
+
+def test_deadline():
+    check_deadline()
+    with deadline(0.05):
+        check_deadline()
+        time.sleep(0.1)
+        with pytest.raises(TimeoutError):
+            check_deadline()
+    # Reset when leaving the context
+    check_deadline()
+
+
+def test_nested_deadline():
+    with deadline(0.05):
+        # An inner deadline can not extend the outer deadline
+        with deadline(10):
+            time.sleep(0.1)
+            with pytest.raises(TimeoutError):
+                check_deadline()
+        with pytest.raises(TimeoutError):
+            check_deadline()
+
+
+def test_deadline_per_thread():
+    errors = []
+
+    def convert(timeout):
+        try:
+            with deadline(timeout):
+                time.sleep(0.1)
+                check_deadline()
+        except TimeoutError as e:
+            errors.append((timeout, e))
+
+    threads = [threading.Thread(target=convert, args=(timeout,)) for timeout in [0.05, 10]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [timeout for timeout, _ in errors] == [0.05]
+
+
+def test_deadline_data_provider():
+    hdp = DeadlineDataProvider(SlowDataProvider())
+    assert hdp.data_version == "uta_20210129"
+    assert hdp.get_seq("NC_000013.10") == "ACGT"
+    with deadline(0.12):
+        hdp.get_seq("NC_000013.10")
+        with pytest.raises(TimeoutError):
+            for _ in range(10):
+                hdp.get_seq("NC_000013.10")
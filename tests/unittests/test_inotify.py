@@ -0,0 +1,31 @@
+import os
+import threading
+
+import pytest
+
+from annotation import inotify
+
+
+pytestmark = pytest.mark.skipif(not inotify.available(), reason="inotify not available")
+
+
+def test_wait_for_existing_file(tmpdir):
+    open(os.path.join(str(tmpdir), "FAILED"), "w").close()
+    assert inotify.wait_for_files(str(tmpdir), ["SUCCESS", "FAILED"], timeout=1) == "FAILED"
+
+
+def test_wait_for_created_file(tmpdir):
+    path = str(tmpdir)
+    timer = threading.Timer(0.2, lambda: open(os.path.join(path, "SUCCESS"), "w").close())
+    timer.start()
+    timeouts = []
+    found = inotify.wait_for_files(path, ["SUCCESS", "FAILED"], timeout=5, on_timeout=lambda: timeouts.append(1))
+    assert found == "SUCCESS"
+    assert not timeouts
+
+
+def test_wait_for_removed_directory(tmpdir):
+    path = str(tmpdir.mkdir("task"))
+    timer = threading.Timer(0.2, lambda: os.rmdir(path))
+    timer.start()
+    assert inotify.wait_for_files(path, ["SUCCESS", "FAILED"], timeout=5) is None
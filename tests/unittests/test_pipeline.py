@@ -0,0 +1,284 @@
+import gzip
+import json
+import os
+import subprocess
+import time
+
+import pytest
+
+from annotation import pipeline as pipeline_module
+from annotation.pipeline import VCF, Pipeline, PipelineError, StatusFileSink, Step, TimingsSink, _fingerprint
+
+ANNOTATE_SH = os.path.join(os.path.dirname(__file__), "..", "..", "src", "annotation", "annotate.sh")
+
+
+def make_pipeline(tmpdir, resume=False, records="1\t1\n"):
+    work_dir = str(tmpdir.join("task"))
+    os.makedirs(work_dir, exist_ok=True)
+    input_vcf = str(tmpdir.join("input.vcf"))
+    with open(input_vcf, "w") as f:
+        f.write("#CHROM\tPOS\n" + records)
+    pipeline = Pipeline(
+        work_dir,
+        sinks=[
+            StatusFileSink(os.path.join(work_dir, "STATUS"), echo=False),
+            TimingsSink(os.path.join(work_dir, "timings.json")),
+        ],
+        resume=resume,
+    )
+    pipeline.add_artifact("input", VCF, input_vcf)
+    return pipeline
+
+
+def copy_step(name, input, output, extra=""):
+    return Step(
+        name,
+        command=lambda p: "{}cp {} {}".format(extra, p["vcf"], p[output]),
+        inputs={"vcf": (input, VCF)},
+        outputs={output: (VCF, "output.vcf")},
+    )
+
+
+def read_status(pipeline):
+    with open(os.path.join(pipeline.work_dir, "STATUS")) as f:
+        return [l.rstrip("\n").split("\t")[1:] for l in f]
+
+
+def test_run(tmpdir):
+    pipeline = make_pipeline(tmpdir)
+    pipeline.add(copy_step("A", "input", "a"))
+    pipeline.add(copy_step("B", "a", "b"))
+    assert pipeline.run()
+
+    assert read_status(pipeline) == [
+        ["STARTED", ""],
+        ["A", "STARTED"],
+        ["A", "DONE"],
+        ["B", "STARTED"],
+        ["B", "DONE"],
+    ]
+    for step in ["A", "B"]:
+        for f in ["SUCCESS", "cmd.sh", "output.vcf", "input.md5"]:
+            assert os.path.isfile(os.path.join(pipeline.work_dir, step, f))
+
+    with open(os.path.join(pipeline.work_dir, "timings.json")) as f:
+        timings = json.load(f)
+    assert list(timings) == ["A", "B"]
+    assert timings["A"]["state"] == "DONE"
+    assert timings["A"]["duration"] >= 0
+    assert timings["A"]["max_rss"] > 0
+
+
+def test_independent_steps_run_concurrently(tmpdir):
+    pipeline = make_pipeline(tmpdir)
+    # B and C both wait for each other's marker, and can only finish if run concurrently
+    marker = str(tmpdir.join("{}.started"))
+    wait = "touch {}; for i in $(seq 100); do [[ -f {} ]] && break; sleep 0.05; done; [[ -f {} ]]; "
+    pipeline.add(copy_step("A", "input", "a"))
+    for step, other in [("B", "C"), ("C", "B")]:
+        extra = wait.format(marker.format(step), marker.format(other), marker.format(other))
+        pipeline.add(copy_step(step, "a", step.lower(), extra=extra))
+    assert pipeline.run()
+
+
+def test_failed_step(tmpdir):
+    pipeline = make_pipeline(tmpdir)
+    pipeline.add(
+        Step(
+            "A",
+            command=lambda p: "echo 'something went wrong' > {}; exit 3".format(p["log"]),
+            inputs={"vcf": ("input", VCF)},
+            outputs={"a": (VCF, "output.vcf")},
+        )
+    )
+    pipeline.add(copy_step("B", "a", "b"))
+    assert not pipeline.run()
+
+    assert read_status(pipeline) == [["STARTED", ""], ["A", "STARTED"], ["A", "FAILED"]]
+    assert os.path.isfile(os.path.join(pipeline.work_dir, "A", "FAILED"))
+    assert not os.path.exists(os.path.join(pipeline.work_dir, "B"))
+    with open(os.path.join(pipeline.work_dir, "error.log")) as f:
+        assert f.read() == "something went wrong\n"
+    assert pipeline.results["A"].returncode == 3
+
+
+@pytest.mark.parametrize("ignore_term", [False, True])
+def test_failed_step_terminates_running_steps(tmpdir, monkeypatch, ignore_term):
+    monkeypatch.setattr(pipeline_module, "TERMINATE_GRACE_PERIOD", 0.5)
+    pipeline = make_pipeline(tmpdir)
+    marker = str(tmpdir.join("B.started"))
+    # A fails once B is running
+    pipeline.add(
+        Step(
+            "A",
+            command=lambda p: "for i in $(seq 100); do [[ -f {} ]] && break; sleep 0.05; done; exit 3".format(marker),
+            inputs={"vcf": ("input", VCF)},
+            outputs={"a": (VCF, "output.vcf")},
+        )
+    )
+    # B is killed after the grace period if it ignores SIGTERM
+    extra = "{}touch {}; sleep 60; ".format("trap '' TERM; " if ignore_term else "", marker)
+    pipeline.add(copy_step("B", "input", "b", extra=extra))
+    pipeline.add(copy_step("C", "b", "c"))
+    start = time.time()
+    assert not pipeline.run()
+    assert time.time() - start < 10
+
+    status = read_status(pipeline)
+    assert ["A", "FAILED"] in status
+    assert ["B", "CANCELLED"] in status
+    assert not any(name == "C" for name, _ in status)
+    assert os.path.isfile(os.path.join(pipeline.work_dir, "B", "FAILED"))
+    assert pipeline.results["B"].returncode == (-9 if ignore_term else -15)
+
+
+def test_missing_output_fails(tmpdir):
+    pipeline = make_pipeline(tmpdir)
+    pipeline.add(Step("A", command=lambda p: "true", inputs={"vcf": ("input", VCF)}, outputs={"a": (VCF, "out.vcf")}))
+    assert not pipeline.run()
+
+
+def test_resume(tmpdir):
+    pipeline = make_pipeline(tmpdir, resume=True)
+    pipeline.add(copy_step("A", "input", "a"))
+    assert pipeline.run()
+
+    os.unlink(os.path.join(pipeline.work_dir, "STATUS"))
+
+    pipeline = make_pipeline(tmpdir, resume=True)
+    pipeline.add(copy_step("A", "input", "a"))
+    assert pipeline.run()
+    assert read_status(pipeline) == [["STARTED", ""], ["A", "STARTED"], ["A", "SKIPPED"]]
+
+    # Changed input
+    os.unlink(os.path.join(pipeline.work_dir, "STATUS"))
+    pipeline = make_pipeline(tmpdir, resume=True, records="1\t2\n")
+    pipeline.add(copy_step("A", "input", "a"))
+    assert pipeline.run()
+    assert read_status(pipeline)[-1] == ["A", "DONE"]
+
+
+def test_resume_fingerprint(tmpdir, monkeypatch):
+    def run(mtime):
+        pipeline = make_pipeline(tmpdir, resume=True)
+        # make_pipeline writes the input again
+        os.utime(pipeline.artifacts["input"].path, ns=(mtime, mtime))
+        pipeline.add(copy_step("A", "input", "a"))
+        pipeline.add(copy_step("B", "a", "b"))
+        assert pipeline.run()
+        return read_status(pipeline)[-4:]
+
+    skipped = [["A", "STARTED"], ["A", "SKIPPED"], ["B", "STARTED"], ["B", "SKIPPED"]]
+    run(10**9)
+    checksums = []
+    checksum = pipeline_module._checksum
+    monkeypatch.setattr(pipeline_module, "_checksum", lambda files: checksums.append(files) or checksum(files))
+
+    # The checksum is not computed for unchanged inputs
+    assert run(10**9) == skipped
+    assert checksums == []
+
+    # Written again with the same content: skipped after comparing the checksum, and not compared again
+    assert run(2 * 10**9) == skipped
+    input = str(tmpdir.join("input.vcf"))
+    assert checksums == [[input]]
+    assert run(2 * 10**9) == skipped
+    assert checksums == [[input]]
+    with open(str(tmpdir.join("task", "A", "input.fingerprint"))) as f:
+        assert f.read() == "{}\t{}\t2.000000000\n".format(input, os.path.getsize(input))
+
+
+def test_resume_compressed_output(tmpdir):
+    pipeline = make_pipeline(tmpdir, resume=True)
+    pipeline.add(copy_step("A", "input", "a"))
+    pipeline.add(copy_step("B", "a", "b"))
+    assert pipeline.run()
+
+    # Step output compressed after the run (bgzip option)
+    output = pipeline.artifacts["a"].path
+    with open(output, "rb") as f, gzip.open(output + ".gz", "wb") as compressed:
+        compressed.write(f.read())
+    os.unlink(output)
+    os.unlink(os.path.join(pipeline.work_dir, "STATUS"))
+
+    pipeline = make_pipeline(tmpdir, resume=True)
+    pipeline.add(copy_step("A", "input", "a"))
+    pipeline.add(copy_step("B", "a", "b"))
+    assert pipeline.run()
+    assert read_status(pipeline)[1:] == [["A", "STARTED"], ["A", "SKIPPED"], ["B", "STARTED"], ["B", "SKIPPED"]]
+    assert os.path.isfile(output) and not os.path.exists(output + ".gz")
+
+
+def run_annotate_steps(tmpdir, resume):
+    """
+    Run steps A -> B -> C with the step functions of annotate.sh, B also depending on regions.bed (as SLICE)
+    """
+    with open(ANNOTATE_SH) as f:
+        script = f.read()
+    functions = script[script.index("### Reused functions") : script.index("### End reused functions")]
+    steps = """
+WORKDIR={work_dir}
+RESUME={resume}
+STATUS_FILE=${{WORKDIR}}/STATUS
+VCF={input}
+REGIONS={regions}
+mkdir -p ${{WORKDIR}}
+for STEP in A B C; do
+    handle_step_start ${{STEP}}
+    if [[ ${{STEP}} = B ]]; then INPUTS=("${{VCF}}" "${{REGIONS}}"); else INPUTS=("${{VCF}}"); fi
+    if step_is_done "${{INPUTS[@]}}"; then
+        handle_step_skipped
+    else
+        cat "${{INPUTS[@]}}" > ${{OUTPUT_VCF}}
+        handle_step_done
+    fi
+done
+""".format(
+        work_dir=tmpdir.join("task"),
+        resume=int(resume),
+        input=tmpdir.join("input.vcf"),
+        regions=tmpdir.join("regions.bed"),
+    )
+    status_file = str(tmpdir.join("task", "STATUS"))
+    if os.path.exists(status_file):
+        os.unlink(status_file)
+    subprocess.check_call(["bash", "-c", "set -e\n" + functions + steps], stdout=subprocess.DEVNULL)
+    with open(status_file) as f:
+        return [l.rstrip("\n").split("\t")[1:] for l in f]
+
+
+def test_annotate_sh_resume(tmpdir):
+    tmpdir.join("input.vcf").write("1\t1\n")
+    tmpdir.join("regions.bed").write("1\t0\t10\n")
+    done = [[step, mode] for step in "ABC" for mode in ["STARTED", "DONE"]]
+    skipped = [[step, mode] for step in "ABC" for mode in ["STARTED", "SKIPPED"]]
+    assert run_annotate_steps(tmpdir, resume=True) == done
+    assert run_annotate_steps(tmpdir, resume=True) == skipped
+
+    # Changed input of B: only B and the steps after it run again
+    tmpdir.join("regions.bed").write("1\t0\t20\n")
+    assert run_annotate_steps(tmpdir, resume=True) == skipped[:2] + done[2:]
+    with open(str(tmpdir.join("task", "C", "output.vcf"))) as f:
+        assert f.read() == "1\t1\n1\t0\t20\n"
+    # Same fingerprint as the Python engine
+    with open(str(tmpdir.join("task", "B", "input.fingerprint"))) as f:
+        inputs = [str(tmpdir.join("task", "A", "output.vcf")), str(tmpdir.join("regions.bed"))]
+        assert f.read() == _fingerprint(inputs) + "\n"
+
+    # Inputs written again with the same content are compared by checksum
+    tmpdir.join("input.vcf").write("1\t1\n")
+    assert run_annotate_steps(tmpdir, resume=True) == skipped
+
+    # Without --resume, every step runs
+    assert run_annotate_steps(tmpdir, resume=False) == done
+
+
+def test_typed_inputs(tmpdir):
+    pipeline = make_pipeline(tmpdir)
+    with pytest.raises(PipelineError):
+        pipeline.add(copy_step("A", "missing", "a"))
+    with pytest.raises(PipelineError):
+        pipeline.add(Step("A", command=lambda p: "true", inputs={"hgvsc": ("input", "hgvsc")}))
+    pipeline.add(copy_step("A", "input", "a"))
+    with pytest.raises(PipelineError):
+        pipeline.add(copy_step("B", "input", "a"))
@@ -0,0 +1,81 @@
+import io
+
+import pytest
+
+from annotation.remove_star_genotypes import remove_star_alleles, split_genotype, trim_values
+
+HEADER = """##fileformat=VCFv4.2
+##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2
+"""
+
+
+def run(records):
+    output = io.StringIO()
+    remove_star_alleles(io.StringIO(HEADER + "".join(r + "\n" for r in records)), output)
+    lines = output.getvalue().splitlines()
+    assert "\n".join(lines[: HEADER.count("\n")]) + "\n" == HEADER
+    return [l.split("\t") for l in lines[HEADER.count("\n") :]]
+
+
+def test_unchanged_records():
+    records = ["2\t10\t.\tA\tG\t.\t.\tAC=1\tGT:AD\t0/1:5,5\t0/0:10,0", "1\t5\t.\tA\tC,T\t.\t.\tAC=1,1\tGT\t1/2\t0/0"]
+    # Records are written in input order
+    assert run(records) == [r.split("\t") for r in records]
+
+
+def test_star_allele_removed():
+    [record] = run(["1\t5\t.\tA\tC,*\t.\t.\tAC=1,1;DP=20\tGT:AD:PL\t0/1:5,5,0:10,0,20,30,40,50\t2/0:4,0,6:1,2,3,4,5,6"])
+    assert record[4] == "C"
+    assert record[7] == "AC=1;DP=20"
+    assert record[9] == "0/1:5,5:10,0,20"
+    assert record[10] == "0/0:4,0:1,2,3"
+
+
+def test_unused_alleles_trimmed():
+    [record] = run(["1\t5\t.\tA\tC,*,T\t.\t.\tAC=0,1,1\tGT:AD:PL\t3|2:1,2,3,4:0,1,2,3,4,5,6,7,8,9\t./.:.:."])
+    assert record[4] == "T"
+    assert record[7] == "AC=1"
+    # Phased genotypes are not ordered
+    assert record[9] == "1|0:1,4:0,6,9"
+    assert record[10] == "./.:.:."
+
+
+def test_no_alt_remaining():
+    [record] = run(["1\t5\t.\tA\t*\t.\t.\tAC=1\tGT:AD\t0/1:5,5\t1/1:0,10"])
+    assert record[4] == "."
+    assert record[7] == "AC=."
+    assert record[9:] == ["0/0:5", "0/0:0"]
+
+
+def test_multidigit_allele_indexes():
+    alts = ",".join("ACGT"[i % 4] * (i // 4 + 2) for i in range(10)) + ",*"
+    [record] = run(["1\t5\t.\tA\t{}\t.\t.\t.\tGT\t11/10\t1/10".format(alts)])
+    assert record[4] == "AA,CCCC"
+    assert record[9:] == ["0/2", "1/2"]
+
+
+@pytest.mark.parametrize(
+    "gt,expected",
+    [
+        ("0/1", (["0", "1"], ["/"])),
+        ("1|2", (["1", "2"], ["|"])),
+        ("0/1|2", (["0", "1", "2"], ["/", "|"])),
+        (".", (["."], [])),
+    ],
+)
+def test_split_genotype(gt, expected):
+    assert split_genotype(gt) == expected
+
+
+def test_trim_values():
+    assert trim_values("1,2", "A", [0, 2], 2) == "2"
+    assert trim_values("1,2,3", "R", [0, 2], 2) == "1,3"
+    assert trim_values("0,1,2,3,4,5", "G", [0, 2], 2) == "0,3,5"
+    assert trim_values("0,1,2", "G", [0, 2], 1) == "0,2"
+    # Unexpected number of values
+    assert trim_values("1", "R", [0, 2], 2) == "1"
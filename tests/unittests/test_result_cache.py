@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from annotation.result_cache import ResultCache
+
+
+def write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+@pytest.fixture
+def files(tmpdir):
+    d = str(tmpdir)
+    return {
+        "input": write(os.path.join(d, "input.vcf"), "#CHROM\n1\t100\t.\tA\tC\n"),
+        "regions": write(os.path.join(d, "regions.bed"), "1\t0\t1000\n"),
+        "sources": write(os.path.join(d, "sources.json"), '{"vep": {"version": "1"}}'),
+        "output": write(os.path.join(d, "output.vcf"), "annotated"),
+        "original": write(os.path.join(d, "original.vcf"), "original"),
+        "cache": os.path.join(d, "cache"),
+    }
+
+
+def test_key(files):
+    cache = ResultCache(files["cache"], version_files=[files["sources"]])
+    key = cache.key(files["input"], "vcf", input_regions=files["regions"])
+    assert key == cache.key(files["input"], "vcf", input_regions=files["regions"])
+    assert key != cache.key(files["input"], "vcf")
+    assert key != cache.key(files["input"], "vcf", input_regions=files["regions"], convert_only=True)
+
+    # Data version changes invalidate the key
+    write(files["sources"], '{"vep": {"version": "2"}}')
+    assert key != cache.key(files["input"], "vcf", input_regions=files["regions"])
+
+
+def test_put_and_get(files):
+    cache = ResultCache(files["cache"])
+    key = cache.key(files["input"], "vcf")
+    assert cache.get(key) is None
+
+    entry = cache.put(key, files["output"], files["original"])
+    assert cache.get(key) == entry
+    with open(os.path.join(entry, ResultCache.OUTPUT_VCF)) as f:
+        assert f.read() == "annotated"
+    with open(os.path.join(entry, ResultCache.ORIGINAL_VCF)) as f:
+        assert f.read() == "original"
+
+
+def test_entry_not_shared_with_task(files):
+    cache = ResultCache(files["cache"])
+    entry = cache.put("key", files["output"], files["original"])
+    # The task rewrites its output (e.g. a restarted step), the entry is unchanged
+    write(files["output"], "rewritten")
+    assert os.access(files["output"], os.W_OK)
+    with open(os.path.join(entry, ResultCache.OUTPUT_VCF)) as f:
+        assert f.read() == "annotated"
+
+
+def test_evict_by_age(files):
+    cache = ResultCache(files["cache"], max_age=3600)
+    entry = cache.put("old", files["output"], files["original"])
+    os.utime(entry, (time.time() - 7200, time.time() - 7200))
+    cache.put("new", files["output"], files["original"])
+    assert cache.get("old") is None
+    assert cache.get("new") is not None
+
+
+def test_evict_by_size(files):
+    cache = ResultCache(files["cache"], max_size=len("annotated") + len("original"))
+    entry = cache.put("first", files["output"], files["original"])
+    os.utime(entry, (time.time() - 10, time.time() - 10))
+    cache.put("second", files["output"], files["original"])
+    assert cache.get("first") is None
+    assert cache.get("second") is not None
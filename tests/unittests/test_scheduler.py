@@ -0,0 +1,244 @@
+import importlib.util
+import threading
+
+import pytest
+
+import config
+from annotation.scheduler import Scheduler
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Tasks(object):
+    "Task functions that block until released, recording the order in which they started"
+
+    def __init__(self):
+        self.started = []
+        self.events = {}
+        self.lock = threading.Condition()
+
+    def __call__(self, id, cores):
+        with self.lock:
+            self.started.append((id, cores))
+            self.lock.notify_all()
+            event = self.events.setdefault(id, threading.Event())
+        event.wait(10)
+        return id
+
+    def wait_started(self, n):
+        with self.lock:
+            assert self.lock.wait_for(lambda: len(self.started) >= n, 10)
+        return self.started
+
+    def release(self, id):
+        with self.lock:
+            self.events.setdefault(id, threading.Event()).set()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def tasks():
+    tasks = Tasks()
+    yield tasks
+    for id in list(tasks.events):
+        tasks.release(id)
+
+
+def make_scheduler(clock, **kwargs):
+    options = dict(cores=8, memory=64.0, priority_cores=1, core_runtime=100.0, task_memory=2.0, memory_per_core=1.0)
+    options.update(kwargs)
+    return Scheduler(clock=clock, **options)
+
+
+def test_allocation(clock):
+    scheduler = make_scheduler(clock)
+    assert scheduler.allocation(10) == (1, 3.0)
+    assert scheduler.allocation(250) == (3, 5.0)
+    # Priority cores are held back from normal tasks
+    assert scheduler.allocation(10000) == (7, 9.0)
+    assert scheduler.allocation(10000, priority=True) == (8, 10.0)
+    # Memory is capped to the budget, so a task always fits on an idle host
+    assert make_scheduler(clock, memory=4.0).allocation(10000) == (7, 4.0)
+
+
+def test_concurrent_tasks(clock, tasks):
+    scheduler = make_scheduler(clock)
+    futures = [scheduler.submit(str(id), tasks, 10) for id in range(10)]
+    # 7 single core tasks fit, the last core is held back for priority tasks
+    assert len(tasks.wait_started(7)) == 7
+    stats = scheduler.stats()
+    assert stats["running"] == 7 and stats["queued"] == 3
+    assert stats["cores_used"] == 7 and stats["memory_used"] == 21.0
+
+    scheduler.submit("priority", tasks, 10, priority=True)
+    assert tasks.wait_started(8)[-1] == ("priority", 1)
+
+    tasks.release("priority")
+    tasks.release("0")
+    assert futures[0].result(10) == "0"
+    # Only one of the two released cores is available to normal tasks
+    assert tasks.wait_started(9)[-1] == ("7", 1)
+    assert scheduler.stats()["queued"] == 2
+
+
+def test_memory_budget(clock, tasks):
+    scheduler = make_scheduler(clock, memory=10.0)
+    for id in range(3):
+        scheduler.submit(str(id), tasks, 10)
+    # 3 GB per task
+    tasks.wait_started(3)
+    assert scheduler.stats()["running"] == 3
+    scheduler.submit("3", tasks, 10)
+    assert scheduler.stats()["queued"] == 1
+
+
+def test_shortest_job_first(clock, tasks):
+    scheduler = make_scheduler(clock, max_tasks=1)
+    scheduler.submit("first", tasks, 10)
+    tasks.wait_started(1)
+    scheduler.submit("long", tasks, 500)
+    scheduler.submit("short", tasks, 10)
+    assert [task["id"] for task in scheduler.stats()["queue"]] == ["short", "long"]
+
+    tasks.release("first")
+    assert tasks.wait_started(2)[-1] == ("short", 1)
+    tasks.release("short")
+    assert tasks.wait_started(3)[-1] == ("long", 5)
+
+
+def test_aging(clock, tasks):
+    scheduler = make_scheduler(clock, max_tasks=1, aging=2.0)
+    scheduler.submit("first", tasks, 10)
+    tasks.wait_started(1)
+    scheduler.submit("long", tasks, 500)
+    # The long task has waited 250s, and now goes before a new short task
+    clock.now = 250.0
+    scheduler.submit("short", tasks, 10)
+    assert [task["id"] for task in scheduler.stats()["queue"]] == ["long", "short"]
+    tasks.release("first")
+    assert tasks.wait_started(2)[-1] == ("long", 5)
+
+
+def test_no_overtaking(clock, tasks):
+    scheduler = make_scheduler(clock)
+    scheduler.submit("large", tasks, 500)
+    tasks.wait_started(1)
+    scheduler.submit("waiting", tasks, 500)
+    clock.now = 1000.0
+    # Fits, but would delay the waiting task, which has aged
+    scheduler.submit("small", tasks, 10)
+    assert scheduler.stats()["queued"] == 2
+    # Priority tasks may use the priority cores
+    scheduler.submit("priority", tasks, 10, priority=True)
+    assert tasks.wait_started(2)[-1] == ("priority", 1)
+
+    tasks.release("large")
+    assert [id for id, _ in tasks.wait_started(4)[2:]] == ["waiting", "small"]
+
+
+def test_cancel(clock, tasks):
+    scheduler = make_scheduler(clock, max_tasks=1)
+    scheduler.submit("first", tasks, 10)
+    tasks.wait_started(1)
+    future = scheduler.submit("queued", tasks, 10)
+    # Submitting a queued task again replaces it
+    replaced = scheduler.submit("queued", tasks, 10)
+    assert future.cancelled()
+    assert scheduler.stats()["queued"] == 1
+    scheduler.cancel("queued")
+    assert replaced.cancelled()
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_failed_task_releases_resources(clock):
+    def fail(id, cores):
+        raise RuntimeError("failed")
+
+    scheduler = make_scheduler(clock)
+    future = scheduler.submit("1", fail, 10)
+    with pytest.raises(RuntimeError):
+        future.result(10)
+    stats = scheduler.stats()
+    assert stats["running"] == 0 and stats["cores_used"] == 0
+
+
+def test_paused(clock, tasks):
+    scheduler = make_scheduler(clock, max_tasks=1)
+    clock.now = 1000.0
+    with scheduler.paused():
+        scheduler.submit("recent", tasks, 10)
+        # Queued before a restart, keeps its waiting time
+        scheduler.submit("old", tasks, 500, submitted=0.0)
+        assert scheduler.stats()["queued"] == 2
+    assert tasks.wait_started(1) == [("old", 5)]
+
+
+def load_config(monkeypatch, **environ):
+    "Config defaults for the environment, without replacing the config used by other modules"
+    for name in ["WORKERS", "SCHEDULER_MAX_TASKS", "SCHEDULER_PRIORITY_CORES"]:
+        monkeypatch.delenv(name, raising=False)
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("config_defaults", config.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.config["scheduler"]
+
+
+@pytest.mark.parametrize("workers", [None, "1"])
+def test_default_workers(clock, tasks, monkeypatch, workers):
+    environ = {"WORKERS": workers} if workers else {}
+    options = load_config(monkeypatch, **environ)
+    assert options["max_tasks"] == 1
+    options.update(cores=8, memory=64.0)
+    scheduler = Scheduler(clock=clock, **options)
+    # One normal task, and one priority task next to it
+    scheduler.submit("1", tasks, 10)
+    scheduler.submit("2", tasks, 10)
+    scheduler.submit("priority", tasks, 10, priority=True)
+    assert [id for id, _ in tasks.wait_started(2)] == ["1", "priority"]
+    assert scheduler.stats()["queued"] == 1
+
+    tasks.release("1")
+    assert tasks.wait_started(3)[-1][0] == "2"
+
+
+def test_max_tasks_counts_normal_tasks(clock, tasks):
+    scheduler = make_scheduler(clock, max_tasks=2)
+    for id in ["1", "2", "3"]:
+        scheduler.submit(id, tasks, 10)
+    tasks.wait_started(2)
+    # Not blocked by the normal tasks filling max_tasks
+    scheduler.submit("priority", tasks, 10, priority=True)
+    assert tasks.wait_started(3)[-1] == ("priority", 1)
+    assert scheduler.stats()["queued"] == 1
+
+
+def test_single_core_host(clock, tasks):
+    scheduler = make_scheduler(clock, cores=1, max_tasks=1)
+    # No core can be held back for priority tasks
+    assert scheduler.priority_cores == 0
+    scheduler.submit("1", tasks, 10)
+    tasks.wait_started(1)
+    scheduler.submit("2", tasks, 10)
+    scheduler.submit("priority", tasks, 10, priority=True)
+    # One priority task still runs next to the normal task
+    assert tasks.wait_started(2)[-1] == ("priority", 1)
+    scheduler.submit("priority2", tasks, 10, priority=True)
+    assert scheduler.stats()["queued"] == 2
+
+    tasks.release("priority")
+    assert tasks.wait_started(3)[-1] == ("priority2", 1)
+    tasks.release("priority2")
+    tasks.release("1")
+    assert tasks.wait_started(4)[-1] == ("2", 1)
@@ -0,0 +1,58 @@
+import sys
+
+import pytest
+
+from annotation.shard_vcf import run_sharded, split_vcf
+
+HEADER = ["##fileformat=VCFv4.1", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+RECORDS = ["{}\t{}\t.\tA\tC\t.\tPASS\t.".format(chrom, pos) for chrom in ["1", "2", "X"] for pos in range(100, 110)]
+
+
+def write_vcf(path, records):
+    with open(path, "w") as f:
+        f.write("\n".join(HEADER + records) + "\n")
+    return str(path)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [l.rstrip("\n") for l in f]
+
+
+@pytest.mark.parametrize("shards", [1, 3, 7, 100])
+def test_split_vcf(tmpdir, shards):
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), RECORDS)
+    shard_files = split_vcf(input_vcf, str(tmpdir.join("shards")), shards)
+    assert 1 <= len(shard_files) <= shards
+
+    records = []
+    for shard_file in shard_files:
+        lines = read_lines(shard_file)
+        assert lines[: len(HEADER)] == HEADER
+        assert len(lines) > len(HEADER)
+        records.extend(lines[len(HEADER) :])
+    assert records == RECORDS
+
+
+def test_split_empty_vcf(tmpdir):
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), [])
+    assert split_vcf(input_vcf, str(tmpdir.join("shards")), 4) == []
+
+
+@pytest.mark.parametrize("stdout", [False, True])
+def test_run_sharded(tmpdir, stdout):
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), RECORDS)
+    output_vcf = str(tmpdir.join("output.vcf"))
+    if stdout:
+        command = ["cat", "{input}"]
+    else:
+        command = [sys.executable, "-c", "import shutil, sys; shutil.copy(sys.argv[1], sys.argv[2])"]
+        command += ["{input}", "{output}"]
+    run_sharded(input_vcf, output_vcf, command, 4, 2, str(tmpdir.join("shards")), stdout=stdout)
+    assert read_lines(output_vcf) == HEADER + RECORDS
+
+
+def test_run_sharded_failure(tmpdir):
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), RECORDS)
+    with pytest.raises(RuntimeError):
+        run_sharded(input_vcf, str(tmpdir.join("output.vcf")), ["false"], 4, 4, str(tmpdir.join("shards")))
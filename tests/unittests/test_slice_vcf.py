@@ -0,0 +1,72 @@
+import io
+
+from annotation.slice_vcf import RegionIndex, block_end, slice_vcf
+
+HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def record(chrom, pos, ref, alt, info="."):
+    return "{}\t{}\t.\t{}\t{}\t.\tPASS\t{}\n".format(chrom, pos, ref, alt, info)
+
+
+def run(records, intervals):
+    output = io.StringIO()
+    slice_vcf(io.StringIO(HEADER + "".join(records)), RegionIndex(intervals), output)
+    assert output.getvalue().startswith(HEADER)
+    return output.getvalue()[len(HEADER) :].splitlines(True)
+
+
+def test_region_index():
+    regions = RegionIndex([("1", 100, 200), ("1", 150, 250), ("1", 300, 400), ("2", 10, 20)])
+    assert regions.starts["1"] == [100, 300]
+    assert regions.ends["1"] == [250, 400]
+    # 0-based, end exclusive
+    assert not regions.overlaps("1", 99, 100)
+    assert regions.overlaps("1", 99, 101)
+    assert regions.overlaps("1", 249, 250)
+    assert not regions.overlaps("1", 250, 300)
+    assert regions.overlaps("1", 200, 350)
+    assert not regions.overlaps("X", 100, 200)
+
+
+def test_slice():
+    records = [
+        record("1", 100, "A", "C"),
+        # Deletion spanning into the region
+        record("1", 148, "ACGT", "A"),
+        record("1", 160, "A", "C"),
+        record("1", 201, "A", "C"),
+        record("2", 160, "A", "C"),
+    ]
+    assert run(records, [("1", 150, 200)]) == records[1:3]
+
+
+def test_multiallelic_blocks():
+    block = "OLD_MULTIALLELIC=1:198:AC/A/AT"
+    other_block = "OLD_MULTIALLELIC=1:300:A/C/T"
+    records = [
+        # Left aligned record of the block, outside the region
+        record("1", 190, "CA", "C", block),
+        record("1", 195, "A", "C"),
+        record("1", 199, "C", "T", block),
+        record("1", 201, "A", "C"),
+        record("1", 300, "A", "C", other_block),
+        record("1", 300, "A", "T", other_block),
+    ]
+    assert run(records, [("1", 198, 199)]) == [records[0], records[2]]
+    assert run(records, [("1", 299, 300)]) == records[4:]
+    assert run(records, [("1", 194, 195), ("1", 299, 300)]) == [records[1]] + records[4:]
+
+
+def test_block_end():
+    assert block_end("OLD_MULTIALLELIC=1:198:AC/A/AT") == 200
+    assert block_end("OLD_MULTIALLELIC=HLA-A*01:01:01:01:5:A/C/T") == 6
+    assert block_end("OLD_MULTIALLELIC=invalid") is None
+
+
+def test_slice_file(tmpdir):
+    regions = tmpdir.join("regions.bed")
+    regions.write("track name=regions\n1\t150\t200\tgene\n")
+    index = RegionIndex.from_bed(str(regions))
+    assert index.overlaps("1", 150, 151)
+    assert not index.overlaps("1", 200, 201)
@@ -0,0 +1,87 @@
+import io
+import random
+import sys
+
+import pytest
+
+from annotation.sort_vcf import contig_key, is_sorted, sort_vcf
+
+HEADER = ["##fileformat=VCFv4.1", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO"]
+# In the order of `vcf-sort -c` (`sort -k1,1V`)
+CONTIGS = ["1", "2", "10", "GL000192.1", "GL000225.1", "MT", "X", "Y", "chr1", "chr2", "chr10", "hs37d5"]
+RECORDS = [
+    "{}\t{}\t.\t{}\tG\t.\tPASS\t.".format(chrom, pos, ref) for chrom in CONTIGS for pos in [5, 40, 300] for ref in "AC"
+]
+
+
+def write_vcf(path, records):
+    with open(path, "w") as f:
+        f.write("\n".join(HEADER + records) + "\n")
+    return str(path)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [l.rstrip("\n") for l in f]
+
+
+def test_contig_order():
+    assert sorted(reversed(CONTIGS), key=contig_key) == CONTIGS
+
+
+def test_sorted_input(tmpdir):
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), RECORDS)
+    assert sort_vcf(input_vcf, str(tmpdir.join("output.vcf")))
+    assert read_lines(tmpdir.join("output.vcf")) == HEADER + RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [100, 10**6])
+def test_unsorted_input(tmpdir, chunk_size):
+    records = RECORDS + RECORDS[:10]
+    random.Random(1).shuffle(records)
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), records)
+    assert not sort_vcf(input_vcf, str(tmpdir.join("output.vcf")), chunk_size=chunk_size, tmp_dir=str(tmpdir))
+    # Duplicates removed
+    assert read_lines(tmpdir.join("output.vcf")) == HEADER + RECORDS
+
+
+@pytest.mark.parametrize("output", ["-", "output.vcf"])
+@pytest.mark.parametrize("chunk_size", [100, 10**6])
+def test_unsorted_stdin(tmpdir, monkeypatch, capsys, output, chunk_size):
+    # Sorted up to the last record, which is out of order
+    records = RECORDS[1:] + RECORDS[:1]
+    monkeypatch.setattr(sys, "stdin", io.StringIO("\n".join(HEADER + records) + "\n"))
+    output_vcf = output if output == "-" else str(tmpdir.join(output))
+    assert not sort_vcf("-", output_vcf, chunk_size=chunk_size, tmp_dir=str(tmpdir))
+    out = capsys.readouterr().out
+    if output != "-":
+        assert out == ""
+        out = tmpdir.join(output).read()
+    assert out.split("\n") == HEADER + RECORDS + [""]
+    # No temporary files left
+    assert sorted(tmpdir.listdir()) == ([] if output == "-" else [tmpdir.join(output)])
+
+
+def test_sorted_stdin(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "stdin", io.StringIO("\n".join(HEADER + RECORDS)))
+    assert sort_vcf("-", "-", tmp_dir=str(tmpdir))
+    assert capsys.readouterr().out.split("\n") == HEADER + RECORDS + [""]
+
+
+def test_duplicates_removed_from_sorted_input(tmpdir):
+    records = [r for r in RECORDS for _ in range(2)]
+    input_vcf = write_vcf(tmpdir.join("input.vcf"), records)
+    assert sort_vcf(input_vcf, str(tmpdir.join("output.vcf")))
+    assert read_lines(tmpdir.join("output.vcf")) == HEADER + RECORDS
+
+
+def test_is_sorted():
+    lines = [l + "\n" for l in HEADER + RECORDS]
+    assert is_sorted(lines)
+    # Records on the same position are ordered by line
+    assert not is_sorted(lines[:2] + [lines[3], lines[2]])
+    assert not is_sorted(lines[:2] + ["2\t5\t.\tA\tG\t.\tPASS\t.\n", "1\t5\t.\tA\tG\t.\tPASS\t.\n"])
+    # Positions are compared as numbers
+    assert is_sorted(lines[:2] + ["1\t9\t.\tA\tG\t.\tPASS\t.\n", "1\t10\t.\tA\tG\t.\tPASS\t.\n"])
+    # Header lines after records
+    assert not is_sorted(lines + ["##INFO=<ID=X>\n"])
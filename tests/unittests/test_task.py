@@ -0,0 +1,204 @@
+import gzip
+import os
+import subprocess
+import time
+
+import pytest
+
+# annotation.task is imported through the api package (circular import with api.util)
+import api  # noqa: F401
+from annotation import task
+from annotation.registry import TaskRegistry
+from annotation.task import Task, _streamed_output, estimate_record_count, is_priority_runtime
+from config import config
+
+ID = "1"
+
+
+def status_line(name, mode):
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S") + ".000000"
+    return "\t".join([timestamp, name, mode]) + "\n"
+
+
+@pytest.fixture
+def task_dir(tmpdir, monkeypatch):
+    "Task folder of a running task, with a registry of its own"
+    monkeypatch.setitem(config, "work_folder", str(tmpdir))
+    registry = TaskRegistry(str(tmpdir.join("tasks.sqlite")), str(tmpdir))
+    monkeypatch.setattr(task, "_REGISTRY", registry)
+    registry.add(ID)
+    registry.set_state(ID, TaskRegistry.RUNNING)
+    path = str(tmpdir.join(ID))
+    os.makedirs(path)
+    return path
+
+
+def write_status(task_dir, *lines):
+    with open(os.path.join(task_dir, "STATUS"), "a") as f:
+        f.write("".join(lines))
+
+
+def write_output(task_dir, step, data):
+    os.makedirs(os.path.join(task_dir, step), exist_ok=True)
+    with open(os.path.join(task_dir, step, "output.vcf"), "a") as f:
+        f.write(data)
+
+
+def finish(task_dir, state, output=None):
+    if output is not None:
+        os.symlink(os.path.join(output, "output.vcf"), os.path.join(task_dir, "output.vcf"))
+    task.get_registry().set_state(ID, state)
+
+
+def test_streamed_output(task_dir):
+    assert _streamed_output(task_dir) is None
+    write_status(task_dir, status_line("STARTED", ""), status_line("VCFANNO", "STARTED"))
+    assert _streamed_output(task_dir) is None
+
+    write_output(task_dir, "VCFANNO", "#CHROM\n")
+    assert _streamed_output(task_dir) == os.path.join(task_dir, "VCFANNO", "output.vcf")
+
+    # Final step with the variant cache
+    write_status(task_dir, status_line("VARIANT_CACHE_SPLIT", "STARTED"))
+    assert _streamed_output(task_dir) is None
+    write_status(task_dir, status_line("VARIANT_CACHE_MERGE", "STARTED"))
+    write_output(task_dir, "VARIANT_CACHE_MERGE", "#CHROM\n")
+    assert _streamed_output(task_dir) == os.path.join(task_dir, "VARIANT_CACHE_MERGE", "output.vcf")
+
+
+def test_streamed_output_left_from_previous_run(task_dir):
+    write_output(task_dir, "VCFANNO", "#CHROM\n")
+    os.utime(os.path.join(task_dir, "VCFANNO", "output.vcf"), (time.time() - 60, time.time() - 60))
+    write_status(task_dir, status_line("VCFANNO", "STARTED"))
+    assert _streamed_output(task_dir) is None
+
+    # Skipped when resumed, the output is complete
+    write_status(task_dir, status_line("VCFANNO", "SKIPPED"))
+    assert _streamed_output(task_dir) == os.path.join(task_dir, "VCFANNO", "output.vcf")
+
+
+def test_stream_as_written(task_dir):
+    stream = Task.stream_result(ID, poll_interval=0.01)
+    write_status(task_dir, status_line("VCFANNO", "STARTED"))
+    write_output(task_dir, "VCFANNO", "#CHROM\n")
+    assert next(stream) == b"#CHROM\n"
+    write_output(task_dir, "VCFANNO", "1\t1")
+    assert next(stream) == b"1\t1"
+    write_output(task_dir, "VCFANNO", "00\n")
+    assert next(stream) == b"00\n"
+
+    finish(task_dir, TaskRegistry.SUCCESS, output=os.path.join(task_dir, "VCFANNO"))
+    assert list(stream) == [b"##ANNO_STATUS=SUCCESS\n"]
+
+
+def test_stream_finished_before_streaming(task_dir):
+    # E.g. conversion only: no final annotation step, output.vcf is sent when done
+    write_output(task_dir, "CONVERT", "#CHROM\n1\t100")
+    finish(task_dir, TaskRegistry.SUCCESS, output=os.path.join(task_dir, "CONVERT"))
+    assert b"".join(Task.stream_result(ID)) == b"#CHROM\n1\t100\n##ANNO_STATUS=SUCCESS\n"
+
+
+def test_stream_failed_task(task_dir):
+    stream = Task.stream_result(ID, poll_interval=0.01)
+    write_status(task_dir, status_line("VCFANNO", "STARTED"))
+    write_output(task_dir, "VCFANNO", "#CHROM\n1\t1")
+    assert next(stream) == b"#CHROM\n1\t1"
+    finish(task_dir, TaskRegistry.FAILED)
+    assert list(stream) == [b"\n", b"##ANNO_STATUS=FAILED\n"]
+
+    # Failed before the final step
+    assert b"".join(Task.stream_result(ID)) == b"##ANNO_STATUS=FAILED\n"
+
+
+def test_recover_kills_running_pipeline(task_dir, monkeypatch):
+    # Pipeline left running when only the API process was restarted
+    with open(os.path.join(task_dir, "cmd.sh"), "w") as f:
+        f.write("sleep 60\n")
+    pipeline = subprocess.Popen(["bash", os.path.join(task_dir, "cmd.sh")])
+    with open(os.path.join(task_dir, "PID"), "w") as f:
+        f.write(str(pipeline.pid))
+    for name in ["ACTIVE", "STATUS", "output.vcf"]:
+        open(os.path.join(task_dir, name), "w").close()
+
+    calls = []
+
+    def queue(id, priority, queued=None):
+        # The pipeline is stopped before the task is queued again
+        assert pipeline.wait(timeout=5) == -9
+        calls.append((id, priority, queued))
+
+    monkeypatch.setattr(Task, "queue", staticmethod(queue))
+    try:
+        Task.recover(ID, priority=True, queued=10.0)
+    finally:
+        if pipeline.poll() is None:
+            pipeline.kill()
+    assert calls == [(ID, True, 10.0)]
+    assert sorted(os.listdir(task_dir)) == ["cmd.sh"]
+    # Not cancelled
+    assert task.get_registry().get_state(ID) == TaskRegistry.RUNNING
+
+
+def test_recover_reused_pid(task_dir, monkeypatch):
+    # The PID of the task is now used by an unrelated process, which is not killed
+    other = subprocess.Popen(["sleep", "60"])
+    try:
+        with open(os.path.join(task_dir, "PID"), "w") as f:
+            f.write(str(other.pid))
+        monkeypatch.setattr(Task, "queue", staticmethod(lambda *args, **kwargs: None))
+        Task.recover(ID)
+        assert other.poll() is None
+        assert not os.path.exists(os.path.join(task_dir, "PID"))
+    finally:
+        other.kill()
+        other.wait()
+
+
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def write_records(path, header, records, compress=False):
+    data = (header + "".join("13\t{}\t.\tG\tA\t.\t.\t.\n".format(32890572 + i) for i in range(records))).encode()
+    if compress == "bgzf":
+        # Several gzip members, as BGZF
+        data = b"".join(gzip.compress(data[i : i + 10000]) for i in range(0, len(data), 10000))
+    elif compress:
+        data = gzip.compress(data)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.mark.parametrize("compress", [False, True, "bgzf"])
+def test_estimate_record_count(tmpdir, compress):
+    path = str(tmpdir.join("input.vcf"))
+    # Exact for small files
+    write_records(path, VCF_HEADER, 100, compress=compress)
+    assert estimate_record_count(path) == 100
+    assert estimate_record_count(write_records(path, VCF_HEADER, 0, compress=compress)) == 0
+
+    # Estimated from the records in the sample
+    write_records(path, VCF_HEADER * 100, 100000, compress=compress)
+    assert estimate_record_count(path, sample_size=10000) == pytest.approx(100000, rel=0.05)
+
+
+def test_estimate_record_count_hgvsc(tmpdir):
+    path = str(tmpdir.join("input.txt"))
+    with open(path, "w") as f:
+        f.write("NM_000059.3:c.1A>G (het)\n\nNM_007294.3(BRCA1):c.3339_3341del\nNM_000059.3:c.2A>G")
+    assert estimate_record_count(path) == 3
+
+
+def test_priority_threshold(monkeypatch):
+    monkeypatch.setitem(
+        config,
+        "priority",
+        {"max_runtime": 60, "task_seconds": 20, "vep_seconds_per_variant": 0.04, "conversion_seconds_per_hgvsc": 0.36},
+    )
+    assert is_priority_runtime(Task.estimate_runtime(1000, "vcf"))
+    assert not is_priority_runtime(Task.estimate_runtime(1001, "vcf"))
+    assert is_priority_runtime(Task.estimate_runtime(100, "hgvsc"))
+    assert not is_priority_runtime(Task.estimate_runtime(101, "hgvsc"))
+    # No annotation cost when only converting, and no cost at all for cached results
+    assert is_priority_runtime(Task.estimate_runtime(110, "hgvsc", convert_only=True))
+    assert is_priority_runtime(Task.estimate_runtime(10**6, "vcf", cached=True))
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+
+import pytest
+
+from annotation.registry import TaskRegistry, read_last_status
+
+
+@pytest.fixture
+def work_folder(tmpdir):
+    return str(tmpdir.mkdir("work"))
+
+
+def create_task_folder(work_folder, id, markers=(), status=None):
+    task_dir = os.path.join(work_folder, id)
+    os.mkdir(task_dir)
+    for marker in markers:
+        open(os.path.join(task_dir, marker), "w").close()
+    if status:
+        with open(os.path.join(task_dir, "STATUS"), "w") as f:
+            for line in status:
+                f.write(line + "\n")
+    return task_dir
+
+
+def test_import_existing_folders(work_folder):
+    create_task_folder(work_folder, "100", ["SUCCESS"], ["ts\tQUEUED\t", "ts\tFINALIZED\t"])
+    create_task_folder(work_folder, "200", ["FAILED"], ["ts\tQUEUED\t", "ts\tVEP\tFAILED"])
+    create_task_folder(work_folder, "300", ["ACTIVE"], ["ts\tQUEUED\t"])
+    create_task_folder(work_folder, "400")
+
+    registry = TaskRegistry(os.path.join(work_folder, "tasks.sqlite"), work_folder)
+
+    assert registry.get_ids() == ["100", "200", "300", "400"]
+    assert registry.get_ids(TaskRegistry.ACTIVE_STATES) == ["300", "400"]
+    assert registry.get_state("100") == TaskRegistry.SUCCESS
+    assert registry.get_state("200") == TaskRegistry.FAILED
+    assert registry.get("100")["step"] == "FINALIZED"
+    assert registry.get("200")["step"] == "VEP FAILED"
+    assert registry.count_by_state() == {
+        TaskRegistry.SUCCESS: 1,
+        TaskRegistry.FAILED: 1,
+        TaskRegistry.QUEUED: 1,
+        TaskRegistry.CREATED: 1,
+    }
+
+
+def test_interrupted_import_is_retried(work_folder, monkeypatch):
+    create_task_folder(work_folder, "100", ["SUCCESS"])
+    create_task_folder(work_folder, "200", ["FAILED"])
+    path = os.path.join(work_folder, "tasks.sqlite")
+
+    def interrupted_import(self, id):
+        raise KeyboardInterrupt()
+
+    with monkeypatch.context() as m:
+        m.setattr(TaskRegistry, "import_task_folder", interrupted_import)
+        with pytest.raises(KeyboardInterrupt):
+            TaskRegistry(path, work_folder)
+    assert os.path.isfile(path)
+
+    registry = TaskRegistry(path, work_folder)
+    assert registry.get_ids() == ["100", "200"]
+    assert registry.get_meta("imported") is not None
+
+
+def test_task_lifecycle(work_folder):
+    registry = TaskRegistry(os.path.join(work_folder, "tasks.sqlite"), work_folder)
+    create_task_folder(work_folder, "1")
+    registry.add("1", priority=True)
+    assert registry.get_state("1") == TaskRegistry.CREATED
+
+    registry.set_state("1", TaskRegistry.QUEUED, step="QUEUED")
+    registry.set_state("1", TaskRegistry.RUNNING)
+    assert registry.get("1")["started"] is not None
+    assert registry.get_ids(TaskRegistry.ACTIVE_STATES) == ["1"]
+
+    registry.set_state("1", TaskRegistry.SUCCESS, step="FINALIZED")
+    task = registry.get("1")
+    assert task["state"] == TaskRegistry.SUCCESS
+    assert task["step"] == "FINALIZED"
+    assert task["finished"] >= task["started"]
+    assert registry.get_ids(TaskRegistry.ACTIVE_STATES) == []
+
+    registry.remove("1")
+    assert registry.get("1") is None
+
+
+def test_estimated_runtime_column_added_to_existing_registry(work_folder):
+    path = os.path.join(work_folder, "tasks.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE task (id TEXT PRIMARY KEY, state TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+        "created REAL NOT NULL, started REAL, finished REAL, updated REAL NOT NULL, step TEXT)"
+    )
+    conn.execute("INSERT INTO task (id, state, created, updated) VALUES ('1', 'QUEUED', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    registry = TaskRegistry(path, work_folder)
+    assert registry.get("1")["estimated_runtime"] is None
+    registry.add("2", estimated_runtime=12.5)
+    assert registry.get("2")["estimated_runtime"] == 12.5
+
+
+def test_queue_order(work_folder):
+    registry = TaskRegistry(os.path.join(work_folder, "tasks.sqlite"), work_folder)
+    for id in ["1", "2", "3", "4"]:
+        registry.add(id)
+    registry.queue("3", queued=10.0)
+    registry.queue("1", priority=True, queued=20.0)
+    registry.queue("2", queued=30.0)
+    registry.set_state("2", TaskRegistry.RUNNING)
+    registry.set_state("4", TaskRegistry.SUCCESS)
+    queue = registry.get_queue()
+    assert [task["id"] for task in queue] == ["3", "1", "2"]
+    assert [task["priority"] for task in queue] == [0, 1, 0]
+
+    # Queued again (restarted), keeps its place
+    registry.queue("2", queued=queue[2]["queued"])
+    task = registry.get("2")
+    assert task["state"] == TaskRegistry.QUEUED and task["queued"] == 30.0
+    assert task["started"] is None
+
+
+def test_unregistered_folder_is_imported_on_access(work_folder):
+    registry = TaskRegistry(os.path.join(work_folder, "tasks.sqlite"), work_folder)
+    create_task_folder(work_folder, "5", ["SUCCESS"])
+    assert registry.get("5") is None
+    assert registry.get_state("5") == TaskRegistry.SUCCESS
+    assert registry.get_state("6") is None
+
+
+def test_read_last_status(work_folder):
+    task_dir = create_task_folder(work_folder, "1", status=["ts\tQUEUED\t", "ts\tSTARTED\t", "ts\tVEP\tSTARTED"])
+    assert read_last_status(os.path.join(task_dir, "STATUS")) == "VEP STARTED"
+    assert read_last_status(os.path.join(task_dir, "MISSING")) is None
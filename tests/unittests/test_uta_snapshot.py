@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+from conversion.uta_snapshot import INDEXES, SCHEMA, UTASnapshot
+
+# NM_000059.3 (BRCA2), first three exons aligned to chromosome 13 of GRCh37
+EXONS = [
+    ("NM_000059.3", "NC_000013.10", "splign", 1, 0, 0, 300, 32889616, 32889916, "300="),
+    ("NM_000059.3", "NC_000013.10", "splign", 1, 1, 300, 400, 32890558, 32890658, "100="),
+    ("NM_000059.3", "NC_000013.10", "splign", 1, 2, 400, 509, 32893213, 32893322, "109="),
+    ("NM_000059.3", "NC_000013.10", "blat", 1, 0, 0, 300, 32889616, 32889916, "300="),
+    ("NM_000492.3", "NC_000007.13", "splign", 1, 0, 0, 185, 117120016, 117120201, "185="),
+]
+
+
+@pytest.fixture
+def snapshot(tmpdir):
+    path = str(tmpdir.join("uta.sqlite"))
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany(
+        "INSERT INTO meta VALUES (?, ?)",
+        [("data_version", "uta_20210129"), ("schema_version", "1.1"), ("assemblies", "GRCh37")],
+    )
+    conn.executemany(
+        "INSERT INTO transcript VALUES (?, ?, ?, ?, ?)",
+        [("NM_000059.3", "BRCA2", 227, 10485, "300,100,109"), ("NM_000492.3", "CFTR", 132, 4572, None)],
+    )
+    conn.executemany("INSERT INTO exon VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", EXONS)
+    conn.execute("INSERT INTO gene VALUES ('BRCA2', '13q12.3', 'breast cancer 2', '', 'FACD,FANCD1', NULL)")
+    conn.execute("INSERT INTO associated_accessions VALUES ('NM_000059.3', 'NP_000050.2', 'NCBI')")
+    conn.executescript(INDEXES)
+    conn.commit()
+    conn.close()
+    snapshot = UTASnapshot(path)
+    yield snapshot
+    snapshot.close()
+
+
+def test_versions(snapshot):
+    assert snapshot.data_version() == "uta_20210129"
+    assert snapshot.schema_version() == "1.1"
+
+
+def test_tx_exons(snapshot):
+    exons = snapshot.get_tx_exons("NM_000059.3", "NC_000013.10", "splign")
+    assert [e["ord"] for e in exons] == [0, 1, 2]
+    assert exons[0]["hgnc"] == "BRCA2"
+    assert exons[0]["alt_strand"] == 1
+    assert exons[2]["alt_end_i"] == 32893322
+    # Accessible by index, like the rows of the UTA data provider
+    assert exons[0][1] == "NM_000059.3"
+    assert snapshot.get_tx_exons("NM_000059.3", "NC_000013.10", "genebuild") is None
+
+
+def test_tx_info(snapshot):
+    info = snapshot.get_tx_info("NM_000059.3", "NC_000013.10", "splign")
+    assert (info["hgnc"], info["cds_start_i"], info["cds_end_i"]) == ("BRCA2", 227, 10485)
+    assert snapshot.get_tx_info("NM_000059.3", "NC_000007.13", "splign") is None
+
+
+def test_tx_identity_info(snapshot):
+    info = snapshot.get_tx_identity_info("NM_000059.3")
+    assert info["lengths"] == [300, 100, 109]
+    assert info["alt_aln_method"] == "transcript"
+    assert snapshot.get_tx_identity_info("NM_000492.3") is None
+
+
+def test_tx_mapping_options(snapshot):
+    options = snapshot.get_tx_mapping_options("NM_000059.3")
+    assert [(o["alt_ac"], o["alt_aln_method"]) for o in options] == [
+        ("NC_000013.10", "blat"),
+        ("NC_000013.10", "splign"),
+    ]
+
+
+def test_tx_for_region(snapshot):
+    txs = snapshot.get_tx_for_region("NC_000013.10", "splign", 32890000, 32890600)
+    assert [(t["tx_ac"], t["start_i"], t["end_i"]) for t in txs] == [("NM_000059.3", 32889616, 32893322)]
+    assert snapshot.get_tx_for_region("NC_000013.10", "splign", 32893323, 32900000) == []
+
+
+def test_tx_for_gene(snapshot):
+    txs = snapshot.get_tx_for_gene("BRCA2")
+    assert [(t["tx_ac"], t["alt_aln_method"]) for t in txs] == [
+        ("NM_000059.3", "blat"),
+        ("NM_000059.3", "splign"),
+    ]
+
+
+def test_gene_info(snapshot):
+    assert snapshot.get_gene_info("BRCA2")["aliases"] == ["FACD", "FANCD1"]
+    assert snapshot.get_gene_info("CFTR") is None
+    assert snapshot.get_pro_ac_for_tx_ac("NM_000059.3") == "NP_000050.2"
+
+
+def test_missing_snapshot(tmpdir):
+    with pytest.raises(IOError):
+        UTASnapshot(str(tmpdir.join("missing.sqlite")))
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from api.util import util
+from api.util.util import SpooledFile, detect_type, extract_data, iter_genomic_to_vcf, iter_lines
+
+VCF = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n13\t32890572\t.\tG\tA\t.\t.\t.\n"
+SEQPILOT = "Sample\tTranscript\tc. HGVS\nS1\tNM_000059.3\tc.1A>G\n"
+GENOMIC = "13-32890572-G-A (het)\n17-41276045-CT-C (homo)\n13-32890573-G-A\n"
+HGVSC = "NM_000059.3:c.1A>G\nNM_007294.3(BRCA1):c.3339_3341del (het)\n"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        "a\nb",
+        "\n\n  a\nb  \n\n",
+        "a\n\nb\n \n\t\nc\n\n",
+        "a \n\t\nb\t\n \n",
+        "a\r\nb\r\n",
+        "",
+        " \n\n",
+    ],
+)
+def test_iter_lines(data):
+    # Same lines as before iter_lines
+    assert list(iter_lines(data)) == data.strip().split("\n")
+    assert list(iter_lines(io.StringIO(data))) == data.strip().split("\n")
+
+
+@pytest.mark.parametrize(
+    "data,type", [(VCF, "vcf"), (SEQPILOT, "seqpilot"), (GENOMIC, "genomic"), (HGVSC, "hgvsc"), ("foo\nbar", None)]
+)
+def test_detect_type(data, type):
+    assert detect_type(iter_lines(data)) == type
+
+
+def test_detect_type_from_head(monkeypatch):
+    monkeypatch.setattr(util, "DETECT_LINES", 3)
+    # Lines after the head are not read
+    assert detect_type(iter_lines(GENOMIC + "foo\n")) == "genomic"
+    assert detect_type(iter_lines(HGVSC + "NM_000059.3:c.2A>G\n13-32890572-G-A\n")) == "hgvsc"
+    # The vcf header is read until #CHROM
+    assert detect_type(iter_lines("##comment\n" * 10 + VCF)) == "vcf"
+
+
+@pytest.mark.parametrize("spooled", [False, True])
+def test_mismatch_after_head(tmpdir, monkeypatch, spooled):
+    monkeypatch.setattr(util, "DETECT_LINES", 3)
+    data = GENOMIC + "NM_000059.3:c.1A>G\n"
+    if spooled:
+        tmpdir.join("upload").write(data)
+        data = SpooledFile(str(tmpdir.join("upload")))
+    with pytest.raises(RuntimeError) as e:
+        extract_data(data)
+    assert str(e.value) == (
+        "Unable to determine input type (vcf, seqpilot, genomic, or hgvsc). "
+        "Not genomic: NM_000059.3:c.1A>G. Not hgvsc: 13-32890572-G-A (het)."
+    )
+
+
+def test_iter_genomic_to_vcf():
+    assert list(iter_genomic_to_vcf(iter_lines(GENOMIC))) == [
+        "##fileformat=VCFv4.2",
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE",
+        "13\t32890572\t.\tG\tA\t.\tPASS\t.\tGT\t0/1",
+        "17\t41276045\t.\tCT\tC\t.\tPASS\t.\tGT\t1/1",
+        "13\t32890573\t.\tG\tA\t.\tPASS\t.\t.\t.",
+    ]
+    with pytest.raises(ValueError, match="Not genomic: foo"):
+        list(iter_genomic_to_vcf(["13-32890572-G-A", "foo"]))
+
+
+@pytest.mark.parametrize(
+    "data,error",
+    [
+        (GENOMIC.replace("\n", "\n\n", 1), "Not genomic: . Not hgvsc: 13-32890572-G-A (het)."),
+        ("", "Not genomic or hgvsc: ."),
+        ("\n \n", "Not genomic or hgvsc: ."),
+    ],
+)
+def test_blank_lines(data, error):
+    # Inner blank lines, and empty input, are not valid, as before iter_lines
+    with pytest.raises(RuntimeError) as e:
+        extract_data(data)
+    assert str(e.value).endswith(error)
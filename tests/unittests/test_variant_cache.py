@@ -0,0 +1,75 @@
+import os
+
+from annotation.variant_cache import VariantCache
+
+HEADER = [
+    "##fileformat=VCFv4.1",
+    '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE",
+]
+ANNOTATION_HEADER = ['##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence">', "##VEP=v1"]
+RECORDS = [
+    "1\t100\t.\tA\tC\t.\tPASS\tDP=10\tGT\t0/1",
+    "1\t200\t.\tG\tT,C\t.\tPASS\tDP=5\tGT\t1/2",
+    "2\t300\t.\tT\tTA\t.\tPASS\t.\tGT\t1/1",
+]
+
+
+def write_vcf(path, header, records):
+    with open(path, "w") as f:
+        f.write("\n".join(header + records) + "\n")
+    return path
+
+
+def read_records(path):
+    with open(path) as f:
+        return [l.rstrip("\n") for l in f if not l.startswith("#")]
+
+
+def annotate(input_vcf, output_vcf):
+    "Fake annotation, adding a CSQ field to all records"
+    records = []
+    for line in read_records(input_vcf):
+        columns = line.split("\t")
+        csq = "CSQ={}_{}".format(columns[1], columns[4])
+        columns[7] = csq if columns[7] == "." else columns[7] + ";" + csq
+        records.append("\t".join(columns))
+    return write_vcf(output_vcf, HEADER[:2] + ANNOTATION_HEADER + HEADER[2:], records)
+
+
+def run(cache, tmpdir, name):
+    d = str(tmpdir.mkdir(name))
+    input_vcf = write_vcf(os.path.join(d, "input.vcf"), HEADER, RECORDS)
+    cached = os.path.join(d, "cached.vcf")
+    uncached = os.path.join(d, "uncached.vcf")
+    cache.split(input_vcf, cached, uncached)
+    annotated = annotate(uncached, os.path.join(d, "annotated.vcf"))
+    output = os.path.join(d, "output.vcf")
+    cache.merge(input_vcf, cached, annotated, output)
+    return uncached, output
+
+
+def test_split_and_merge(tmpdir):
+    cache_dir = str(tmpdir.mkdir("cache"))
+
+    cache = VariantCache(cache_dir, "v1")
+    uncached, output = run(cache, tmpdir, "first")
+    assert cache.hits == 0
+    assert read_records(uncached) == RECORDS
+    expected = read_records(output)
+    assert expected[0] == "1\t100\t.\tA\tC\t.\tPASS\tDP=10;CSQ=100_C\tGT\t0/1"
+
+    # Biallelic records are now cached, the multiallelic record is always annotated
+    cache = VariantCache(cache_dir, "v1")
+    uncached, output = run(cache, tmpdir, "second")
+    assert cache.hits == 2
+    assert read_records(uncached) == [RECORDS[1]]
+    assert read_records(output) == expected
+    with open(output) as f:
+        assert "##VEP=v1\n" in f.read()
+
+    # New data version invalidates the cache
+    cache = VariantCache(cache_dir, "v2")
+    uncached, output = run(cache, tmpdir, "third")
+    assert cache.hits == 0
+    assert os.listdir(cache_dir) == ["variants_v2.sqlite"]
@@ -0,0 +1,67 @@
+import os
+
+from annotation.vcf_index import VcfIndex, get_index, index_path
+
+HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+def record(chrom, pos, ref="A", alt="C"):
+    return "{}\t{}\t.\t{}\t{}\t.\tPASS\t.\n".format(chrom, pos, ref, alt)
+
+
+RECORDS = [
+    record("1", 10),
+    # Deletion spanning several windows
+    record("1", 90, "A" * 50),
+    record("1", 100),
+    record("1", 250),
+    record("2", 5),
+    record("2", 1000),
+    record("X", 300),
+]
+
+
+def write_vcf(tmpdir, records=RECORDS):
+    path = str(tmpdir.join("output.vcf"))
+    with open(path, "w") as f:
+        f.write(HEADER + "".join(records))
+    return path
+
+
+def query(index, path, *regions):
+    with open(path, "rb") as f:
+        return [l.decode() for l in index.query_regions(f, regions)]
+
+
+def test_query(tmpdir):
+    path = write_vcf(tmpdir)
+    index = VcfIndex.build(path, window_size=16)
+    with open(path, "rb") as f:
+        assert index.header(f).decode() == HEADER
+    assert query(index, path, ("1", 100, 100)) == RECORDS[1:3]
+    assert query(index, path, ("1", 139, 139)) == [RECORDS[1]]
+    assert query(index, path, ("1", 140, 249)) == []
+    assert query(index, path, ("1", 200, 10000)) == [RECORDS[3]]
+    assert query(index, path, ("2", 1, 2000)) == RECORDS[4:6]
+    assert query(index, path, ("X", 300, 300)) == [RECORDS[6]]
+    assert query(index, path, ("Y", 1, 1000)) == []
+
+
+def test_query_regions(tmpdir):
+    path = write_vcf(tmpdir)
+    index = VcfIndex.build(path, window_size=16)
+    # File order, records overlapping several regions once
+    assert query(index, path, ("2", 1000, 1000), ("1", 95, 100), ("1", 1, 90)) == RECORDS[:3] + [RECORDS[5]]
+
+
+def test_get_index(tmpdir):
+    path = write_vcf(tmpdir)
+    index = get_index(path)
+    assert os.path.isfile(index_path(path))
+    assert VcfIndex.load(index_path(path)).contigs == index.contigs
+    assert query(get_index(path), path, ("1", 250, 250)) == [RECORDS[3]]
+
+    # Rebuilt when the vcf changed
+    write_vcf(tmpdir, RECORDS[:3])
+    os.utime(path, (0, 0))
+    assert query(get_index(path), path, ("1", 250, 250)) == []